@@ -19,6 +19,22 @@ def create_app(config_class=Config):
     login_manager.login_view = 'auth.login'
     login_manager.login_message = 'Please log in to access this page.'
     
+    from app import instrumentation, metrics, profiling, cache, storage, previews, text_index, media_rollup, commitments, hierarchy, counters, invoice_analytics, status_analytics, changelog
+    instrumentation.init_app(app, db)
+    metrics.init_app(app)
+    profiling.init_app(app)
+    cache.init_app(app)
+    storage.init_app(app)
+    previews.init_app(app)
+    text_index.init_app(app)
+    media_rollup.init_app(app)
+    commitments.init_app(app)
+    hierarchy.init_app(app)
+    counters.init_app(app)
+    invoice_analytics.init_app(app)
+    status_analytics.init_app(app)
+    changelog.init_app(app)
+    
     from app.auth import bp as auth_bp
     app.register_blueprint(auth_bp, url_prefix='/auth')
     
@@ -31,4 +47,10 @@ def create_app(config_class=Config):
     from app.dashboard import bp as dashboard_bp
     app.register_blueprint(dashboard_bp, url_prefix='/')
     
+    from app.admin import bp as admin_bp
+    app.register_blueprint(admin_bp, url_prefix='/admin')
+    
+    from app.api import bp as api_bp
+    app.register_blueprint(api_bp, url_prefix='/api/v1')
+    
     return app
\ No newline at end of file
@@ -0,0 +1,55 @@
+import json
+import os
+from flask import render_template, current_app, abort, Response, send_from_directory
+from app.admin import bp
+from app.auth.decorators import admin_required
+from app.profiling import list_profiles, read_collapsed, top_functions, to_speedscope
+
+
+def _profile_or_404(name):
+    profile = next((p for p in list_profiles(current_app.config['PROFILE_DIR']) if p['name'] == name), None)
+    if profile is None:
+        abort(404)
+    return profile
+
+
+@bp.route('/profiles')
+@admin_required
+def profiles():
+    profiles = list_profiles(current_app.config['PROFILE_DIR'])
+    return render_template('admin/profiles.html', profiles=profiles)
+
+
+@bp.route('/profiles/<name>')
+@admin_required
+def profile_detail(name):
+    profile = _profile_or_404(name)
+    stacks = read_collapsed(os.path.join(current_app.config['PROFILE_DIR'], name))
+    total_samples = sum(count for _, count in stacks)
+    hottest_stacks = sorted(stacks, key=lambda s: s[1], reverse=True)[:20]
+    return render_template('admin/profile_detail.html', profile=profile,
+                           functions=top_functions(stacks), hottest_stacks=hottest_stacks,
+                           total_samples=total_samples)
+
+
+@bp.route('/profiles/<name>/collapsed')
+@admin_required
+def download_collapsed(name):
+    _profile_or_404(name)
+    return send_from_directory(current_app.config['PROFILE_DIR'], name,
+                               mimetype='text/plain', as_attachment=True)
+
+
+@bp.route('/profiles/<name>/speedscope')
+@admin_required
+def download_speedscope(name):
+    profile = _profile_or_404(name)
+    stacks = read_collapsed(os.path.join(current_app.config['PROFILE_DIR'], name))
+    data = to_speedscope(f"{profile['endpoint']} {profile['captured_at']:%Y-%m-%d %H:%M:%S}",
+                         stacks, current_app.config['PROFILE_INTERVAL_MS'])
+    download_name = name[:-len('.collapsed')] + '.speedscope.json'
+    return Response(
+        json.dumps(data),
+        mimetype='application/json',
+        headers={'Content-Disposition': f'attachment; filename={download_name}'}
+    )
@@ -0,0 +1,134 @@
+"""Models exposed by the JSON API and how their rows are read and written.
+
+Every resource exposes all columns of its model. Primary keys, timestamps,
+authors and the counters kept by ``app.counters`` are read-only; the author
+of new rows is the logged-in user. Includes are relationships to other
+resources, loaded with one ``selectinload`` per include and page.
+"""
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import inspect, select
+from sqlalchemy.orm import RelationshipDirection
+from app import db
+from app.models import Company, Brand, ClientContact, StatusUpdate, Invoice, MediaPlan, BrandTask
+from app.status_analytics import EVALUATIONS
+
+# Set by the app rather than by clients, on every model that has them
+SERVER_COLUMNS = ('id', 'created_at', 'updated_at', 'created_by_id')
+
+
+class ValidationError(ValueError):
+    def __init__(self, field, message):
+        super().__init__(message)
+        self.field = field
+
+
+class Resource:
+    def __init__(self, name, model, includes=None, read_only=(), choices=None):
+        self.name = name
+        self.model = model
+        mapper = inspect(model)
+        self.columns = {attr.key: attr.columns[0] for attr in mapper.column_attrs}
+        self.fields = tuple(self.columns)
+        self.writable = tuple(key for key in self.fields if key not in SERVER_COLUMNS + tuple(read_only))
+        self.required = tuple(key for key in self.writable
+                              if not self.columns[key].nullable and self.columns[key].default is None
+                              and self.columns[key].server_default is None)
+        # include name -> (relationship, resource name)
+        self.includes = {key: (mapper.relationships[key], resource) for key, resource in (includes or {}).items()}
+        # field -> allowed values, for string columns the forms offer as a select
+        self.choices = choices or {}
+
+    def to_one(self, include):
+        return self.includes[include][0].direction is RelationshipDirection.MANYTOONE
+
+    def load_columns(self, fields, includes=()):
+        """Columns to load for ``fields`` plus the keys ``includes`` are matched on."""
+        keys = {'id'} | set(fields)
+        for include in includes:
+            relationship = self.includes[include][0]
+            if relationship.direction is RelationshipDirection.MANYTOONE:
+                keys.update(column.key for column, _ in relationship.local_remote_pairs)
+        return [getattr(self.model, key) for key in self.fields if key in keys]
+
+    def coerce(self, key, value):
+        """``value`` from a request converted to the Python type of column ``key``."""
+        column = self.columns[key]
+        if value is None:
+            if not column.nullable:
+                raise ValidationError(key, 'may not be null')
+            return None
+        python_type = column.type.python_type
+        try:
+            if python_type is bool:
+                if not isinstance(value, bool):
+                    raise ValueError
+            elif python_type is int:
+                if isinstance(value, bool) or int(value) != value:
+                    raise ValueError
+                value = int(value)
+            elif python_type is Decimal:
+                if isinstance(value, bool):
+                    raise ValueError
+                value = Decimal(str(value))
+                if not value.is_finite():
+                    raise ValidationError(key, 'must be a finite number')
+            elif python_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif python_type is date:
+                value = date.fromisoformat(value)
+            elif python_type is str:
+                if not isinstance(value, str):
+                    raise ValueError
+                length = getattr(column.type, 'length', None)
+                if length and len(value) > length:
+                    raise ValidationError(key, f'must be at most {length} characters')
+                if key in self.choices and value not in self.choices[key]:
+                    raise ValidationError(key, f'must be one of {", ".join(self.choices[key])}')
+        except (TypeError, ValueError, InvalidOperation) as e:
+            if isinstance(e, ValidationError):
+                raise
+            raise ValidationError(key, f'must be a valid {python_type.__name__}')
+        return value
+
+    def check_references(self, rows):
+        """Errors for foreign keys in ``rows`` (index, values) that point nowhere, one query per key."""
+        errors = []
+        for key in self.writable:
+            foreign_keys = list(self.columns[key].foreign_keys)
+            if not foreign_keys:
+                continue
+            target = foreign_keys[0].column
+            wanted = {values[key] for _, values in rows if values.get(key) is not None}
+            if not wanted:
+                continue
+            found = set(db.session.scalars(select(target).where(target.in_(wanted))))
+            errors.extend(dict(index=index, field=key, message=f'{target.table.name} {values[key]} does not exist')
+                          for index, values in rows if values.get(key) is not None and values[key] not in found)
+        return errors
+
+
+RESOURCES = {resource.name: resource for resource in (
+    Resource('companies', Company, {'parent_company': 'companies', 'brands': 'brands'},
+             read_only=('brand_count', 'subcompany_count', 'invoice_count')),
+    Resource('brands', Brand, {'company': 'companies', 'contacts': 'contacts'},
+             read_only=('contact_count', 'team_member_count', 'active_task_count', 'invoice_count')),
+    Resource('contacts', ClientContact, {'brands': 'brands'}),
+    Resource('status_updates', StatusUpdate, {'brand': 'brands'}, choices={'evaluation': EVALUATIONS}),
+    Resource('invoices', Invoice, {'brand': 'brands', 'company': 'companies'},
+             read_only=('filename', 'file_path')),
+    Resource('media_plans', MediaPlan, {'brand': 'brands'}),
+    Resource('brand_tasks', BrandTask, {'brand': 'brands'}),
+)}
+
+
+def to_json(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def serialize(obj, fields):
+    return {key: to_json(getattr(obj, key)) for key in fields}
@@ -0,0 +1,342 @@
+"""Versioned JSON API for integrations (``/api/v1``).
+
+* ``GET /<resource>`` lists rows by ascending id, ``limit`` at a time. The
+  response carries a ``next_cursor`` to pass back as ``cursor`` while more
+  rows follow; paging seeks on the primary key, so page 1000 costs the same
+  as page 1.
+* ``fields[<resource>]=a,b`` limits the columns returned (and loaded) per
+  resource, ``include=brand,company`` embeds related rows loaded with one
+  extra query per include, ``filter[<field>]=value`` filters on equality.
+* ``POST /<resource>`` creates and ``PATCH /<resource>`` updates a JSON
+  array of rows (updates identify rows by ``id``) in a single transaction:
+  either every row is stored or none is, and the errors are returned with
+  the array index of the offending row.
+
+``GET /changes?since=<seq>`` streams the change log (see ``app.changelog``)
+as JSON lines. Responses are serialized with orjson when it is installed.
+Scripts log in once with ``POST /login`` and reuse the session cookie;
+as the cookie alone authenticates them, writes also need the CSRF token the
+login returns in an ``X-CSRFToken`` header.
+"""
+import base64
+import binascii
+import json
+from flask import current_app, request, abort, stream_with_context
+from flask_login import login_required, login_user, current_user
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import selectinload, load_only
+from werkzeug.exceptions import HTTPException
+from app import db, login_manager
+from app.api import bp
+from app.api.resources import RESOURCES, ValidationError, serialize
+from app.auth.decorators import check_csrf_header
+from app.changelog import changes_upto, iter_changes
+from app.models import User
+
+try:
+    import orjson
+except ImportError:  # Falls back to the standard library
+    orjson = None
+
+# Unauthenticated API calls get a 401 instead of a redirect to the login page
+login_manager.blueprint_login_views['api'] = None
+
+
+def _dumps(payload):
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode()
+
+
+def _json(payload, status=200):
+    return current_app.response_class(_dumps(payload), status=status, mimetype='application/json')
+
+
+def _errors(status, errors):
+    return _json({'errors': errors}, status)
+
+
+@bp.errorhandler(HTTPException)
+def _http_error(e):
+    return _errors(e.code, [dict(message=e.description)])
+
+
+@bp.before_request
+def _check_csrf():
+    # Logging in needs the password instead
+    if (request.method not in ('GET', 'HEAD', 'OPTIONS') and request.endpoint != 'api.login'
+            and current_user.is_authenticated):
+        check_csrf_header()
+
+
+def _resource(name):
+    resource = RESOURCES.get(name)
+    if resource is None:
+        abort(404, f'Unknown resource {name}')
+    return resource
+
+
+def _fields(resource):
+    requested = request.args.get(f'fields[{resource.name}]')
+    if not requested:
+        return resource.fields
+    fields = [key.strip() for key in requested.split(',') if key.strip()]
+    unknown = [key for key in fields if key not in resource.fields]
+    if unknown:
+        abort(400, f'Unknown fields for {resource.name}: {", ".join(unknown)}')
+    return ['id'] + [key for key in fields if key != 'id']
+
+
+def _includes(resource):
+    includes = [key.strip() for key in request.args.get('include', '').split(',') if key.strip()]
+    unknown = [key for key in includes if key not in resource.includes]
+    if unknown:
+        abort(400, f'Unknown includes for {resource.name}: {", ".join(unknown)}')
+    return includes
+
+
+def _load_options(resource, fields, includes):
+    options = [load_only(*resource.load_columns(fields, includes))]
+    for include in includes:
+        relationship, target_name = resource.includes[include]
+        target = RESOURCES[target_name]
+        target_fields = _fields(target)
+        # One-to-many collections are matched on the foreign key of the related rows
+        keys = [remote.key for _, remote in relationship.local_remote_pairs
+                if remote.table is target.model.__table__]
+        options.append(selectinload(getattr(resource.model, include))
+                       .load_only(*target.load_columns(list(target_fields) + keys)))
+    return options
+
+
+def _render(resource, obj, fields, includes):
+    data = serialize(obj, fields)
+    for include in includes:
+        target = RESOURCES[resource.includes[include][1]]
+        target_fields = _fields(target)
+        related = getattr(obj, include)
+        if resource.to_one(include):
+            data[include] = serialize(related, target_fields) if related is not None else None
+        else:
+            data[include] = [serialize(item, target_fields) for item in related]
+    return data
+
+
+def _encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor):
+    try:
+        return int(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode())
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        abort(400, 'Invalid cursor')
+
+
+def _filters(resource):
+    conditions = []
+    for arg, value in request.args.items():
+        if not (arg.startswith('filter[') and arg.endswith(']')):
+            continue
+        key = arg[len('filter['):-1]
+        if key not in resource.fields:
+            abort(400, f'Unknown filter field for {resource.name}: {key}')
+        column = getattr(resource.model, key)
+        if value == 'null':
+            conditions.append(column.is_(None))
+            continue
+        python_type = resource.columns[key].type.python_type
+        try:
+            if python_type is bool:
+                if value.lower() not in ('1', 'true', '0', 'false'):
+                    raise ValueError
+                value = value.lower() in ('1', 'true')
+            elif python_type is int:
+                value = int(value)
+            elif python_type is not str:
+                value = resource.coerce(key, value)
+        except ValueError:
+            abort(400, f'Invalid value for filter {key}')
+        conditions.append(column == value)
+    return conditions
+
+
+@bp.route('/login', methods=['POST'])
+def login():
+    payload = request.get_json(silent=True) or {}
+    user = User.query.filter_by(email=payload.get('email')).first()
+    if user is None or not user.is_active or not user.check_password(payload.get('password') or ''):
+        return _errors(401, [dict(message='Invalid email or password')])
+    login_user(user)
+    return _json({'data': {'id': user.id, 'email': user.email, 'csrf_token': generate_csrf()}})
+
+
+@bp.route('/')
+@login_required
+def index():
+    return _json({'data': [dict(name=resource.name, fields=list(resource.fields), writable=list(resource.writable),
+                                required=list(resource.required), includes=list(resource.includes))
+                           for resource in RESOURCES.values()]})
+
+
+@bp.route('/changes')
+@login_required
+def changes():
+    since = max(request.args.get('since', 0, type=int), 0)
+    limit = request.args.get('limit', type=int)
+    tables = [name.strip() for name in request.args.get('tables', '').split(',') if name.strip()]
+    # Pinned before streaming, so the header tells where the next read starts
+    upto = changes_upto(since, limit)
+
+    def generate():
+        for change in iter_changes(since, upto, tables):
+            yield _dumps({'seq': change.seq, 'table': change.table_name, 'key': change.row_key, 'op': change.op,
+                          'data': json.loads(change.data) if change.data else None,
+                          'at': change.recorded_at.isoformat()}) + b'\n'
+
+    response = current_app.response_class(stream_with_context(generate()), mimetype='application/x-ndjson')
+    response.headers['X-Change-Seq'] = str(max(upto, since))
+    return response
+
+
+@bp.route('/<name>')
+@login_required
+def list_rows(name):
+    resource = _resource(name)
+    fields = _fields(resource)
+    includes = _includes(resource)
+    limit = min(max(request.args.get('limit', current_app.config['API_PAGE_SIZE'], type=int), 1),
+                current_app.config['API_MAX_PAGE_SIZE'])
+    query = (select(resource.model).where(*_filters(resource))
+             .options(*_load_options(resource, fields, includes))
+             .order_by(resource.model.id).limit(limit + 1))
+    cursor = request.args.get('cursor')
+    if cursor:
+        query = query.where(resource.model.id > _decode_cursor(cursor))
+    rows = db.session.scalars(query).all()
+    page = rows[:limit]
+    return _json({
+        'data': [_render(resource, obj, fields, includes) for obj in page],
+        'next_cursor': _encode_cursor(page[-1].id) if len(rows) > limit else None,
+    })
+
+
+@bp.route('/<name>/<int:row_id>')
+@login_required
+def get_row(name, row_id):
+    resource = _resource(name)
+    fields = _fields(resource)
+    includes = _includes(resource)
+    obj = db.session.scalars(select(resource.model).where(resource.model.id == row_id)
+                             .options(*_load_options(resource, fields, includes))).first()
+    if obj is None:
+        abort(404, f'{resource.name} {row_id} not found')
+    return _json({'data': _render(resource, obj, fields, includes)})
+
+
+def _batch():
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        abort(400, 'Expected a JSON array of objects')
+    if not rows:
+        abort(400, 'Nothing to store')
+    if len(rows) > current_app.config['API_MAX_BATCH']:
+        abort(413, f'At most {current_app.config["API_MAX_BATCH"]} rows per request')
+    return rows
+
+
+def _validate(resource, rows, creating):
+    """Coerce every row, returning ``(values per row, errors)``."""
+    cleaned = []
+    errors = []
+    for index, row in enumerate(rows):
+        values = {}
+        for key, value in row.items():
+            if key == 'id' and not creating:
+                continue
+            if key not in resource.writable:
+                errors.append(dict(index=index, field=key, message='is not writable'))
+                continue
+            try:
+                values[key] = resource.coerce(key, value)
+            except ValidationError as e:
+                errors.append(dict(index=index, field=e.field, message=str(e)))
+        if creating:
+            errors.extend(dict(index=index, field=key, message='is required')
+                          for key in resource.required if key not in row)
+        cleaned.append((index, values))
+    errors.extend(resource.check_references(cleaned))
+    return [values for _, values in cleaned], errors
+
+
+def _store(objects):
+    """Commit ``objects`` and return ``(ids, None)``, or ``(None, error response)``."""
+    try:
+        db.session.flush()
+        ids = [obj.id for obj in objects]
+        db.session.commit()
+    except IntegrityError as e:
+        db.session.rollback()
+        return None, _errors(409, [dict(message=str(e.orig))])
+    except ValueError as e:
+        # Refused by a flush guard, e.g. a company moved below its own subcompany
+        db.session.rollback()
+        return None, _errors(422, [dict(message=str(e))])
+    return ids, None
+
+
+def _stored(resource, ids):
+    """The stored rows in request order, reloaded with one query after the commit expired them."""
+    fields = _fields(resource)
+    objects = {obj.id: obj for obj in db.session.scalars(
+        select(resource.model).where(resource.model.id.in_(ids))
+        .options(load_only(*resource.load_columns(fields))))}
+    return [serialize(objects[row_id], fields) for row_id in ids]
+
+
+@bp.route('/<name>', methods=['POST'])
+@login_required
+def create_rows(name):
+    resource = _resource(name)
+    values, errors = _validate(resource, _batch(), creating=True)
+    if errors:
+        return _errors(422, errors)
+
+    author = {'created_by_id': current_user.id} if 'created_by_id' in resource.fields else {}
+    objects = [resource.model(**row, **author) for row in values]
+    db.session.add_all(objects)
+    ids, failed = _store(objects)
+    if failed:
+        return failed
+    return _json({'data': _stored(resource, ids)}, 201)
+
+
+@bp.route('/<name>', methods=['PATCH'])
+@login_required
+def update_rows(name):
+    resource = _resource(name)
+    rows = _batch()
+    values, errors = _validate(resource, rows, creating=False)
+    ids = []
+    for index, row in enumerate(rows):
+        if not isinstance(row.get('id'), int) or isinstance(row.get('id'), bool):
+            errors.append(dict(index=index, field='id', message='is required'))
+        ids.append(row.get('id'))
+    if errors:
+        return _errors(422, errors)
+
+    objects = {obj.id: obj for obj in db.session.scalars(
+        select(resource.model).where(resource.model.id.in_(ids)))}
+    missing = [dict(index=index, field='id', message=f'{resource.name} {row_id} not found')
+               for index, row_id in enumerate(ids) if row_id not in objects]
+    if missing:
+        return _errors(422, missing)
+    for row_id, changes in zip(ids, values):
+        for key, value in changes.items():
+            setattr(objects[row_id], key, value)
+    _, failed = _store(list(objects.values()))
+    if failed:
+        return failed
+    return _json({'data': _stored(resource, list(dict.fromkeys(ids)))})
@@ -0,0 +1,219 @@
+"""Set-based maintenance of link tables (brand contacts and brand teams).
+
+Instead of loading every related object and appending it to a relationship
+collection, these helpers read the ids currently linked, diff them against
+the wanted ids and apply the difference with a multi-row INSERT, a
+DELETE ... IN and, for team flags, targeted UPDATEs. Relationship
+collections already loaded in the session are expired so they reload with
+the new links on next access, the contact and team member counters of the
+affected brands are recounted and the changed rows are logged for the change
+feed (these statements bypass the flush events of ``app.counters`` and
+``app.changelog``).
+"""
+from datetime import datetime
+from sqlalchemy import select, and_, null
+from sqlalchemy.orm.util import identity_key
+from app import db
+from app.changelog import record_changes
+from app.counters import refresh_counters
+from app.models import Brand, BrandTeam, ClientContact, User, brand_contacts
+
+
+def _clean_ids(ids):
+    clean = set()
+    for pk in ids or []:
+        try:
+            clean.add(int(pk))
+        except (TypeError, ValueError):
+            continue
+    return clean
+
+
+def _existing_ids(model, ids):
+    if not ids:
+        return set()
+    return set(db.session.scalars(select(model.id).where(model.id.in_(ids))))
+
+
+def sync_links(table, owner_column, owner_id, other_column, other_model, wanted_ids,
+               add=True, remove=True):
+    """Make the links of ``owner_id`` in ``table`` match ``wanted_ids``.
+
+    With ``remove=False`` only missing links are added, with ``add=False``
+    only the listed links are removed. Returns ``(added_ids, removed_ids)``.
+    """
+    # Push pending ORM collection changes first so the diff sees them
+    db.session.flush()
+
+    wanted = _existing_ids(other_model, _clean_ids(wanted_ids)) if add else _clean_ids(wanted_ids)
+    current = set(db.session.scalars(select(other_column).where(owner_column == owner_id)))
+
+    if add and remove:
+        to_add, to_remove = wanted - current, current - wanted
+    elif add:
+        to_add, to_remove = wanted - current, set()
+    else:
+        to_add, to_remove = set(), wanted & current
+
+    if to_add:
+        rows = [{owner_column.key: owner_id, other_column.key: other_id} for other_id in sorted(to_add)]
+        db.session.execute(table.insert(), rows)
+        record_changes(table, 'insert', rows)
+    if to_remove:
+        db.session.execute(table.delete().where(owner_column == owner_id,
+                                                other_column.in_(to_remove)))
+        record_changes(table, 'delete', [{owner_column.key: owner_id, other_column.key: other_id}
+                                         for other_id in sorted(to_remove)])
+    return to_add, to_remove
+
+
+def _expire_collections(model, ids, attribute):
+    for pk in ids:
+        obj = db.session.identity_map.get(identity_key(model, pk))
+        if obj is not None:
+            db.session.expire(obj, [attribute])
+
+
+def set_contact_brands(contact, brand_ids):
+    """Link ``contact`` to exactly ``brand_ids``."""
+    added, removed = sync_links(brand_contacts, brand_contacts.c.contact_id, contact.id,
+                                brand_contacts.c.brand_id, Brand, brand_ids)
+    db.session.expire(contact, ['brands'])
+    _expire_collections(Brand, added | removed, 'contacts')
+    if added or removed:
+        refresh_counters(brand_ids=added | removed)
+    return added, removed
+
+
+def set_brand_contacts(brand, contact_ids):
+    """Link ``brand`` to exactly ``contact_ids``."""
+    added, removed = sync_links(brand_contacts, brand_contacts.c.brand_id, brand.id,
+                                brand_contacts.c.contact_id, ClientContact, contact_ids)
+    db.session.expire(brand, ['contacts'])
+    _expire_collections(ClientContact, added | removed, 'brands')
+    if added or removed:
+        refresh_counters(brand_ids={brand.id})
+    return added, removed
+
+
+def add_brand_contacts(brand, contact_ids):
+    """Link many contacts to ``brand`` at once, keeping its existing contacts."""
+    added, _ = sync_links(brand_contacts, brand_contacts.c.brand_id, brand.id,
+                          brand_contacts.c.contact_id, ClientContact, contact_ids, remove=False)
+    db.session.expire(brand, ['contacts'])
+    _expire_collections(ClientContact, added, 'brands')
+    if added:
+        refresh_counters(brand_ids={brand.id})
+    return added
+
+
+def remove_brand_contacts(brand, contact_ids):
+    """Unlink the given contacts from ``brand``."""
+    _, removed = sync_links(brand_contacts, brand_contacts.c.brand_id, brand.id,
+                            brand_contacts.c.contact_id, ClientContact, contact_ids, add=False)
+    db.session.expire(brand, ['contacts'])
+    _expire_collections(ClientContact, removed, 'brands')
+    if removed:
+        refresh_counters(brand_ids={brand.id})
+    return removed
+
+
+def assign_brand_team(brand_id, member_ids, key_responsible_id=None):
+    """Bring a brand's team in line with ``member_ids`` using the fewest row changes.
+
+    Members who stay keep their row and ``assigned_at``; only new members are
+    inserted, dropped members deleted and changed key-responsible flags updated.
+    Returns ``(added, updated, removed)`` member id sets.
+    """
+    table = BrandTeam.__table__
+    wanted = _clean_ids(member_ids)
+    # The current team and which of the wanted users exist, in one query (which autoflushes)
+    current = {}
+    existing = set()
+    for member_id, row_id, is_key in db.session.execute(
+            select(BrandTeam.team_member_id, BrandTeam.id, BrandTeam.is_key_responsible)
+            .where(BrandTeam.brand_id == brand_id)
+            .union_all(select(User.id, null(), null()).where(User.id.in_(wanted)))):
+        if row_id is None:
+            existing.add(member_id)
+        else:
+            current[member_id] = (row_id, bool(is_key))
+    wanted &= existing
+
+    added = wanted - set(current)
+    removed = set(current) - wanted
+    flagged = {member_id for member_id in wanted & set(current)
+               if current[member_id][1] != (member_id == key_responsible_id)}
+
+    if removed:
+        db.session.execute(table.delete().where(table.c.id.in_([current[m][0] for m in removed])))
+        record_changes(table, 'delete', [{'id': current[m][0]} for m in sorted(removed)])
+    if flagged:
+        db.session.execute(table.update().where(table.c.id.in_([current[m][0] for m in flagged]))
+                           .values(is_key_responsible=table.c.team_member_id == key_responsible_id))
+        record_changes(table, 'update', [{'id': current[m][0], 'is_key_responsible': m == key_responsible_id}
+                                         for m in sorted(flagged)])
+    if added:
+        now = datetime.utcnow()
+        rows = [{'brand_id': brand_id, 'team_member_id': member_id,
+                 'is_key_responsible': member_id == key_responsible_id, 'assigned_at': now}
+                for member_id in sorted(added)]
+        ids = dict(db.session.execute(table.insert().returning(table.c.team_member_id, table.c.id), rows).all())
+        record_changes(table, 'insert', [dict(id=ids[row['team_member_id']], **row) for row in rows])
+
+    _expire_collections(Brand, {brand_id}, 'team_members')
+    _expire_collections(User, added | removed, 'team_assignments')
+    # A swap leaves the team size, and so the brand's counter, as it was
+    if len(added) != len(removed):
+        refresh_counters(brand_ids={brand_id})
+    return added, flagged, removed
+
+
+def reassign_brands(from_user_id, to_user_id, brand_ids=None):
+    """Move ``from_user_id``'s brand assignments to ``to_user_id`` in one transaction.
+
+    Where the target is already on a brand's team the two assignments are
+    merged, keeping the key-responsible flag if either had it. Limit the
+    move with ``brand_ids``; by default every brand is moved. Returns the
+    number of brands affected. The caller commits.
+    """
+    db.session.flush()
+    table = BrandTeam.__table__
+    scope = select(table.c.brand_id).where(table.c.team_member_id == from_user_id)
+    if brand_ids is not None:
+        scope = scope.where(table.c.brand_id.in_(_clean_ids(brand_ids)))
+    moved_brand_ids = set(db.session.scalars(scope))
+    if not moved_brand_ids or from_user_id == to_user_id:
+        return 0
+
+    target_brands = select(table.c.brand_id).where(table.c.team_member_id == to_user_id)
+    from_rows = and_(table.c.team_member_id == from_user_id, table.c.brand_id.in_(moved_brand_ids))
+    moving = db.session.execute(select(table.c.id, table.c.brand_id, table.c.is_key_responsible)
+                                .where(from_rows)).all()
+    staying = {row.brand_id: row for row in db.session.execute(
+        select(table.c.id, table.c.brand_id, table.c.is_key_responsible)
+        .where(table.c.team_member_id == to_user_id, table.c.brand_id.in_(moved_brand_ids)))}
+
+    # Brands the target already works on: carry the key flag over, then drop the old row
+    db.session.execute(table.update().where(
+        table.c.team_member_id == to_user_id,
+        table.c.brand_id.in_(select(table.c.brand_id).where(from_rows, table.c.is_key_responsible == True))
+    ).values(is_key_responsible=True))
+    db.session.execute(table.delete().where(from_rows, table.c.brand_id.in_(target_brands)))
+
+    # Everywhere else the existing row simply changes hands
+    now = datetime.utcnow()
+    db.session.execute(table.update().where(from_rows).values(
+        team_member_id=to_user_id, assigned_at=now))
+
+    record_changes(table, 'update', [{'id': staying[row.brand_id].id, 'is_key_responsible': True}
+                                     for row in moving if row.brand_id in staying and row.is_key_responsible
+                                     and not staying[row.brand_id].is_key_responsible])
+    record_changes(table, 'delete', [{'id': row.id} for row in moving if row.brand_id in staying])
+    record_changes(table, 'update', [{'id': row.id, 'team_member_id': to_user_id, 'assigned_at': now}
+                                     for row in moving if row.brand_id not in staying])
+
+    _expire_collections(Brand, moved_brand_ids, 'team_members')
+    _expire_collections(User, {from_user_id, to_user_id}, 'team_assignments')
+    refresh_counters(brand_ids=moved_brand_ids)
+    return len(moved_brand_ids)
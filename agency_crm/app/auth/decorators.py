@@ -0,0 +1,33 @@
+from functools import wraps
+from flask import abort, current_app, request
+from flask_login import current_user, login_required
+from flask_wtf.csrf import validate_csrf
+from wtforms.validators import ValidationError
+
+
+def is_admin(user):
+    return user.is_authenticated and user.role in current_app.config['ADMIN_ROLES']
+
+
+def admin_required(f):
+    """Like login_required, but also requires one of the ADMIN_ROLES."""
+    @wraps(f)
+    @login_required
+    def decorated_function(*args, **kwargs):
+        if not is_admin(current_user):
+            abort(403)
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def check_csrf_header():
+    """Reject a cookie-authenticated JSON write without a valid ``X-CSRFToken`` header.
+
+    Pages send the CSRF token of their form; API scripts the one returned by
+    ``POST /api/v1/login``.
+    """
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        try:
+            validate_csrf(request.headers.get('X-CSRFToken'))
+        except ValidationError:
+            abort(400, 'The CSRF token is missing or invalid.')
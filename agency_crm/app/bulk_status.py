@@ -0,0 +1,106 @@
+"""Status updates for many brands in one submission.
+
+``brand_statuses`` lists the active brands a user works on (or all of them)
+with their latest status update, picked with ``row_number()`` in the same
+query. Submitted updates are checked together by ``validate_updates``,
+which loads the brands they refer to with one query, and
+``create_updates`` adds them to the session for one batched INSERT; the
+caller commits, so either every update is stored or none is.
+"""
+from collections import namedtuple
+from datetime import date
+from sqlalchemy import select, func, and_
+from app import db
+from app.health_snapshots import UPDATE_OVERDUE_DAYS
+from app.models import Company, Brand, BrandTeam, StatusUpdate
+from app.status_analytics import EVALUATIONS
+
+BrandStatus = namedtuple('BrandStatus', 'brand_id brand company last_date evaluation days_since overdue '
+                                        'key_responsible')
+
+
+def brand_statuses(user_id=None, today=None):
+    """Active brands, of ``user_id``'s team when given, with their latest update, by company and brand."""
+    today = today or date.today()
+    ranked = (select(StatusUpdate.brand_id, StatusUpdate.date, StatusUpdate.evaluation,
+                     func.row_number().over(partition_by=StatusUpdate.brand_id,
+                                            order_by=(StatusUpdate.date.desc(), StatusUpdate.id.desc()))
+                     .label('position'))
+              .subquery())
+    latest = select(ranked).where(ranked.c.position == 1).subquery()
+    query = (select(Brand.id, Brand.name, Company.name, latest.c.date, latest.c.evaluation)
+             .join(Company, Company.id == Brand.company_id)
+             .outerjoin(latest, latest.c.brand_id == Brand.id)
+             .where(Brand.status == 'active')
+             .order_by(Company.name, Brand.name))
+    if user_id is not None:
+        query = query.add_columns(BrandTeam.is_key_responsible).join(
+            BrandTeam, and_(BrandTeam.brand_id == Brand.id, BrandTeam.team_member_id == user_id))
+    statuses = []
+    for brand_id, brand, company, last_date, evaluation, *key in db.session.execute(query):
+        days_since = (today - last_date).days if last_date else None
+        statuses.append(BrandStatus(brand_id, brand, company, last_date, evaluation, days_since,
+                                    days_since is None or days_since > UPDATE_OVERDUE_DAYS,
+                                    bool(key and key[0])))
+    return statuses
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _error(index, brand_id, field, message):
+    return dict(index=index, brand_id=brand_id, field=field, message=message)
+
+
+def validate_updates(entries, today=None):
+    """Check submitted updates together.
+
+    ``entries`` are dicts with ``brand_id``, ``evaluation``, ``comment`` and
+    an optional ``date`` (a date or ISO string, default today). Returns
+    ``(updates, errors)``: the cleaned updates and a list of errors with the
+    index of the offending entry.
+    """
+    today = today or date.today()
+    wanted = {entry.get('brand_id') for entry in entries if _is_id(entry.get('brand_id'))}
+    active = set(db.session.scalars(select(Brand.id).where(Brand.id.in_(wanted), Brand.status == 'active')))
+    updates = []
+    errors = []
+    seen = set()
+    for index, entry in enumerate(entries):
+        brand_id = entry.get('brand_id')
+        if not _is_id(brand_id):
+            errors.append(_error(index, brand_id, 'brand_id', 'must be a brand id'))
+            brand_id = None
+        elif brand_id not in active:
+            errors.append(_error(index, brand_id, 'brand_id', 'is not an active brand'))
+        elif brand_id in seen:
+            errors.append(_error(index, brand_id, 'brand_id', 'has more than one update'))
+        seen.add(brand_id)
+        evaluation = entry.get('evaluation')
+        if evaluation not in EVALUATIONS:
+            errors.append(_error(index, brand_id, 'evaluation', f'must be one of {", ".join(EVALUATIONS)}'))
+        comment = entry.get('comment')
+        comment = comment.strip() if isinstance(comment, str) else ''
+        if not comment:
+            errors.append(_error(index, brand_id, 'comment', 'is required'))
+        update_date = entry.get('date') or today
+        try:
+            if isinstance(update_date, str):
+                update_date = date.fromisoformat(update_date)
+            elif not isinstance(update_date, date):
+                raise ValueError
+        except ValueError:
+            errors.append(_error(index, brand_id, 'date', 'must be a date (YYYY-MM-DD)'))
+            update_date = today
+        if update_date > today:
+            errors.append(_error(index, brand_id, 'date', 'may not be in the future'))
+        updates.append(dict(brand_id=brand_id, evaluation=evaluation, comment=comment, date=update_date))
+    return updates, errors
+
+
+def create_updates(updates, user_id):
+    """Add validated ``updates`` by ``user_id`` to the session; the caller commits."""
+    objects = [StatusUpdate(created_by_id=user_id, **update) for update in updates]
+    db.session.add_all(objects)
+    return objects
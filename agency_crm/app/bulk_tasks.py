@@ -0,0 +1,123 @@
+"""Recurring brand tasks handled in batches.
+
+``due_dates`` works out the due date of many tasks with one query: the
+latest completion of each task is picked with ``row_number()`` and passed to
+``task_due_date`` (one period after the last completion or the start date),
+the same rule the team workload counts overdue tasks by. After a batch
+action only the affected tasks are passed back through it.
+
+The actions each run as a handful of set-based statements in one
+transaction; the caller commits:
+
+* ``complete_tasks`` adds one completion per task with a single batched INSERT.
+* ``set_tasks_active`` flips ``is_active`` with one ``UPDATE ... WHERE id IN``,
+  which bypasses the flush events, so it recounts the brands' active tasks
+  and logs the change itself.
+* ``assign_templates`` adds every missing (brand, template) pair, leaving
+  pairs that already exist alone.
+"""
+from collections import namedtuple
+from datetime import date, timedelta
+from sqlalchemy import select, update, func
+from sqlalchemy.orm.util import identity_key
+from app import db
+from app.changelog import record_changes
+from app.counters import refresh_counters
+from app.models import Brand, BrandTask, TaskTemplate, TaskCompletion, task_due_date
+
+# Tasks completed this recently are shown as done
+COMPLETED_WINDOW_DAYS = 7
+
+TaskDue = namedtuple('TaskDue', 'task_id brand_id is_active next_due last_completion completed_by_id '
+                                'is_overdue is_completed')
+
+
+def due_dates(task_ids=None, brand_ids=None, is_active=None, today=None):
+    """``TaskDue`` by task id for the given tasks, brands and/or active state (default every task)."""
+    today = today or date.today()
+    ranked = (select(TaskCompletion.brand_task_id, TaskCompletion.completion_date, TaskCompletion.completed_by_id,
+                     func.row_number().over(partition_by=TaskCompletion.brand_task_id,
+                                            order_by=(TaskCompletion.completion_date.desc(),
+                                                      TaskCompletion.id.desc()))
+                     .label('position')))
+    if task_ids is not None:
+        ranked = ranked.where(TaskCompletion.brand_task_id.in_(task_ids))
+    ranked = ranked.subquery()
+    latest = select(ranked).where(ranked.c.position == 1).subquery()
+    query = (select(BrandTask.id, BrandTask.brand_id, BrandTask.is_active, BrandTask.frequency, BrandTask.start_date,
+                    latest.c.completion_date, latest.c.completed_by_id)
+             .outerjoin(latest, latest.c.brand_task_id == BrandTask.id))
+    if task_ids is not None:
+        query = query.where(BrandTask.id.in_(task_ids))
+    if brand_ids is not None:
+        query = query.where(BrandTask.brand_id.in_(brand_ids))
+    if is_active is not None:
+        query = query.where(BrandTask.is_active == is_active)
+    result = {}
+    for task_id, brand_id, active, frequency, start_date, last_completion, completed_by_id in db.session.execute(query):
+        next_due = task_due_date(frequency, start_date, last_completion)
+        result[task_id] = TaskDue(
+            task_id, brand_id, bool(active), next_due, last_completion, completed_by_id,
+            next_due < today,
+            last_completion is not None and last_completion >= today - timedelta(days=COMPLETED_WINDOW_DAYS))
+    return result
+
+
+def _task_ids(task_ids, is_active=None):
+    """The ids among ``task_ids`` that exist (and have the given active state), with their brands."""
+    if not task_ids:
+        return {}
+    query = select(BrandTask.id, BrandTask.brand_id).where(BrandTask.id.in_(set(task_ids)))
+    if is_active is not None:
+        query = query.where(BrandTask.is_active == is_active)
+    return dict(db.session.execute(query).all())
+
+
+def complete_tasks(task_ids, user_id, completion_date, notes=None):
+    """Complete the active tasks among ``task_ids``; returns the ids of the tasks completed."""
+    tasks = _task_ids(task_ids, is_active=True)
+    db.session.add_all([TaskCompletion(brand_task_id=task_id, completion_date=completion_date, notes=notes,
+                                       completed_by_id=user_id)
+                        for task_id in sorted(tasks)])
+    db.session.flush()
+    return set(tasks)
+
+
+def set_tasks_active(task_ids, is_active):
+    """Activate or deactivate the tasks among ``task_ids``; returns the ids of the tasks changed."""
+    db.session.flush()
+    tasks = _task_ids(task_ids, is_active=not is_active)
+    if not tasks:
+        return set()
+    table = BrandTask.__table__
+    db.session.execute(update(table).where(table.c.id.in_(tasks)).values(is_active=is_active))
+    record_changes(table, 'update', [{'id': task_id, 'is_active': is_active} for task_id in sorted(tasks)])
+    for task_id in tasks:
+        obj = db.session.identity_map.get(identity_key(BrandTask, task_id))
+        if obj is not None:
+            db.session.expire(obj, ['is_active'])
+    refresh_counters(brand_ids=set(tasks.values()))
+    return set(tasks)
+
+
+def assign_templates(template_ids, brand_ids, frequency, start_date, user_id):
+    """Add each of ``template_ids`` to each of ``brand_ids`` that lacks it.
+
+    Returns ``(added, skipped)``: the new ``BrandTask`` rows and the number of
+    pairs that were already assigned.
+    """
+    template_ids = set(db.session.scalars(select(TaskTemplate.id).where(TaskTemplate.id.in_(set(template_ids)))))
+    brand_ids = set(db.session.scalars(select(Brand.id).where(Brand.id.in_(set(brand_ids)))))
+    if not template_ids or not brand_ids:
+        return [], 0
+    db.session.flush()
+    existing = set(db.session.execute(
+        select(BrandTask.brand_id, BrandTask.task_template_id)
+        .where(BrandTask.brand_id.in_(brand_ids), BrandTask.task_template_id.in_(template_ids))).all())
+    added = [BrandTask(brand_id=brand_id, task_template_id=template_id, frequency=frequency,
+                       start_date=start_date, created_by_id=user_id)
+             for brand_id in sorted(brand_ids) for template_id in sorted(template_ids)
+             if (brand_id, template_id) not in existing]
+    db.session.add_all(added)
+    db.session.flush()
+    return added, len(existing)
@@ -0,0 +1,191 @@
+"""Streaming ZIP downloads of stored attachments.
+
+``stream_zip`` writes the archive into a small buffer that is emptied after
+every chunk of input, so the response starts immediately and memory use
+does not depend on the size of the archive. Entries are written with data
+descriptors (the output is not seekable) and already-compressed formats are
+stored rather than deflated again.
+
+The ``*_entries`` helpers collect ``(archive name, file_path)`` pairs with a
+few column-only queries instead of walking relationships row by row.
+"""
+import os
+import time
+import zipfile
+from sqlalchemy import select
+from app import db
+from app.hierarchy import subtree_select
+from app.models import (Company, Brand, Agreement, PlanningInfo, PlanningAttachment, KeyMeeting,
+                        MeetingAttachment, Invoice, InvoiceAttachment)
+
+CHUNK_SIZE = 256 * 1024
+STORED_EXTENSIONS = {'pdf', 'png', 'jpg', 'jpeg', 'gif', 'webp', 'docx', 'xlsx', 'pptx', 'zip'}
+
+
+class _ChunkBuffer:
+    """Write-only file object collecting ZipFile's output between yields."""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def _clean(name):
+    # Keep accented names readable; only strip what would break the archive layout
+    name = (name or '').replace('/', '_').replace('\\', '_').strip().lstrip('.')
+    return name or 'unnamed'
+
+
+def _unique(arcname, used):
+    base, ext = os.path.splitext(arcname)
+    candidate = arcname
+    counter = 2
+    while candidate in used:
+        candidate = f'{base} ({counter}){ext}'
+        counter += 1
+    used.add(candidate)
+    return candidate
+
+
+def stream_zip(entries, upload_folder):
+    """Yield a ZIP archive of ``(arcname, file_path)`` entries relative to ``upload_folder``.
+
+    Files missing on disk are listed in ``missing_files.txt`` inside the archive.
+    """
+    buffer = _ChunkBuffer()
+    used = set()
+    missing = []
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for arcname, file_path in entries:
+            path = os.path.join(upload_folder, file_path)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                missing.append(arcname)
+                continue
+            info = zipfile.ZipInfo(_unique(arcname, used), time.localtime(max(stat.st_mtime, 315532800))[:6])
+            info.file_size = stat.st_size
+            extension = arcname.rsplit('.', 1)[-1].lower()
+            info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as src, archive.open(info, 'w') as dest:
+                for chunk in iter(lambda: src.read(CHUNK_SIZE), b''):
+                    dest.write(chunk)
+                    data = buffer.pop()
+                    if data:
+                        yield data
+            yield buffer.pop()
+        if missing:
+            archive.writestr('missing_files.txt', '\n'.join(missing) + '\n')
+    yield buffer.pop()
+
+
+def _agreement_entries(company_ids, prefix_for):
+    rows = db.session.execute(
+        select(Agreement.company_id, Agreement.type, Agreement.filename, Agreement.file_path)
+        .where(Agreement.company_id.in_(company_ids))
+        .order_by(Agreement.uploaded_at))
+    for company_id, agreement_type, filename, file_path in rows:
+        yield f'{prefix_for(company_id)}agreements/{_clean(agreement_type)}_{_clean(filename)}', file_path
+
+
+def _brand_file_entries(brand_ids, prefix_for):
+    planning = db.session.execute(
+        select(PlanningInfo.brand_id, PlanningInfo.created_at, PlanningAttachment.filename,
+               PlanningAttachment.file_path)
+        .join(PlanningAttachment.planning_info)
+        .where(PlanningInfo.brand_id.in_(brand_ids))
+        .order_by(PlanningInfo.created_at))
+    for brand_id, created_at, filename, file_path in planning:
+        yield f'{prefix_for(brand_id)}planning/{created_at:%Y-%m-%d}_{_clean(filename)}', file_path
+
+    meetings = db.session.execute(
+        select(KeyMeeting.brand_id, KeyMeeting.date, MeetingAttachment.filename, MeetingAttachment.file_path)
+        .join(MeetingAttachment.meeting)
+        .where(KeyMeeting.brand_id.in_(brand_ids))
+        .order_by(KeyMeeting.date))
+    for brand_id, meeting_date, filename, file_path in meetings:
+        yield f'{prefix_for(brand_id)}meetings/{meeting_date:%Y-%m-%d}_{_clean(filename)}', file_path
+
+    yield from _invoice_entries([Invoice.brand_id.in_(brand_ids)],
+                                lambda brand_id: f'{prefix_for(brand_id)}invoices/')
+
+
+def _invoice_entries(conditions, prefix_for):
+    rows = db.session.execute(
+        select(Invoice.id, Invoice.brand_id, Invoice.invoice_date,
+               InvoiceAttachment.filename, InvoiceAttachment.file_path)
+        .join(InvoiceAttachment, InvoiceAttachment.invoice_id == Invoice.id)
+        .where(*conditions)
+        .order_by(Invoice.invoice_date, Invoice.id))
+    for invoice_id, brand_id, invoice_date, filename, file_path in rows:
+        yield f'{prefix_for(brand_id)}{invoice_date:%Y-%m-%d}_invoice-{invoice_id}_{_clean(filename)}', file_path
+
+    # Invoices from before invoice_attachments only have the single file on the row
+    legacy = db.session.execute(
+        select(Invoice.id, Invoice.brand_id, Invoice.invoice_date, Invoice.filename, Invoice.file_path)
+        .where(*conditions, Invoice.file_path.isnot(None), ~Invoice.attachments.any())
+        .order_by(Invoice.invoice_date, Invoice.id))
+    for invoice_id, brand_id, invoice_date, filename, file_path in legacy:
+        yield (f'{prefix_for(brand_id)}{invoice_date:%Y-%m-%d}_invoice-{invoice_id}_'
+               f'{_clean(filename or os.path.basename(file_path))}', file_path)
+
+
+def brand_entries(brand):
+    """A brand's files plus its company's agreements."""
+    entries = list(_agreement_entries([brand.company_id], lambda company_id: ''))
+    entries.extend(_brand_file_entries([brand.id], lambda brand_id: ''))
+    return entries
+
+
+def company_entries(company):
+    """Files of a company and its subcompanies, one folder per company and brand."""
+    companies = dict(db.session.execute(
+        select(Company.id, Company.name).where(Company.id.in_(subtree_select(company.id)))).all())
+    brands = {brand_id: (name, company_id) for brand_id, name, company_id in db.session.execute(
+        select(Brand.id, Brand.name, Brand.company_id).where(Brand.company_id.in_(companies)))}
+
+    def company_prefix(company_id):
+        return f'{_clean(companies[company_id])}/'
+
+    def brand_prefix(brand_id):
+        name, company_id = brands[brand_id]
+        return f'{company_prefix(company_id)}{_clean(name)}/'
+
+    entries = list(_agreement_entries(list(companies), company_prefix))
+    if brands:
+        entries.extend(_brand_file_entries(list(brands), brand_prefix))
+    return entries
+
+
+def invoice_entries(start=None, end=None, brand_id=None, company_id=None):
+    """Invoice files in a date range, filtered like the invoice list, by company and brand."""
+    conditions = []
+    if start:
+        conditions.append(Invoice.invoice_date >= start)
+    if end:
+        conditions.append(Invoice.invoice_date <= end)
+    if brand_id:
+        conditions.append(Invoice.brand_id == brand_id)
+    if company_id:
+        conditions.append(Invoice.brand_id.in_(select(Brand.id).where(Brand.company_id == company_id)))
+
+    names = {row_id: (brand_name, company_name) for row_id, brand_name, company_name in db.session.execute(
+        select(Brand.id, Brand.name, Company.name).join(Brand.company)
+        .where(Brand.id.in_(select(Invoice.brand_id).where(*conditions))))}
+
+    def prefix(row_brand_id):
+        brand_name, company_name = names[row_brand_id]
+        return f'{_clean(company_name)}/{_clean(brand_name)}/'
+
+    return list(_invoice_entries(conditions, prefix))
@@ -0,0 +1,223 @@
+"""In-process caches and batched primary-key lookups.
+
+Expensive aggregates are cached per *data version*: every write to the
+tables behind a named data set (``track_data_version``) bumps a counter row
+in ``data_versions`` within the same transaction, and ``cached_for_version``
+keys its entries on that counter. Reading it is one primary-key lookup, so
+every worker sees a change as soon as it commits, and a rolled back write
+changes nothing. Core ``update()``/``delete()`` statements bypass the ORM
+and must call ``bump_data_version`` themselves. A transaction that bumped a
+version does not cache under it, as its writes are not committed yet.
+
+``get_cached_user`` keeps a detached copy of each ``User`` row, keyed on the
+``users`` data version, for up to USER_CACHE_TTL seconds and merges it into
+the current session, so loading the logged-in user and resolving
+``created_by`` on list rows costs that one version lookup. An edited or
+deactivated user is reloaded by every worker once the edit commits.
+"""
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, inspect, select, update, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.util import identity_key
+from app import db
+from app.metrics import record_cache_lookup
+
+
+class TTLCache:
+    """Thread-safe dict with per-entry expiry and a size cap."""
+
+    def __init__(self, name, maxsize=1024):
+        self.name = name
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._data[key]
+                entry = None
+        record_cache_lookup(self.name, entry is not None)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            if len(self._data) >= self.maxsize and key not in self._data:
+                # Drop the entry closest to expiry rather than tracking LRU order
+                del self._data[min(self._data, key=lambda k: self._data[k][0])]
+            self._data[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+USER_DATA_VERSION = 'users'
+
+user_cache = TTLCache('user')
+versioned_cache = TTLCache('versioned', maxsize=256)
+_tracked_models = {}
+
+
+def _detached_copy(obj):
+    """Copy the column values of a loaded row into a detached instance that can be merged later."""
+    mapper = inspect(obj).mapper
+    copy = mapper.class_(**{attr.key: getattr(obj, attr.key) for attr in mapper.column_attrs})
+    make_transient_to_detached(copy)
+    return copy
+
+
+def _cache_users(users, version):
+    ttl = current_app.config['USER_CACHE_TTL']
+    if ttl > 0 and USER_DATA_VERSION not in _bumped(db.session()):
+        for user in users:
+            user_cache.set((user.id, version), _detached_copy(user), ttl)
+
+
+def get_cached_user(user_id):
+    from app.models import User
+
+    version = data_version(USER_DATA_VERSION)
+    cached = user_cache.get((user_id, version))
+    if cached is not None:
+        return db.session.merge(cached, load=False)
+    user = db.session.get(User, user_id)
+    if user is not None:
+        _cache_users([user], version)
+    return user
+
+
+def get_many(model, ids):
+    """Load rows by primary key with at most one query, preserving the order of ``ids``.
+
+    Rows already in the session's identity map are reused; unknown or malformed
+    ids are skipped.
+    """
+    wanted = []
+    for pk in ids:
+        try:
+            wanted.append(int(pk))
+        except (TypeError, ValueError):
+            continue
+    wanted = list(dict.fromkeys(wanted))
+    found = {}
+    missing = []
+    for pk in wanted:
+        obj = db.session.identity_map.get(identity_key(model, pk))
+        if obj is not None:
+            found[pk] = obj
+        else:
+            missing.append(pk)
+    if missing:
+        for obj in model.query.filter(model.id.in_(missing)):
+            found[obj.id] = obj
+    return [found[pk] for pk in wanted if pk in found]
+
+
+def prime_users(user_ids):
+    """Put the given users into the session so ``created_by``-style lookups need no SQL."""
+    from app.models import User
+
+    wanted = [user_id for user_id in set(user_ids)
+              if user_id is not None and db.session.identity_map.get(identity_key(User, user_id)) is None]
+    if not wanted:
+        return
+    version = data_version(USER_DATA_VERSION)
+    missing = []
+    for user_id in wanted:
+        cached = user_cache.get((user_id, version))
+        if cached is not None:
+            db.session.merge(cached, load=False)
+        else:
+            missing.append(user_id)
+    if missing:
+        _cache_users(get_many(User, missing), version)
+
+
+def track_data_version(name, *models):
+    """Bump data version ``name`` whenever rows of ``models`` are added, changed or deleted."""
+    for model in models:
+        _tracked_models.setdefault(model, set()).add(name)
+
+
+def bump_data_version(name, connection=None):
+    """Increment a data version in the current transaction."""
+    from app.models import DataVersion
+
+    if connection is None:
+        connection = db.session.connection()
+        _bumped(db.session()).add(name)
+    table = DataVersion.__table__
+    now = datetime.utcnow()
+    result = connection.execute(update(table).where(table.c.name == name)
+                                .values(version=table.c.version + 1, updated_at=now))
+    if not result.rowcount:
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(table).values(name=name, version=1, updated_at=now))
+        except IntegrityError:
+            # Created by a concurrent transaction in the meantime
+            connection.execute(update(table).where(table.c.name == name)
+                               .values(version=table.c.version + 1, updated_at=now))
+
+
+def data_version(name):
+    from app.models import DataVersion
+
+    return db.session.scalar(select(DataVersion.version).where(DataVersion.name == name)) or 0
+
+
+def cached_for_version(name, key, compute):
+    """Return ``compute()``, reused until data version ``name`` changes.
+
+    Entries also expire after ANALYTICS_CACHE_TTL seconds to bound memory
+    held by versions nobody asks for any more.
+    """
+    cache_key = (name, data_version(name), key)
+    value = versioned_cache.get(cache_key)
+    if value is None:
+        value = compute()
+        if name not in _bumped(db.session()):
+            versioned_cache.set(cache_key, value, current_app.config['ANALYTICS_CACHE_TTL'])
+    return value
+
+
+def _bumped(session):
+    """The data versions bumped in ``session``'s current transaction."""
+    return session.info.setdefault('bumped_versions', set())
+
+
+def _forget_bumps(session):
+    session.info.pop('bumped_versions', None)
+
+
+def _bump_tracked_versions(session, flush_context):
+    # The session's collections still hold what this flush wrote
+    names = set()
+    for obj in list(session.new) + list(session.deleted):
+        names.update(_tracked_models.get(type(obj), ()))
+    for obj in session.dirty:
+        if type(obj) in _tracked_models and session.is_modified(obj, include_collections=False):
+            names.update(_tracked_models[type(obj)])
+    for name in sorted(names):
+        bump_data_version(name, session.connection())
+    _bumped(session).update(names)
+
+
+def init_app(app):
+    from app.models import User
+
+    track_data_version(USER_DATA_VERSION, User)
+    if not event.contains(Session, 'after_flush', _bump_tracked_versions):
+        event.listen(Session, 'after_flush', _bump_tracked_versions)
+        event.listen(Session, 'after_commit', _forget_bumps)
+        event.listen(Session, 'after_rollback', _forget_bumps)
@@ -0,0 +1,226 @@
+"""Change data capture for incremental sync.
+
+Every flush appends one ``change_log`` row per inserted, updated and deleted
+row: the table, the primary key, the operation and, as JSON, the new column
+values (all of them for inserts, only the changed ones for updates). The
+sequence number is an autoincrementing primary key, so a consumer that
+remembers the last sequence it applied reads exactly the entries after it
+(``/api/v1/changes?since=<seq>``), however large the tables are.
+
+The entries are written on the flushing connection, so they commit or roll
+back with the change itself. SQLite allows one writer at a time, which
+makes sequence order commit order as well. Other databases hand out
+sequence numbers before commit, so a reader can see seq 11 while the
+transaction holding seq 10 is still open and skip it for good; the feed is
+only gap-free on SQLite (see the README). Link rows that ``app.associations``
+writes with Core statements are logged through ``record_changes``. Derived
+data is not logged: the counters of ``app.counters`` (left out of the row
+data too, as they are recounted after the flush), blob bookkeeping,
+commitment spend and health snapshots can all be rebuilt from the rest.
+
+``compact`` merges the entries older than the retention period into one per
+row (the latest state, or a delete), so the log grows with the number of
+rows touched rather than with the number of changes.
+"""
+import json
+from collections import namedtuple, defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from sqlalchemy import event, inspect, select, insert, update, delete, func, bindparam
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.base import NO_VALUE
+from app import db
+from app.counters import COUNTER_COLUMNS
+from app.models import (ChangeLogEntry, DataVersion, Blob, CommitmentSpend, BrandHealthSnapshot,
+                        Brand, ClientContact, brand_contacts)
+
+# Bookkeeping and derived tables
+IGNORED_MODELS = (ChangeLogEntry, DataVersion, Blob, CommitmentSpend, BrandHealthSnapshot)
+# Never sent down the change feed
+IGNORED_COLUMNS = {'password_hash'}
+
+Change = namedtuple('Change', 'seq table_name row_key op data recorded_at')
+
+
+def _jsonable(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def _entry(table, key, op, data, now):
+    return dict(table_name=table.name,
+                row_key=','.join(str(value) for value in key),
+                op=op,
+                data=json.dumps(data, default=_jsonable, separators=(',', ':')) if data is not None else None,
+                recorded_at=now)
+
+
+def _columns(mapper):
+    counters = COUNTER_COLUMNS.get(mapper.class_, ())
+    return [(prop.key, prop.columns[0].name) for prop in mapper.column_attrs
+            if prop.columns[0].table is mapper.local_table and prop.columns[0].name not in IGNORED_COLUMNS
+            and prop.columns[0].name not in counters]
+
+
+def _object_entry(obj, op, now):
+    state = inspect(obj)
+    mapper = state.mapper
+    key = state.identity or mapper.primary_key_from_instance(obj)
+    if op == 'delete':
+        data = None
+    elif op == 'insert':
+        data = {name: state.dict.get(attr) for attr, name in _columns(mapper)}
+    else:
+        data = {}
+        for attr, name in _columns(mapper):
+            history = state.attrs[attr].history
+            if history.has_changes():
+                data[name] = history.added[0] if history.added else None
+        if not data:
+            return None
+    return _entry(mapper.local_table, key, op, data, now)
+
+
+def _link_changes(session):
+    """Brand contact links added or removed through the ``Brand.contacts``/``ClientContact.brands`` collections."""
+    links = {}
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, Brand):
+            attr = inspect(obj).attrs.contacts
+            pair = lambda other: (obj.id, other.id)
+        elif isinstance(obj, ClientContact):
+            attr = inspect(obj).attrs.brands
+            pair = lambda other: (other.id, obj.id)
+        else:
+            continue
+        if obj in session.deleted:
+            # The links of a deleted row go with it
+            added, removed = [], ([] if attr.loaded_value is NO_VALUE else list(attr.loaded_value))
+        else:
+            added, removed = attr.history.added, attr.history.deleted
+        for other in added:
+            links[pair(other)] = 'insert'
+        for other in removed:
+            links[pair(other)] = 'delete'
+    return links
+
+
+def _record(session, flush_context):
+    now = datetime.utcnow()
+    entries = []
+    for objects, op in ((session.new, 'insert'), (session.dirty, 'update'), (session.deleted, 'delete')):
+        for obj in objects:
+            if isinstance(obj, IGNORED_MODELS):
+                continue
+            entry = _object_entry(obj, op, now)
+            if entry is not None:
+                entries.append(entry)
+    for (brand_id, contact_id), op in _link_changes(session).items():
+        data = {'brand_id': brand_id, 'contact_id': contact_id} if op == 'insert' else None
+        entries.append(_entry(brand_contacts, (brand_id, contact_id), op, data, now))
+    if entries:
+        session.connection().execute(insert(ChangeLogEntry.__table__), entries)
+
+
+def record_changes(table, op, rows):
+    """Log ``rows`` (dicts of column values, primary key included) written to ``table`` with Core."""
+    if not rows:
+        return
+    now = datetime.utcnow()
+    keys = [column.name for column in table.primary_key.columns]
+    db.session.execute(insert(ChangeLogEntry.__table__), [
+        _entry(table, [row[key] for key in keys], op, None if op == 'delete' else dict(row), now)
+        for row in rows])
+
+
+def latest_seq():
+    return db.session.scalar(select(func.max(ChangeLogEntry.seq))) or 0
+
+
+def changes_upto(since, limit=None):
+    """The last sequence number a read of ``limit`` entries after ``since`` would return."""
+    latest = latest_seq()
+    if not limit:
+        return latest
+    nth = db.session.scalar(select(ChangeLogEntry.seq).where(ChangeLogEntry.seq > since)
+                            .order_by(ChangeLogEntry.seq).offset(limit - 1).limit(1))
+    return min(nth, latest) if nth is not None else latest
+
+
+def iter_changes(since, upto, tables=None, batch_size=1000):
+    """Yield the ``Change`` entries after ``since`` up to ``upto``, in sequence order, a batch at a time."""
+    log = ChangeLogEntry.__table__
+    while since < upto:
+        query = (select(log.c.seq, log.c.table_name, log.c.row_key, log.c.op, log.c.data, log.c.recorded_at)
+                 .where(log.c.seq > since, log.c.seq <= upto)
+                 .order_by(log.c.seq).limit(batch_size))
+        if tables:
+            query = query.where(log.c.table_name.in_(tables))
+        rows = db.session.execute(query).all()
+        if not rows:
+            return
+        for row in rows:
+            yield Change(*row)
+        since = rows[-1].seq
+
+
+def _merge(entries):
+    """One entry with the combined effect of ``entries`` on a row, oldest first."""
+    last = entries[-1]
+    if last.op == 'delete':
+        return 'delete', None
+    # Only what happened since the row was last (re)inserted counts
+    start = max((i for i, entry in enumerate(entries) if entry.op in ('insert', 'delete')), default=0)
+    tail = [entry for entry in entries[start:] if entry.op != 'delete']
+    data = {}
+    for entry in tail:
+        data.update(json.loads(entry.data or '{}'))
+    op = 'insert' if tail[0].op == 'insert' else 'update'
+    return op, json.dumps(data, separators=(',', ':'))
+
+
+def compact(before, batch_size=500):
+    """Merge the entries recorded before ``before`` into one per row.
+
+    The merged entry keeps the sequence number of the row's latest entry, so
+    consumers at any position still end up with the same rows. Returns the
+    number of entries removed; the caller commits.
+    """
+    log = ChangeLogEntry.__table__
+    horizon = db.session.scalar(select(func.max(log.c.seq)).where(log.c.recorded_at < before))
+    if horizon is None:
+        return 0
+    keys = defaultdict(list)
+    for table_name, row_key in db.session.execute(
+            select(log.c.table_name, log.c.row_key).where(log.c.seq <= horizon)
+            .group_by(log.c.table_name, log.c.row_key).having(func.count() > 1)):
+        keys[table_name].append(row_key)
+
+    removed = 0
+    for table_name, row_keys in keys.items():
+        for start in range(0, len(row_keys), batch_size):
+            entries = defaultdict(list)
+            for row in db.session.execute(
+                    select(log.c.seq, log.c.row_key, log.c.op, log.c.data)
+                    .where(log.c.table_name == table_name, log.c.row_key.in_(row_keys[start:start + batch_size]),
+                           log.c.seq <= horizon)
+                    .order_by(log.c.seq)):
+                entries[row.row_key].append(row)
+            merged = []
+            obsolete = []
+            for rows in entries.values():
+                op, data = _merge(rows)
+                merged.append(dict(seq_=rows[-1].seq, op=op, data=data))
+                obsolete.extend(row.seq for row in rows[:-1])
+            db.session.execute(delete(log).where(log.c.seq.in_(obsolete)))
+            db.session.execute(update(log).where(log.c.seq == bindparam('seq_')), merged)
+            removed += len(obsolete)
+    return removed
+
+
+def init_app(app):
+    if not event.contains(Session, 'after_flush', _record):
+        event.listen(Session, 'after_flush', _record)
@@ -3,7 +3,8 @@ from flask_wtf.file import FileField, FileAllowed, MultipleFileField
 from wtforms import StringField, TextAreaField, SelectField, SubmitField, BooleanField, DateField, DecimalField, IntegerField, SelectMultipleField
 from wtforms.validators import DataRequired, Email, Optional, Length, ValidationError
 from wtforms.widgets import ListWidget, CheckboxInput
-from app.models import Company, ClientContact, MediaGroup, Brand
+from app import db
+from app.models import Company, ClientContact, MediaGroup, MediaGroupMapping, Brand
 
 class MultiCheckboxField(SelectMultipleField):
     widget = ListWidget(prefix_label=False)
@@ -137,10 +138,33 @@ class StatusUpdateForm(FlaskForm):
     ], validators=[DataRequired()])
     submit = SubmitField('Add Status Update')
 
+class BulkStatusUpdateForm(FlaskForm):
+    # Evaluations and comments are posted per brand as evaluation-<id> and comment-<id>
+    date = DateField('Date', format='%Y-%m-%d', validators=[DataRequired()])
+    submit = SubmitField('Add Status Updates')
+
 class MediaGroupForm(FlaskForm):
     name = StringField('Media Group Name', validators=[DataRequired(), Length(max=100)])
     submit = SubmitField('Save Media Group')
 
+class MediaGroupMappingForm(FlaskForm):
+    media_group_id = SelectField('Media Group', coerce=int, validators=[DataRequired()])
+    field = SelectField('Match On', choices=[('channel_name', 'Channel'), ('media_type', 'Media Type')],
+                        validators=[DataRequired()])
+    value = StringField('Channel or Media Type', validators=[DataRequired(), Length(max=200)])
+    submit = SubmitField('Add Mapping')
+    
+    def __init__(self, *args, **kwargs):
+        super(MediaGroupMappingForm, self).__init__(*args, **kwargs)
+        self.media_group_id.choices = [(mg.id, mg.name) for mg in MediaGroup.query.order_by(MediaGroup.name).all()]
+    
+    def validate_value(self, value):
+        exists = MediaGroupMapping.query.filter(
+            MediaGroupMapping.field == self.field.data,
+            db.func.lower(MediaGroupMapping.value) == db.func.lower(value.data.strip())).first()
+        if exists:
+            raise ValidationError(f'This is already mapped to {exists.media_group.name}.')
+
 class PlanningInfoForm(FlaskForm):
     comments = TextAreaField('Planning Comments', validators=[DataRequired()])
     attachments = MultipleFileField('Attachments', validators=[
@@ -192,6 +216,30 @@ class TaskCompletionForm(FlaskForm):
     notes = TextAreaField('Notes', validators=[Optional()])
     submit = SubmitField('Mark as Complete')
 
+class TaskBatchForm(FlaskForm):
+    # The selected tasks are posted as task_ids
+    action = SelectField('Action', choices=[
+        ('complete', 'Mark Complete'),
+        ('activate', 'Activate'),
+        ('deactivate', 'Deactivate')
+    ], validators=[DataRequired()])
+    completion_date = DateField('Completion Date', format='%Y-%m-%d', validators=[Optional()])
+    notes = TextAreaField('Notes', validators=[Optional()])
+    brand_id = IntegerField('Brand', validators=[Optional()])
+    submit = SubmitField('Apply')
+
+class TaskAssignmentForm(FlaskForm):
+    task_template_ids = MultiCheckboxField('Tasks', coerce=int, validators=[DataRequired()])
+    brand_ids = MultiCheckboxField('Brands', coerce=int, validators=[DataRequired()])
+    frequency = SelectField('Frequency', choices=[
+        ('monthly', 'Monthly'),
+        ('quarterly', 'Quarterly (every 3 months)'),
+        ('twice_yearly', 'Twice a Year (every 6 months)'),
+        ('yearly', 'Once a Year')
+    ], validators=[DataRequired()])
+    start_date = DateField('Start Date', format='%Y-%m-%d', validators=[DataRequired()])
+    submit = SubmitField('Assign Tasks')
+
 class SubcompanyForm(FlaskForm):
     name = StringField('Company Name', validators=[DataRequired(), Length(max=200)])
     vat_code = StringField('VAT Code', validators=[Optional(), Length(max=50)])
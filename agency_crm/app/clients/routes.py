@@ -1,8 +1,10 @@
 import os
-from datetime import datetime, timedelta
-from flask import render_template, redirect, url_for, flash, request, current_app, send_from_directory, abort, Response
+import re
+from datetime import datetime
+from flask import render_template, redirect, url_for, flash, request, current_app, abort, Response, jsonify
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
+from sqlalchemy.orm import selectinload, joinedload, contains_eager
 from wtforms import SelectField
 from wtforms.validators import DataRequired
 from app.clients import bp
@@ -10,15 +12,36 @@ from openpyxl import Workbook
 from io import BytesIO
 from app.clients.forms import (CompanyForm, AgreementForm, BrandForm, ClientContactForm, 
                               BrandTeamForm, PlanningInfoForm, CommitmentForm, 
-                              StatusUpdateForm, MediaGroupForm, KeyMeetingForm, KeyLinkForm, GiftForm,
-                              TaskTemplateForm, BrandTaskForm, TaskCompletionForm, SubcompanyForm, InvoiceForm,
+                              StatusUpdateForm, BulkStatusUpdateForm, MediaGroupForm, MediaGroupMappingForm, KeyMeetingForm, KeyLinkForm, GiftForm,
+                              TaskTemplateForm, BrandTaskForm, TaskCompletionForm, TaskBatchForm, TaskAssignmentForm,
+                              SubcompanyForm, InvoiceForm,
                               SubbrandForm, MediaPlanForm, DigitalInfoForm, DigitalInfoLinkForm)
 from app.models import (Company, Agreement, Brand, ClientContact, BrandTeam, 
-                       PlanningInfo, Commitment, StatusUpdate, MediaGroup, User,
+                       PlanningInfo, Commitment, StatusUpdate, MediaGroup, MediaGroupMapping, User,
                        KeyMeeting, KeyLink, PlanningAttachment, MeetingAttachment, Gift,
                        TaskTemplate, BrandTask, TaskCompletion, Invoice, InvoiceAttachment, Subbrand, MediaPlan,
-                       DigitalInfo, DigitalInfoLink)
+                       DigitalInfo, DigitalInfoLink, Blob, brand_contacts)
 from app import db
+from app.metrics import timed_export
+from app.auth.decorators import check_csrf_header
+from app.cache import prime_users
+from app.associations import set_contact_brands, add_brand_contacts, assign_brand_team
+from app.delivery import send_upload, send_stored_file
+from app.previews import PREVIEW_SUFFIX, preview_file
+from app.bundles import stream_zip, brand_entries, company_entries, invoice_entries
+from app.uploads import UploadError, create_session, load_session, append_chunk, form_uploads
+from app.text_index import search_attachments
+from app.media_rollup import pivot, rollup_years, overspend_tolerance
+from app.commitments import fulfilment, unmapped_plans
+from app.invoice_analytics import (revenue_series, top_clients, year_over_year, aging, revenue_years,
+                                   period_label, period_code, AGING_BUCKETS)
+from app.status_analytics import evaluation_analytics, portfolio, EVALUATIONS, WINDOWS, DEFAULT_WINDOW
+from app.health_snapshots import UPDATE_OVERDUE_DAYS
+from app.bulk_status import brand_statuses, validate_updates, create_updates
+from app.bulk_tasks import due_dates, complete_tasks, set_tasks_active, assign_templates
+from app.hierarchy import company_tree, subtree_totals, subtree_select, ancestors
+
+SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
 
 def allowed_file(filename):
     return '.' in filename and \
@@ -27,9 +50,10 @@ def allowed_file(filename):
 @bp.route('/companies')
 @login_required
 def companies():
-    # Only get parent companies (those without parent_company_id)
-    companies = Company.query.filter_by(parent_company_id=None).order_by(Company.name).all()
-    return render_template('clients/companies.html', companies=companies)
+    # The whole hierarchy, nested under the top-level companies
+    companies, children = company_tree(Company.query.order_by(Company.name).all())
+    return render_template('clients/companies.html', companies=companies, children=children,
+                         totals=subtree_totals())
 
 @bp.route('/company/new', methods=['GET', 'POST'])
 @login_required
@@ -59,7 +83,14 @@ def new_company():
 @login_required
 def company_detail(company_id):
     company = Company.query.get_or_404(company_id)
-    return render_template('clients/company_detail.html', company=company, datetime=datetime)
+    progress = {f.commitment_id: f for f in fulfilment(company_ids=[company.id])}
+    subtree = Company.query.filter(Company.id.in_(subtree_select(company.id))).order_by(Company.name).all()
+    _, children = company_tree(subtree)
+    return render_template('clients/company_detail.html', company=company, datetime=datetime,
+                         commitment_progress=progress,
+                         ancestors=ancestors(company.id),
+                         children=children,
+                         totals=subtree_totals([company.id]).get(company.id))
 
 @bp.route('/company/<int:company_id>/edit', methods=['GET', 'POST'])
 @login_required
@@ -67,10 +98,9 @@ def edit_company(company_id):
     company = Company.query.get_or_404(company_id)
     form = CompanyForm(company=company)
     
-    # Get list of companies for parent company selection, excluding current company and its subcompanies
-    exclude_ids = [company.id] + [s.id for s in company.subcompanies]
+    # Get list of companies for parent company selection, excluding current company and everything below it
     parent_choices = [(0, 'None')]
-    parent_choices += [(c.id, c.name) for c in Company.query.filter(~Company.id.in_(exclude_ids)).order_by(Company.name).all()]
+    parent_choices += [(c.id, c.name) for c in Company.query.filter(~Company.id.in_(subtree_select(company.id))).order_by(Company.name).all()]
     form.parent_company_id.choices = parent_choices
     
     if form.validate_on_submit():
@@ -105,7 +135,7 @@ def delete_company(company_id):
     company = Company.query.get_or_404(company_id)
     
     # Check if company has subcompanies
-    if company.subcompanies:
+    if company.subcompany_count:
         flash('Cannot delete company with existing subcompanies. Please delete subcompanies first.', 'error')
         return redirect(url_for('clients.company_detail', company_id=company.id))
     
@@ -132,18 +162,17 @@ def upload_agreement(company_id):
     form = AgreementForm()
     
     if form.validate_on_submit():
-        if form.file.data:
-            filename = secure_filename(form.file.data.filename)
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            filename = f"{company_id}_{timestamp}_{filename}"
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-            form.file.data.save(file_path)
+        # The file arrives in the form or, when large, as a finished chunked upload
+        uploads = form_uploads(form.file.data, lambda filename: filename.lower().endswith('.pdf'))
+        if uploads:
+            filename, blob = uploads[0]
             
             agreement = Agreement(
                 company_id=company_id,
                 type=form.type.data,
-                filename=form.file.data.filename,
-                file_path=filename,
+                filename=filename,
+                file_path=blob.path,
+                blob_sha256=blob.sha256,
                 valid_until=form.valid_until.data,
                 uploaded_by_id=current_user.id
             )
@@ -186,6 +215,12 @@ def new_brand():
 @login_required
 def brand_detail(brand_id):
     brand = Brand.query.get_or_404(brand_id)
+    
+    # Load the authors shown on the page up front instead of one lazy load per row
+    prime_users([p.created_by_id for p in brand.planning_info] +
+                [m.created_by_id for m in brand.key_meetings] +
+                [l.created_by_id for l in brand.key_links] +
+                [u.created_by_id for u in brand.status_updates])
     return render_template('clients/brand_detail.html', brand=brand)
 
 @bp.route('/brand/<int:brand_id>/edit', methods=['GET', 'POST'])
@@ -251,12 +286,7 @@ def assign_contact(brand_id):
         
         if action == 'existing':
             # Assign existing contacts
-            contact_ids = request.form.getlist('contact_ids')
-            for contact_id in contact_ids:
-                contact = ClientContact.query.get(contact_id)
-                if contact and contact not in brand.contacts:
-                    brand.contacts.append(contact)
-            
+            add_brand_contacts(brand, request.form.getlist('contact_ids'))
             db.session.commit()
             flash('Contacts assigned successfully!', 'success')
             return redirect(url_for('clients.brand_detail', brand_id=brand_id))
@@ -266,10 +296,10 @@ def assign_contact(brand_id):
             return redirect(url_for('clients.new_contact', brand_id=brand_id))
     
     # Get all contacts not already assigned to this brand
-    assigned_contact_ids = [c.id for c in brand.contacts]
+    assigned_contact_ids = db.select(brand_contacts.c.contact_id).where(brand_contacts.c.brand_id == brand_id)
     available_contacts = ClientContact.query.filter(
-        ~ClientContact.id.in_(assigned_contact_ids) if assigned_contact_ids else True
-    ).order_by(ClientContact.last_name, ClientContact.first_name).all()
+        ~ClientContact.id.in_(assigned_contact_ids)
+    ).options(selectinload(ClientContact.brands)).order_by(ClientContact.last_name, ClientContact.first_name).all()
     
     return render_template('clients/assign_contact.html', brand=brand, available_contacts=available_contacts)
 
@@ -280,18 +310,9 @@ def assign_team(brand_id):
     form = BrandTeamForm()
     
     if form.validate_on_submit():
-        BrandTeam.query.filter_by(brand_id=brand_id).delete()
-        
         key_responsible_id = int(form.key_responsible_id.data) if form.key_responsible_id.data and form.key_responsible_id.data != '0' else None
         
-        for user_id in form.team_members.data:
-            assignment = BrandTeam(
-                brand_id=brand_id,
-                team_member_id=user_id,
-                is_key_responsible=(user_id == key_responsible_id)
-            )
-            db.session.add(assignment)
-        
+        assign_brand_team(brand_id, form.team_members.data, key_responsible_id)
         db.session.commit()
         flash('Team assigned successfully!', 'success')
         return redirect(url_for('clients.brand_detail', brand_id=brand_id))
@@ -322,21 +343,14 @@ def planning_info(brand_id):
         db.session.flush()  # Get planning ID before handling attachments
         
         # Handle file attachments
-        if form.attachments.data:
-            for file in form.attachments.data:
-                if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = f"planning_{planning.id}_{timestamp}_{filename}"
-                    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    
-                    attachment = PlanningAttachment(
-                        planning_info_id=planning.id,
-                        filename=file.filename,
-                        file_path=filename
-                    )
-                    db.session.add(attachment)
+        for filename, blob in form_uploads(form.attachments.data, allowed_file):
+            attachment = PlanningAttachment(
+                planning_info_id=planning.id,
+                filename=filename,
+                file_path=blob.path,
+                blob_sha256=blob.sha256
+            )
+            db.session.add(attachment)
         
         db.session.commit()
         flash('Planning information added!', 'success')
@@ -446,12 +460,9 @@ def new_contact(brand_id=None):
             contact_type=form.contact_type.data
         )
         
-        for brand_id in form.brands.data:
-            brand = Brand.query.get(brand_id)
-            if brand:
-                contact.brands.append(brand)
-        
         db.session.add(contact)
+        db.session.flush()
+        set_contact_brands(contact, form.brands.data)
         db.session.commit()
         flash('Contact created successfully!', 'success')
         
@@ -488,11 +499,7 @@ def edit_contact(contact_id):
         contact.status = form.status.data
         contact.contact_type = form.contact_type.data
         
-        contact.brands.clear()
-        for brand_id in form.brands.data:
-            brand = Brand.query.get(brand_id)
-            if brand:
-                contact.brands.append(brand)
+        set_contact_brands(contact, form.brands.data)
         
         db.session.commit()
         flash('Contact updated successfully!', 'success')
@@ -563,6 +570,54 @@ def new_media_group():
     
     return render_template('clients/media_group_form.html', form=form, title='New Media Group')
 
+@bp.route('/media-groups/mappings', methods=['GET', 'POST'])
+@login_required
+def media_group_mappings():
+    form = MediaGroupMappingForm()
+    if form.validate_on_submit():
+        mapping = MediaGroupMapping(
+            media_group_id=form.media_group_id.data,
+            field=form.field.data,
+            value=form.value.data.strip()
+        )
+        db.session.add(mapping)
+        db.session.commit()
+        flash('Mapping added successfully!', 'success')
+        return redirect(url_for('clients.media_group_mappings'))
+    
+    mappings = MediaGroupMapping.query.join(MediaGroupMapping.media_group).order_by(
+        MediaGroup.name, MediaGroupMapping.field, MediaGroupMapping.value).all()
+    return render_template('clients/media_group_mappings.html', form=form, mappings=mappings,
+                         unmapped=unmapped_plans())
+
+@bp.route('/media-groups/mappings/<int:mapping_id>/delete', methods=['POST'])
+@login_required
+def delete_media_group_mapping(mapping_id):
+    mapping = MediaGroupMapping.query.get_or_404(mapping_id)
+    db.session.delete(mapping)
+    db.session.commit()
+    flash('Mapping deleted successfully!', 'success')
+    return redirect(url_for('clients.media_group_mappings'))
+
+@bp.route('/commitments')
+@login_required
+def commitments():
+    year = request.args.get('year', type=int, default=datetime.now().year)
+    company_id = request.args.get('company_id', type=int)
+    
+    results = fulfilment(year=year, company_ids=[company_id] if company_id else None)
+    years = [y[0] for y in db.session.query(Commitment.year).distinct().order_by(Commitment.year.desc())]
+    if year not in years:
+        years = sorted(years + [year], reverse=True)
+    companies = Company.query.order_by(Company.name).all()
+    
+    return render_template('clients/commitments.html',
+                         results=results,
+                         companies=companies,
+                         available_years=years,
+                         selected_year=year,
+                         selected_company_id=company_id)
+
 @bp.route('/brand/<int:brand_id>/meeting', methods=['GET', 'POST'])
 @login_required
 def add_meeting(brand_id):
@@ -580,21 +635,14 @@ def add_meeting(brand_id):
         db.session.flush()
         
         # Handle file attachments
-        if form.attachments.data:
-            for file in form.attachments.data:
-                if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = f"meeting_{meeting.id}_{timestamp}_{filename}"
-                    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    
-                    attachment = MeetingAttachment(
-                        meeting_id=meeting.id,
-                        filename=file.filename,
-                        file_path=filename
-                    )
-                    db.session.add(attachment)
+        for filename, blob in form_uploads(form.attachments.data, allowed_file):
+            attachment = MeetingAttachment(
+                meeting_id=meeting.id,
+                filename=filename,
+                file_path=blob.path,
+                blob_sha256=blob.sha256
+            )
+            db.session.add(attachment)
         
         db.session.commit()
         flash('Meeting added successfully!', 'success')
@@ -622,10 +670,54 @@ def add_link(brand_id):
     
     return render_template('clients/link_form.html', form=form, brand=brand)
 
-@bp.route('/uploads/<filename>')
+@bp.route('/uploads/<path:filename>')
 @login_required
 def uploaded_file(filename):
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], filename)
+    # ?name= gives the browser the original file name instead of the blob hash
+    return send_stored_file(filename, download_name=request.args.get('name'))
+
+@bp.route('/previews/<sha256>')
+@login_required
+def attachment_preview(sha256):
+    if not SHA256_PATTERN.fullmatch(sha256) or not os.path.exists(preview_file(sha256)):
+        abort(404)
+    return send_upload(Blob.relative_path(sha256) + PREVIEW_SUFFIX, mimetype='image/jpeg',
+                       sha256=sha256)
+
+@bp.route('/attachments/search')
+@login_required
+def attachment_search():
+    query = request.args.get('q', '').strip()
+    results = search_attachments(query) if query else []
+    return render_template('clients/attachment_search.html', query=query, results=results)
+
+def _upload_error(error):
+    return jsonify(error=str(error), offset=error.offset), error.status
+
+@bp.route('/upload-sessions', methods=['POST'])
+@login_required
+def create_upload():
+    check_csrf_header()
+    data = request.get_json(silent=True) or {}
+    try:
+        state = create_session(data.get('filename'), data.get('size'), current_user.id)
+    except UploadError as e:
+        return _upload_error(e)
+    state['url'] = url_for('clients.upload_session', upload_id=state['id'])
+    return jsonify(state), 201
+
+@bp.route('/upload-sessions/<upload_id>', methods=['GET', 'PUT'])
+@login_required
+def upload_session(upload_id):
+    try:
+        if request.method == 'PUT':
+            check_csrf_header()
+            offset = append_chunk(upload_id, current_user.id,
+                                  request.headers.get('Content-Range'), request.stream)
+            return jsonify(id=upload_id, offset=offset)
+        return jsonify(load_session(upload_id, current_user.id))
+    except UploadError as e:
+        return _upload_error(e)
 
 @bp.route('/birthdays')
 @login_required
@@ -726,6 +818,7 @@ def status_updates():
     pagination = query.order_by(StatusUpdate.date.desc()).paginate(
         page=page, per_page=per_page, error_out=False)
     updates = pagination.items
+    prime_users(u.created_by_id for u in updates)
     
     # Get all brands for filter dropdown
     brands = Brand.query.join(Company).order_by(Company.name, Brand.name).all()
@@ -742,6 +835,43 @@ def status_updates():
                          selected_evaluation=evaluation,
                          selected_created_by_id=created_by_id)
 
+def _status_analytics_options():
+    window = request.args.get('window', DEFAULT_WINDOW, type=int)
+    return dict(by=request.args.get('by', 'brand'),
+                window=window if window in WINDOWS else DEFAULT_WINDOW,
+                company_id=request.args.get('company_id', type=int))
+
+@bp.route('/status-updates/analytics')
+@login_required
+def status_analytics():
+    options = _status_analytics_options()
+    companies = Company.query.order_by(Company.name).all()
+    
+    return render_template('clients/status_analytics.html',
+                         rows=evaluation_analytics(options['by'], options['window'],
+                                                   company_id=options['company_id']),
+                         summaries=portfolio(company_id=options['company_id']),
+                         evaluations=EVALUATIONS,
+                         windows=WINDOWS,
+                         update_overdue_days=UPDATE_OVERDUE_DAYS,
+                         companies=companies,
+                         selected_company_id=options['company_id'],
+                         window=options['window'],
+                         by=options['by'])
+
+@bp.route('/status-updates/analytics.json')
+@login_required
+def status_analytics_data():
+    options = _status_analytics_options()
+    return jsonify(
+        by=options['by'],
+        window=options['window'],
+        as_of=datetime.now().date().isoformat(),
+        rows=[row._asdict() for row in evaluation_analytics(options['by'], options['window'],
+                                                           company_id=options['company_id'])],
+        portfolio=[dict(window=window, **(summary._asdict() if summary else {}))
+                   for window, summary in portfolio(company_id=options['company_id'])])
+
 @bp.route('/status-update/new', methods=['GET', 'POST'])
 @login_required
 def new_status_update():
@@ -774,47 +904,134 @@ def new_status_update():
     
     return render_template('clients/status_update_form.html', form=form, title='New Status Update')
 
+def _bulk_scope():
+    """'mine' lists the brands of the current user's team, 'all' every active brand.
+    
+    Without a scope the user's own brands are listed, or every brand if they have none.
+    """
+    scope = request.args.get('scope')
+    if scope != 'all':
+        statuses = brand_statuses(current_user.id)
+        if statuses or scope == 'mine':
+            return 'mine', statuses
+    return 'all', brand_statuses()
+
+@bp.route('/status-updates/bulk', methods=['GET', 'POST'])
+@login_required
+def bulk_status_updates():
+    form = BulkStatusUpdateForm()
+    scope, statuses = _bulk_scope()
+    errors = {}
+    
+    if form.validate_on_submit():
+        # Brands left without an evaluation and comment are skipped
+        entries = []
+        for key in request.form:
+            if not key.startswith('evaluation-'):
+                continue
+            try:
+                brand_id = int(key[len('evaluation-'):])
+            except ValueError:
+                continue
+            evaluation = request.form.get(key, '')
+            comment = request.form.get(f'comment-{brand_id}', '')
+            if evaluation or comment.strip():
+                entries.append(dict(brand_id=brand_id, evaluation=evaluation, comment=comment,
+                                    date=form.date.data))
+        if not entries:
+            flash('Choose an evaluation and write a comment for at least one brand.', 'error')
+        else:
+            updates, problems = validate_updates(entries)
+            if not problems:
+                create_updates(updates, current_user.id)
+                db.session.commit()
+                flash(f'{len(updates)} status updates added successfully!', 'success')
+                return redirect(url_for('clients.status_updates'))
+            for problem in problems:
+                errors.setdefault(problem['brand_id'], []).append(
+                    f"{problem['field'].replace('_', ' ').capitalize()} {problem['message']}")
+            flash('No status updates were added, please correct the errors below.', 'error')
+    
+    if request.method == 'GET':
+        form.date.data = datetime.now().date()
+    
+    return render_template('clients/status_updates_bulk.html', 
+                         form=form,
+                         statuses=statuses,
+                         scope=scope,
+                         errors=errors,
+                         evaluations=EVALUATIONS,
+                         overdue_days=UPDATE_OVERDUE_DAYS)
+
+@bp.route('/status-updates/bulk.json', methods=['GET', 'POST'])
+@login_required
+def bulk_status_updates_data():
+    if request.method == 'GET':
+        scope, statuses = _bulk_scope()
+        return jsonify(scope=scope,
+                       overdue_days=UPDATE_OVERDUE_DAYS,
+                       brands=[dict(status._asdict(), last_date=status.last_date.isoformat() if status.last_date else None)
+                               for status in statuses])
+    
+    check_csrf_header()
+    payload = request.get_json(silent=True)
+    entries = payload.get('updates') if isinstance(payload, dict) else payload
+    if not isinstance(entries, list) or not entries or not all(isinstance(entry, dict) for entry in entries):
+        return jsonify(errors=[dict(message='Expected a non-empty JSON array of updates')]), 400
+    if len(entries) > current_app.config['API_MAX_BATCH']:
+        return jsonify(errors=[dict(message=f"At most {current_app.config['API_MAX_BATCH']} updates per request")]), 413
+    updates, errors = validate_updates(entries)
+    if errors:
+        return jsonify(errors=errors), 422
+    
+    objects = create_updates(updates, current_user.id)
+    db.session.flush()
+    ids = [update.id for update in objects]
+    db.session.commit()
+    return jsonify(created=len(ids), ids=ids), 201
+
 @bp.route('/tasks')
 @login_required
 def tasks():
-    # Get all active brand tasks with upcoming due dates
+    # Active tasks due within the next 90 days, or every inactive task
     today = datetime.now().date()
+    status = 'inactive' if request.args.get('status') == 'inactive' else 'active'
+    
+    due = due_dates(is_active=status == 'active', today=today)
+    prime_users(d.completed_by_id for d in due.values())
+    listed_tasks = (BrandTask.query.filter_by(is_active=status == 'active')
+                    .join(Brand).join(Company)
+                    .options(contains_eager(BrandTask.brand).contains_eager(Brand.company),
+                             contains_eager(BrandTask.brand).selectinload(Brand.team_members)
+                             .joinedload(BrandTeam.team_member),
+                             joinedload(BrandTask.task_template))
+                    .order_by(Company.name, Brand.name)
+                    .all())
     
-    # Get all active tasks
-    active_tasks = BrandTask.query.filter_by(is_active=True).join(Brand).join(TaskTemplate).all()
-    
-    # Calculate due dates and organize by brand
     tasks_by_brand = {}
-    for task in active_tasks:
-        next_due = task.get_next_due_date()
-        
-        # Only show tasks that are due within the next 90 days
-        if next_due and (next_due - today).days <= 90:
-            if task.brand_id not in tasks_by_brand:
-                tasks_by_brand[task.brand_id] = {
-                    'brand': task.brand,
-                    'tasks': []
-                }
-            
-            # Check if already completed for this period
-            completed = TaskCompletion.query.filter(
-                TaskCompletion.brand_task_id == task.id,
-                TaskCompletion.completion_date >= next_due - timedelta(days=7)
-            ).first()
-            
-            tasks_by_brand[task.brand_id]['tasks'].append({
-                'task': task,
-                'next_due': next_due,
-                'is_overdue': next_due < today,
-                'is_completed': completed is not None,
-                'completion': completed
-            })
+    for task in listed_tasks:
+        task_due = due.get(task.id)
+        if task_due is None or (status == 'active' and (task_due.next_due - today).days > 90):
+            continue
+        tasks_by_brand.setdefault(task.brand_id, {'brand': task.brand, 'tasks': []})['tasks'].append({
+            'task': task,
+            'next_due': task_due.next_due,
+            'is_overdue': task_due.is_overdue,
+            'is_completed': task_due.is_completed,
+            'last_completion': task_due.last_completion,
+            'completed_by': db.session.get(User, task_due.completed_by_id) if task_due.completed_by_id else None
+        })
     
     # Sort tasks by due date within each brand
-    for brand_id in tasks_by_brand:
-        tasks_by_brand[brand_id]['tasks'].sort(key=lambda x: x['next_due'])
-    
-    return render_template('clients/tasks.html', tasks_by_brand=tasks_by_brand)
+    for brand_data in tasks_by_brand.values():
+        brand_data['tasks'].sort(key=lambda x: (x['next_due'], x['task'].task_template.name))
+    
+    form = TaskBatchForm()
+    form.completion_date.data = today
+    return render_template('clients/tasks.html', 
+                         tasks_by_brand=tasks_by_brand,
+                         status=status,
+                         form=form)
 
 @bp.route('/brand/<int:brand_id>/tasks')
 @login_required
@@ -831,29 +1048,29 @@ def brand_tasks(brand_id):
     # Get available templates (not yet assigned)
     available_templates = [t for t in templates if t.id not in assigned_template_ids]
     
-    # Calculate next due dates for active tasks
+    # Due dates of all the brand's tasks in one query; inactive tasks are listed last
+    due = due_dates(brand_ids=[brand_id])
+    prime_users(d.completed_by_id for d in due.values())
     tasks_with_due_dates = []
     for bt in brand_tasks:
-        if bt.is_active:
-            next_due = bt.get_next_due_date()
-            last_completion = TaskCompletion.query.filter_by(
-                brand_task_id=bt.id
-            ).order_by(TaskCompletion.completion_date.desc()).first()
-            
-            tasks_with_due_dates.append({
-                'task': bt,
-                'next_due': next_due,
-                'last_completion': last_completion,
-                'is_overdue': next_due < datetime.now().date() if next_due else False
-            })
+        task_due = due[bt.id]
+        tasks_with_due_dates.append({
+            'task': bt,
+            'next_due': task_due.next_due if bt.is_active else None,
+            'last_completion': task_due.last_completion,
+            'completed_by': db.session.get(User, task_due.completed_by_id) if task_due.completed_by_id else None,
+            'is_overdue': task_due.is_overdue if bt.is_active else False
+        })
     
     # Sort by next due date
     tasks_with_due_dates.sort(key=lambda x: x['next_due'] if x['next_due'] else datetime.max.date())
     
+    batch_form = TaskBatchForm()
     return render_template('clients/brand_tasks.html', 
                          brand=brand, 
                          tasks=tasks_with_due_dates,
-                         available_templates=available_templates)
+                         available_templates=available_templates,
+                         batch_form=batch_form)
 
 @bp.route('/brand/<int:brand_id>/task/new', methods=['GET', 'POST'])
 @login_required
@@ -914,16 +1131,101 @@ def complete_task(task_id):
     
     return render_template('clients/task_completion_form.html', form=form, task=task)
 
-@bp.route('/brand-task/<int:task_id>/toggle-active', methods=['POST'])
+def _task_id_list(values):
+    task_ids = []
+    for value in values:
+        try:
+            task_ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return task_ids
+
+def _apply_task_batch(action, task_ids, completion_date=None, notes=None):
+    """Run a batch action on ``task_ids``; returns the ids of the tasks it changed."""
+    if action == 'complete':
+        return complete_tasks(task_ids, current_user.id, completion_date or datetime.now().date(), notes or None)
+    return set_tasks_active(task_ids, action == 'activate')
+
+@bp.route('/tasks/batch', methods=['POST'])
 @login_required
-def toggle_task_active(task_id):
-    task = BrandTask.query.get_or_404(task_id)
-    task.is_active = not task.is_active
+def batch_tasks():
+    form = TaskBatchForm()
+    task_ids = _task_id_list(request.form.getlist('task_ids'))
+    if form.brand_id.data:
+        back = url_for('clients.brand_tasks', brand_id=form.brand_id.data)
+    else:
+        back = url_for('clients.tasks', status=request.args.get('status'))
+    
+    if not form.validate_on_submit():
+        flash('Invalid task action.', 'error')
+    elif not task_ids:
+        flash('Select at least one task.', 'error')
+    else:
+        changed = _apply_task_batch(form.action.data, task_ids, form.completion_date.data, form.notes.data)
+        db.session.commit()
+        done = {'complete': 'marked as complete!', 'activate': 'activated successfully!',
+                'deactivate': 'deactivated successfully!'}[form.action.data]
+        flash(f'{len(changed)} task{"s" if len(changed) != 1 else ""} {done}', 'success')
+    return redirect(back)
+
+@bp.route('/tasks/batch.json', methods=['POST'])
+@login_required
+def batch_tasks_data():
+    check_csrf_header()
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict) or payload.get('action') not in ('complete', 'activate', 'deactivate'):
+        return jsonify(errors=[dict(message='Expected an object with action complete, activate or deactivate')]), 400
+    task_ids = payload.get('task_ids')
+    if (not isinstance(task_ids, list) or not task_ids
+            or not all(isinstance(task_id, int) and not isinstance(task_id, bool) for task_id in task_ids)):
+        return jsonify(errors=[dict(field='task_ids', message='must be a non-empty array of task ids')]), 422
+    if len(task_ids) > current_app.config['API_MAX_BATCH']:
+        return jsonify(errors=[dict(message=f"At most {current_app.config['API_MAX_BATCH']} tasks per request")]), 413
+    notes = payload.get('notes')
+    if notes is not None and not isinstance(notes, str):
+        return jsonify(errors=[dict(field='notes', message='must be a string or null')]), 422
+    completion_date = None
+    if payload.get('completion_date'):
+        try:
+            completion_date = datetime.strptime(payload['completion_date'], '%Y-%m-%d').date()
+        except (TypeError, ValueError):
+            return jsonify(errors=[dict(field='completion_date', message='must be a date (YYYY-MM-DD)')]), 422
+    
+    changed = _apply_task_batch(payload['action'], task_ids, completion_date, notes)
     db.session.commit()
+    # Only the tasks of this request are recomputed
+    due = due_dates(task_ids=task_ids)
+    return jsonify(action=payload['action'],
+                   changed=sorted(changed),
+                   tasks=[dict(task._asdict(),
+                               next_due=task.next_due.isoformat(),
+                               last_completion=task.last_completion.isoformat() if task.last_completion else None)
+                          for task in due.values()])
+
+@bp.route('/tasks/assign', methods=['GET', 'POST'])
+@login_required
+def assign_tasks():
+    form = TaskAssignmentForm()
+    form.task_template_ids.choices = [(t.id, t.name) for t in TaskTemplate.query.order_by(TaskTemplate.name).all()]
+    form.brand_ids.choices = [(b.id, f"{b.name} ({b.company.name})") for b in
+                              Brand.query.filter(Brand.status == 'active').join(Company)
+                              .options(contains_eager(Brand.company))
+                              .order_by(Company.name, Brand.name).all()]
     
-    status = 'activated' if task.is_active else 'deactivated'
-    flash(f'Task {status} successfully!', 'success')
-    return redirect(url_for('clients.brand_tasks', brand_id=task.brand_id))
+    if form.validate_on_submit():
+        added, skipped = assign_templates(form.task_template_ids.data, form.brand_ids.data,
+                                          form.frequency.data, form.start_date.data, current_user.id)
+        db.session.commit()
+        message = f'{len(added)} task{"s" if len(added) != 1 else ""} assigned successfully!'
+        if skipped:
+            message += f' {skipped} already assigned task{"s were" if skipped != 1 else " was"} left unchanged.'
+        flash(message, 'success')
+        return redirect(url_for('clients.tasks'))
+    
+    if request.method == 'GET':
+        form.start_date.data = datetime.now().date()
+    
+    return render_template('clients/task_assign_form.html', form=form)
 
 @bp.route('/task-templates')
 @login_required
@@ -1019,7 +1321,7 @@ def delete_subcompany(subcompany_id):
     parent_company_id = subcompany.parent_company_id
     
     # Check if subcompany has its own subcompanies
-    if subcompany.subcompanies:
+    if subcompany.subcompany_count:
         flash('Cannot delete subcompany with existing sub-subcompanies.', 'error')
         return redirect(url_for('clients.companies'))
     
@@ -1080,16 +1382,78 @@ def invoices():
                          sort_by=sort_by,
                          page_total=page_total)
 
+def _invoice_analytics_options():
+    years = revenue_years() or [datetime.now().year]
+    year = request.args.get('year', type=int)
+    if year not in years:
+        year = datetime.now().year if datetime.now().year in years else years[0]
+    return dict(period=request.args.get('period', 'month'),
+                by=request.args.get('by', 'group'),
+                year=year,
+                company_id=request.args.get('company_id', type=int),
+                top=min(max(request.args.get('top', 10, type=int), 1), 100),
+                years=years)
+
+@bp.route('/invoices/analytics')
+@login_required
+def invoice_analytics():
+    options = _invoice_analytics_options()
+    periods, series = revenue_series(period=options['period'], by=options['by'],
+                                     year=options['year'], company_id=options['company_id'])
+    clients_by = options['by'] if options['by'] != 'total' else 'group'
+    companies = Company.query.order_by(Company.name).all()
+    
+    return render_template('clients/invoice_analytics.html',
+                         periods=[period_label(p, options['period']) for p in periods],
+                         series=series,
+                         period_totals=[sum(values) for values in zip(*[s.values for s in series])],
+                         top=top_clients(options['top'], year=options['year'], by=clients_by),
+                         comparison=year_over_year(options['year'], by=clients_by),
+                         aging=aging(by='group' if clients_by == 'group' else 'company'),
+                         aging_buckets=[label for _, label in AGING_BUCKETS],
+                         clients_by=clients_by,
+                         companies=companies,
+                         available_years=options['years'],
+                         selected_year=options['year'],
+                         selected_company_id=options['company_id'],
+                         period=options['period'],
+                         by=options['by'])
+
+@bp.route('/invoices/analytics.json')
+@login_required
+def invoice_analytics_data():
+    options = _invoice_analytics_options()
+    periods, series = revenue_series(period=options['period'], by=options['by'],
+                                     year=options['year'], company_id=options['company_id'])
+    clients_by = options['by'] if options['by'] != 'total' else 'group'
+    comparison = year_over_year(options['year'], by=clients_by)
+    return jsonify(
+        period=options['period'],
+        by=options['by'],
+        year=options['year'],
+        periods=[period_code(p, options['period']) for p in periods],
+        series=[dict(key=s.key, label=s.label, values=s.values, total=s.total) for s in series],
+        top_clients=[c._asdict() for c in top_clients(options['top'], year=options['year'], by=clients_by)],
+        year_over_year=dict(
+            year=comparison['year'],
+            through_month=comparison['through_month'],
+            months=[dict(month=m, current=current, previous=previous)
+                    for m, current, previous in comparison['months']],
+            clients=[c._asdict() for c in comparison['clients']],
+            total=comparison['total']._asdict()),
+        aging=dict(buckets=[label for _, label in AGING_BUCKETS],
+                   rows=[dict(key=key, label=label, amounts=amounts)
+                         for key, label, amounts in aging(by='group' if clients_by == 'group' else 'company')]))
+
 @bp.route('/brand/<int:brand_id>/invoice/new', methods=['GET', 'POST'])
 @login_required
 def new_invoice(brand_id):
     brand = Brand.query.get_or_404(brand_id)
     form = InvoiceForm()
     
-    # Get all companies (main company + subcompanies)
+    # Get all companies (main company + subcompanies at any depth)
     companies = [brand.company]
-    if brand.company.subcompanies:
-        companies.extend(brand.company.subcompanies)
+    companies += Company.query.filter(Company.id.in_(subtree_select(brand.company_id, include_self=False))).order_by(Company.name).all()
     form.company_id.choices = [(c.id, c.name) for c in companies]
     
     if form.validate_on_submit():
@@ -1106,28 +1470,19 @@ def new_invoice(brand_id):
         db.session.flush()  # Get the invoice ID before saving files
         
         # Handle multiple file uploads
-        if form.files.data:
-            file_count = 0
-            for file in form.files.data:
-                if file and allowed_file(file.filename):
-                    filename = secure_filename(file.filename)
-                    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                    filename = f"invoice_{invoice.id}_{timestamp}_{filename}"
-                    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                    file.save(file_path)
-                    
-                    attachment = InvoiceAttachment(
-                        invoice_id=invoice.id,
-                        filename=file.filename,
-                        file_path=filename
-                    )
-                    db.session.add(attachment)
-                    file_count += 1
-                    
-                    # For backward compatibility, store first file in invoice table
-                    if file_count == 1:
-                        invoice.filename = file.filename
-                        invoice.file_path = filename
+        for file_count, (filename, blob) in enumerate(form_uploads(form.files.data, allowed_file), 1):
+            attachment = InvoiceAttachment(
+                invoice_id=invoice.id,
+                filename=filename,
+                file_path=blob.path,
+                blob_sha256=blob.sha256
+            )
+            db.session.add(attachment)
+            
+            # For backward compatibility, store first file in invoice table
+            if file_count == 1:
+                invoice.filename = filename
+                invoice.file_path = blob.path
         
         db.session.commit()
         flash('Invoice registered successfully!', 'success')
@@ -1140,11 +1495,44 @@ def new_invoice(brand_id):
 def download_invoice(invoice_id):
     invoice = Invoice.query.get_or_404(invoice_id)
     if invoice.file_path:
-        return send_from_directory(current_app.config['UPLOAD_FOLDER'], invoice.file_path, 
-                                 as_attachment=True, download_name=invoice.filename)
+        return send_stored_file(invoice.file_path, as_attachment=True, download_name=invoice.filename)
+
+def _zip_response(entries, name):
+    response = Response(stream_zip(entries, current_app.config['UPLOAD_FOLDER']), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f'attachment; filename={secure_filename(name) or "attachments"}.zip'
+    # Let nginx pass the archive through as it is produced
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+def _parse_date(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+@bp.route('/brand/<int:brand_id>/attachments.zip')
+@login_required
+def brand_attachments_zip(brand_id):
+    brand = Brand.query.get_or_404(brand_id)
+    return _zip_response(brand_entries(brand), f'{brand.name}-attachments')
+
+@bp.route('/company/<int:company_id>/attachments.zip')
+@login_required
+def company_attachments_zip(company_id):
+    company = Company.query.get_or_404(company_id)
+    return _zip_response(company_entries(company), f'{company.name}-attachments')
+
+@bp.route('/invoices/attachments.zip')
+@login_required
+def invoice_attachments_zip():
+    start = request.args.get('start', type=_parse_date)
+    end = request.args.get('end', type=_parse_date)
+    entries = invoice_entries(start, end,
+                              brand_id=request.args.get('brand_id', type=int),
+                              company_id=request.args.get('company_id', type=int))
+    period = '_'.join(f'{d:%Y-%m-%d}' for d in (start, end) if d)
+    return _zip_response(entries, f'invoices-{period}' if period else 'invoices')
 
 @bp.route('/brands/export')
 @login_required
+@timed_export('brands')
 def export_brands():
     # Create workbook and worksheet
     wb = Workbook()
@@ -1203,6 +1591,7 @@ def export_brands():
 
 @bp.route('/contacts/export')
 @login_required
+@timed_export('contacts')
 def export_contacts():
     # Create workbook and worksheet
     wb = Workbook()
@@ -1254,6 +1643,7 @@ def export_contacts():
 
 @bp.route('/companies/export')
 @login_required
+@timed_export('companies')
 def export_companies():
     # Create workbook and worksheet
     wb = Workbook()
@@ -1348,6 +1738,37 @@ def media_planning(brand_id):
                          total_planned=total_planned,
                          total_actual=total_actual)
 
+@bp.route('/media-planning/rollup')
+@login_required
+def media_rollup():
+    rows_by = request.args.get('rows', 'company')
+    columns_by = request.args.get('columns', 'quarter')
+    company_id = request.args.get('company_id', type=int)
+    
+    years = rollup_years() or [datetime.now().year]
+    year = request.args.get('year', type=int)
+    if year not in years:
+        year = datetime.now().year if datetime.now().year in years else years[0]
+    
+    rows, columns, cells, row_totals, column_totals, total = pivot(
+        rows_by=rows_by, columns_by=columns_by, year=year, company_id=company_id)
+    companies = Company.query.order_by(Company.name).all()
+    
+    return render_template('clients/media_rollup.html',
+                         rows=rows,
+                         columns=columns,
+                         cells=cells,
+                         row_totals=row_totals,
+                         column_totals=column_totals,
+                         total=total,
+                         tolerance=overspend_tolerance(),
+                         companies=companies,
+                         available_years=years,
+                         selected_year=year,
+                         selected_company_id=company_id,
+                         rows_by=rows_by,
+                         columns_by=columns_by)
+
 @bp.route('/brand/<int:brand_id>/media-planning/add', methods=['GET', 'POST'])
 @login_required
 def add_media_plan(brand_id):
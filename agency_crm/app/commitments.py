@@ -0,0 +1,201 @@
+"""How far companies have met their yearly media group commitments.
+
+Media plans are assigned to media groups through ``MediaGroupMapping``: a
+mapping on the plan's channel name wins over one on its media type, and
+both match case-insensitively. Spend is pre-aggregated per company (the
+brand's own company), media group and year in ``commitment_spend``:
+
+* mapper events on ``MediaPlan`` apply each insert, update and delete to
+  the affected rows as a delta within the same flush;
+* changing the mappings, or moving a brand to another company, rebuilds
+  the table with a single INSERT ... SELECT ... GROUP BY.
+
+So the fulfilment page reads a handful of rows per commitment no matter how
+many plans there are. Commitments of a company include the spend of its
+subcompanies. ``rebuild_spend`` can also be called to recover from changes
+that bypassed the ORM.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from itertools import chain
+from sqlalchemy import event, inspect, select, insert, update, delete, func, case, and_, or_
+from sqlalchemy.orm import Session
+from app import db
+from app.hierarchy import subtrees as company_subtrees
+from app.models import Company, Brand, MediaGroup, MediaGroupMapping, Commitment, CommitmentSpend, MediaPlan
+
+PLAN_COLUMNS = ('brand_id', 'year', 'channel_name', 'media_type', 'planned_budget', 'actual_spend')
+
+Fulfilment = namedtuple('Fulfilment', 'commitment_id company_id company media_group year amount currency '
+                                      'actual open_budget projected progress shortfall')
+
+
+def _mapping_join(mapping, field, plan_column):
+    return and_(mapping.c.field == field, func.lower(mapping.c.value) == func.lower(plan_column))
+
+
+def rebuild_spend(connection=None):
+    """Recompute ``commitment_spend`` from all media plans in one grouped query."""
+    connection = connection or db.session.connection()
+    plans = MediaPlan.__table__
+    brands = Brand.__table__
+    spend = CommitmentSpend.__table__
+    channel_mapping = MediaGroupMapping.__table__.alias('channel_mapping')
+    type_mapping = MediaGroupMapping.__table__.alias('type_mapping')
+
+    group_id = func.coalesce(channel_mapping.c.media_group_id, type_mapping.c.media_group_id)
+    actual = func.coalesce(plans.c.actual_spend, 0)
+    open_budget = case((actual == 0, func.coalesce(plans.c.planned_budget, 0)), else_=0)
+    grouped = (
+        select(brands.c.company_id, group_id, plans.c.year, func.sum(actual), func.sum(open_budget),
+               func.count())
+        .select_from(plans.join(brands, brands.c.id == plans.c.brand_id)
+                     .outerjoin(channel_mapping, _mapping_join(channel_mapping, 'channel_name',
+                                                               plans.c.channel_name))
+                     .outerjoin(type_mapping, _mapping_join(type_mapping, 'media_type', plans.c.media_type)))
+        .where(group_id.isnot(None))
+        .group_by(brands.c.company_id, group_id, plans.c.year))
+
+    connection.execute(delete(spend))
+    connection.execute(insert(spend).from_select(
+        ['company_id', 'media_group_id', 'year', 'actual_spend', 'open_budget', 'plans'], grouped))
+
+
+def _resolve_group(connection, channel_name, media_type):
+    mapping = MediaGroupMapping.__table__
+    groups = dict(connection.execute(
+        select(mapping.c.field, mapping.c.media_group_id).where(or_(
+            _mapping_join(mapping, 'channel_name', channel_name),
+            _mapping_join(mapping, 'media_type', media_type)))).all())
+    return groups.get('channel_name', groups.get('media_type'))
+
+
+def _contribution(connection, brand_id, year, channel_name, media_type, planned_budget, actual_spend):
+    """The ``(key, actual, open budget)`` a plan adds to ``commitment_spend``, or None if unmapped."""
+    group_id = _resolve_group(connection, channel_name, media_type)
+    if group_id is None:
+        return None
+    brands = Brand.__table__
+    company_id = connection.scalar(select(brands.c.company_id).where(brands.c.id == brand_id))
+    actual = Decimal(actual_spend or 0)
+    open_budget = Decimal(planned_budget or 0) if not actual else Decimal(0)
+    return (company_id, group_id, year), actual, open_budget
+
+
+def _apply(connection, contribution, sign):
+    if contribution is None:
+        return
+    (company_id, group_id, year), actual, open_budget = contribution
+    spend = CommitmentSpend.__table__
+    key = and_(spend.c.company_id == company_id, spend.c.media_group_id == group_id, spend.c.year == year)
+    result = connection.execute(update(spend).where(key).values(
+        actual_spend=spend.c.actual_spend + sign * actual,
+        open_budget=spend.c.open_budget + sign * open_budget,
+        plans=spend.c.plans + sign))
+    if not result.rowcount and sign > 0:
+        connection.execute(insert(spend).values(company_id=company_id, media_group_id=group_id, year=year,
+                                                actual_spend=actual, open_budget=open_budget, plans=1))
+    elif sign < 0:
+        connection.execute(delete(spend).where(key, spend.c.plans <= 0))
+
+
+def _stored_contribution(connection, plan_id):
+    plans = MediaPlan.__table__
+    row = connection.execute(select(*[plans.c[name] for name in PLAN_COLUMNS])
+                             .where(plans.c.id == plan_id)).first()
+    return _contribution(connection, *row) if row is not None else None
+
+
+def _plan_inserted(mapper, connection, target):
+    _apply(connection, _contribution(connection, *[getattr(target, name) for name in PLAN_COLUMNS]), 1)
+
+
+def _plan_updating(mapper, connection, target):
+    state = inspect(target)
+    if not any(state.attrs[name].history.has_changes() for name in PLAN_COLUMNS):
+        return
+    # The row still holds the old values; the instance has the new ones
+    _apply(connection, _stored_contribution(connection, target.id), -1)
+    _apply(connection, _contribution(connection, *[getattr(target, name) for name in PLAN_COLUMNS]), 1)
+
+
+def _plan_deleting(mapper, connection, target):
+    _apply(connection, _stored_contribution(connection, target.id), -1)
+
+
+def _rebuild_if_remapped(session, flush_context):
+    remapped = any(isinstance(obj, MediaGroupMapping)
+                   for obj in chain(session.new, session.dirty, session.deleted))
+    moved = any(isinstance(obj, Brand) and inspect(obj).attrs.company_id.history.has_changes()
+                for obj in session.dirty)
+    if remapped or moved:
+        rebuild_spend(session.connection())
+
+
+def fulfilment(year=None, company_ids=None):
+    """Progress of commitments, optionally for one year or some companies.
+
+    ``projected`` adds the planned budget of plans without actual spend yet
+    to the spend so far; ``shortfall`` is what would still be missing then.
+    """
+    query = (select(Commitment.id, Commitment.company_id, Company.name, MediaGroup.id, MediaGroup.name,
+                    Commitment.year, Commitment.amount, Commitment.currency)
+             .join(Commitment.company).join(Commitment.media_group)
+             .order_by(Commitment.year.desc(), Company.name, MediaGroup.name))
+    if year:
+        query = query.where(Commitment.year == year)
+    if company_ids is not None:
+        query = query.where(Commitment.company_id.in_(company_ids))
+    commitments = db.session.execute(query).all()
+    if not commitments:
+        return []
+
+    years = {row[5] for row in commitments}
+    groups = {row[3] for row in commitments}
+    spend = {}
+    for company_id, group_id, spend_year, actual, open_budget in db.session.execute(
+            select(CommitmentSpend.company_id, CommitmentSpend.media_group_id, CommitmentSpend.year,
+                   CommitmentSpend.actual_spend, CommitmentSpend.open_budget)
+            .where(CommitmentSpend.year.in_(years), CommitmentSpend.media_group_id.in_(groups))):
+        spend[(company_id, group_id, spend_year)] = (Decimal(actual), Decimal(open_budget))
+
+    subtrees = company_subtrees({row[1] for row in commitments})
+    results = []
+    for commitment_id, company_id, company, group_id, group, commitment_year, amount, currency in commitments:
+        actual = open_budget = Decimal(0)
+        for member_id in subtrees.get(company_id, {company_id}):
+            member_actual, member_open = spend.get((member_id, group_id, commitment_year), (0, 0))
+            actual += member_actual
+            open_budget += member_open
+        projected = actual + open_budget
+        progress = float(actual / amount * 100) if amount else None
+        shortfall = max(amount - projected, Decimal(0))
+        results.append(Fulfilment(commitment_id, company_id, company, group, commitment_year, amount, currency,
+                                  actual, open_budget, projected, progress, shortfall))
+    return results
+
+
+def unmapped_plans(limit=50):
+    """Channel and media type combinations no mapping covers, with their spend."""
+    plans = MediaPlan.__table__
+    channel_mapping = MediaGroupMapping.__table__.alias('channel_mapping')
+    type_mapping = MediaGroupMapping.__table__.alias('type_mapping')
+    return db.session.execute(
+        select(plans.c.media_type, plans.c.channel_name, func.count(),
+               func.coalesce(func.sum(plans.c.actual_spend), 0))
+        .select_from(plans
+                     .outerjoin(channel_mapping, _mapping_join(channel_mapping, 'channel_name',
+                                                               plans.c.channel_name))
+                     .outerjoin(type_mapping, _mapping_join(type_mapping, 'media_type', plans.c.media_type)))
+        .where(channel_mapping.c.id.is_(None), type_mapping.c.id.is_(None))
+        .group_by(plans.c.media_type, plans.c.channel_name)
+        .order_by(func.sum(plans.c.actual_spend).desc())
+        .limit(limit)).all()
+
+
+def init_app(app):
+    if not event.contains(MediaPlan, 'after_insert', _plan_inserted):
+        event.listen(MediaPlan, 'after_insert', _plan_inserted)
+        event.listen(MediaPlan, 'before_update', _plan_updating)
+        event.listen(MediaPlan, 'before_delete', _plan_deleting)
+        event.listen(Session, 'after_flush', _rebuild_if_remapped)
@@ -0,0 +1,148 @@
+"""Denormalized row counts on companies and brands.
+
+List pages show how many brands, subcompanies, contacts, team members,
+active tasks and invoices a company or brand has. Counting them through
+relationship collections loads every row, so the counts are stored in
+columns instead:
+
+* ``Company``: ``brand_count``, ``subcompany_count``, ``invoice_count``
+* ``Brand``: ``contact_count``, ``team_member_count``, ``active_task_count``,
+  ``invoice_count``
+
+After each flush the companies and brands touched by it are recounted with
+one correlated ``UPDATE`` per table, so the stored counts are exact rather
+than accumulated deltas. Link tables written with Core statements (see
+``app.associations``) call ``refresh_counters`` themselves, and
+``reconcile_counters.py`` recounts everything after changes that bypassed
+both.
+"""
+from sqlalchemy import event, inspect, select, update, func, or_
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.base import NO_VALUE
+from sqlalchemy.orm.util import identity_key
+from app import db
+from app.models import Company, Brand, BrandTeam, BrandTask, ClientContact, Invoice, brand_contacts
+
+# The stored counts, recounted rather than written by the app
+COUNTER_COLUMNS = {
+    Company: ('brand_count', 'subcompany_count', 'invoice_count'),
+    Brand: ('contact_count', 'team_member_count', 'active_task_count', 'invoice_count'),
+}
+# Attributes whose changes move rows between the counts of a company or brand
+_COMPANY_KEYS = {Company: ('parent_company_id',), Brand: ('company_id',), Invoice: ('company_id',)}
+_BRAND_KEYS = {Invoice: ('brand_id',), BrandTeam: ('brand_id',), BrandTask: ('brand_id', 'is_active')}
+
+
+def _count(table, *conditions):
+    return select(func.count()).select_from(table).where(*conditions).scalar_subquery()
+
+
+def _company_counts():
+    companies = Company.__table__
+    subcompanies = companies.alias('subcompanies')
+    brands = Brand.__table__
+    invoices = Invoice.__table__
+    return {
+        'brand_count': _count(brands, brands.c.company_id == companies.c.id),
+        'subcompany_count': _count(subcompanies, subcompanies.c.parent_company_id == companies.c.id),
+        'invoice_count': _count(invoices, invoices.c.company_id == companies.c.id),
+    }
+
+
+def _brand_counts():
+    brands = Brand.__table__
+    tasks = BrandTask.__table__
+    teams = BrandTeam.__table__
+    invoices = Invoice.__table__
+    return {
+        'contact_count': _count(brand_contacts, brand_contacts.c.brand_id == brands.c.id),
+        'team_member_count': _count(teams, teams.c.brand_id == brands.c.id),
+        'active_task_count': _count(tasks, tasks.c.brand_id == brands.c.id, tasks.c.is_active == True),
+        'invoice_count': _count(invoices, invoices.c.brand_id == brands.c.id),
+    }
+
+
+def refresh_counters(company_ids=(), brand_ids=(), session=None):
+    """Recount the given companies and brands; pass ``None`` to recount all of them."""
+    session = session or db.session()
+    connection = session.connection()
+    for model, ids, counts in ((Company, company_ids, _company_counts()), (Brand, brand_ids, _brand_counts())):
+        if ids is not None and not ids:
+            continue
+        table = model.__table__
+        # Recounting is not an edit: keep columns such as updated_at from firing their onupdate
+        untouched = {column.name: column for column in table.columns if column.onupdate is not None}
+        statement = update(table).values(**counts, **untouched)
+        if ids is not None:
+            statement = statement.where(table.c.id.in_(ids))
+        connection.execute(statement)
+        _expire_counters(session, model, ids, counts)
+
+
+def counter_drift():
+    """Ids of the companies and brands whose stored counts are wrong."""
+    drift = []
+    for model, counts in ((Company, _company_counts()), (Brand, _brand_counts())):
+        table = model.__table__
+        drift.append(db.session.scalars(select(table.c.id).where(
+            or_(*[table.c[name] != count for name, count in counts.items()]))).all())
+    return tuple(drift)
+
+
+def _expire_counters(session, model, ids, attributes):
+    if ids is None:
+        objects = [obj for obj in session.identity_map.values() if isinstance(obj, model)]
+    else:
+        objects = [session.identity_map.get(identity_key(model, pk)) for pk in ids]
+    for obj in objects:
+        if obj is not None and obj not in session.deleted:
+            session.expire(obj, list(attributes))
+
+
+def _touched(obj, names, changed_only):
+    """Old and new values of the first of ``names``, if any of them changed (or always)."""
+    state = inspect(obj)
+    if changed_only and not any(state.attrs[name].history.has_changes() for name in names):
+        return []
+    key = state.attrs[names[0]]
+    return [value for value in [key.value] + list(key.history.deleted) if value is not None]
+
+
+def _contact_brand_ids(obj, changed_only):
+    attr = inspect(obj).attrs.brands
+    if attr.loaded_value is NO_VALUE or (changed_only and not attr.history.has_changes()):
+        return set()
+    return {brand.id for brand in list(attr.loaded_value) + list(attr.history.deleted) if brand.id is not None}
+
+
+def _collect(session, flush_context):
+    company_ids = set()
+    brand_ids = set()
+    changes = [(obj, False) for obj in session.new] + [(obj, False) for obj in session.deleted]
+    changes += [(obj, True) for obj in session.dirty]
+    for obj, changed_only in changes:
+        model = type(obj)
+        if model in _COMPANY_KEYS:
+            company_ids.update(_touched(obj, _COMPANY_KEYS[model], changed_only))
+        if model in _BRAND_KEYS:
+            brand_ids.update(_touched(obj, _BRAND_KEYS[model], changed_only))
+        if model is Brand and (obj in session.new or inspect(obj).attrs.contacts.history.has_changes()):
+            brand_ids.add(obj.id)
+        elif model is ClientContact:
+            brand_ids.update(_contact_brand_ids(obj, changed_only))
+    if company_ids or brand_ids:
+        pending = session.info.setdefault('counter_ids', (set(), set()))
+        pending[0].update(company_ids)
+        pending[1].update(brand_ids)
+
+
+def _apply(session, flush_context):
+    pending = session.info.pop('counter_ids', None)
+    if pending is not None:
+        refresh_counters(*pending, session=session)
+
+
+def init_app(app):
+    if not event.contains(Session, 'after_flush', _collect):
+        event.listen(Session, 'after_flush', _collect)
+        event.listen(Session, 'after_flush_postexec', _apply)
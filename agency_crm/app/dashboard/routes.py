@@ -1,7 +1,9 @@
-from flask import render_template
+from flask import render_template, request, jsonify
 from flask_login import login_required, current_user
 from app.dashboard import bp
-from app.models import Company, Brand, ClientContact, StatusUpdate, Agreement, Invoice, KeyMeeting, BrandTeam
+from app.models import Company, Brand, ClientContact, StatusUpdate, Agreement, Invoice, KeyMeeting, BrandTeam, BrandHealthSnapshot
+from app.health_snapshots import (daily_trend, brand_trend, snapshot_range,
+                                  UPDATE_OVERDUE_DAYS, MEETING_OVERDUE_DAYS)
 from sqlalchemy import desc
 from datetime import datetime, timedelta
 
@@ -30,7 +32,7 @@ def index():
         last_update = StatusUpdate.query.filter_by(brand_id=brand.id).order_by(desc(StatusUpdate.date)).first()
         if last_update:
             days_since_update = (datetime.now().date() - last_update.date).days
-            update_overdue = days_since_update > 14
+            update_overdue = days_since_update > UPDATE_OVERDUE_DAYS
             last_evaluation = last_update.evaluation
         else:
             days_since_update = None
@@ -50,7 +52,7 @@ def index():
         last_meeting = KeyMeeting.query.filter_by(brand_id=brand.id).order_by(desc(KeyMeeting.date)).first()
         if last_meeting:
             days_since_meeting = (datetime.now().date() - last_meeting.date).days
-            meeting_overdue = days_since_meeting > 30
+            meeting_overdue = days_since_meeting > MEETING_OVERDUE_DAYS
         else:
             days_since_meeting = None
             meeting_overdue = True
@@ -73,4 +75,46 @@ def index():
     brands_data.sort(key=lambda x: (x['brand'].company.name, x['brand'].name))
     
     return render_template('dashboard/index.html',
-                         brands_data=brands_data)
\ No newline at end of file
+                         brands_data=brands_data)
+
+def _trend_range():
+    """The ``start``/``end`` query arguments, defaulting to the last 90 days."""
+    end = request.args.get('end', type=lambda v: datetime.strptime(v, '%Y-%m-%d').date()) or datetime.now().date()
+    start = request.args.get('start', type=lambda v: datetime.strptime(v, '%Y-%m-%d').date()) or end - timedelta(days=89)
+    return start, end
+
+@bp.route('/trends')
+@login_required
+def trends():
+    start, end = _trend_range()
+    company_id = request.args.get('company_id', type=int)
+    days = daily_trend(start, end, company_id=company_id)
+    companies = Company.query.order_by(Company.name).all()
+    first_day, last_day = snapshot_range()
+    
+    return render_template('dashboard/trends.html',
+                         days=days,
+                         companies=companies,
+                         start=start,
+                         end=end,
+                         first_day=first_day,
+                         last_day=last_day,
+                         selected_company_id=company_id)
+
+@bp.route('/trends.json')
+@login_required
+def trends_data():
+    start, end = _trend_range()
+    days = daily_trend(start, end, company_id=request.args.get('company_id', type=int))
+    return jsonify(start=start.isoformat(), end=end.isoformat(),
+                   days=[dict(day._asdict(), date=day.date.isoformat()) for day in days])
+
+@bp.route('/trends/brand/<int:brand_id>.json')
+@login_required
+def brand_trend_data(brand_id):
+    start, end = _trend_range()
+    columns = [column.name for column in BrandHealthSnapshot.__table__.columns
+               if column.name not in ('snapshot_date', 'brand_id')]
+    return jsonify(brand_id=brand_id, start=start.isoformat(), end=end.isoformat(),
+                   days=[dict({name: getattr(row, name) for name in columns}, date=row.snapshot_date.isoformat())
+                         for row in brand_trend(brand_id, start, end)])
\ No newline at end of file
@@ -0,0 +1,76 @@
+"""Serving stored attachments.
+
+With FILE_OFFLOAD set, the worker only checks access and answers with a
+header telling the front proxy which file to send, so a slow download never
+holds a gunicorn worker:
+
+* ``x-accel`` - nginx ``X-Accel-Redirect`` to FILE_OFFLOAD_PREFIX + path,
+  an ``internal`` location aliased to UPLOAD_FOLDER;
+* ``x-sendfile`` - ``X-Sendfile`` with the absolute path (Apache
+  mod_xsendfile, lighttpd).
+
+The proxy then handles Range requests itself. Without offloading the file is
+sent by werkzeug, which answers Range and conditional requests and hands the
+open file to the server's ``wsgi.file_wrapper`` so gunicorn can use
+sendfile(2) instead of copying it through Python.
+
+Blob files never change, so they are sent with their SHA-256 as a strong
+ETag and a year-long immutable (but private, as they sit behind login)
+Cache-Control.
+"""
+import os
+from urllib.parse import quote
+from flask import current_app, request, abort
+from werkzeug.security import safe_join
+from werkzeug.utils import send_file
+from app import db
+from app.models import Blob
+
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+OFFLOAD_MODES = ('x-accel', 'x-sendfile')
+
+
+def send_upload(relative_path, mimetype=None, as_attachment=False, download_name=None, sha256=None):
+    """Send a file from UPLOAD_FOLDER; pass ``sha256`` for immutable blob files."""
+    path = safe_join(current_app.config['UPLOAD_FOLDER'], relative_path)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mode = current_app.config['FILE_OFFLOAD']
+    offload = mode in OFFLOAD_MODES
+    response = send_file(
+        path, request.environ,
+        mimetype=mimetype,
+        as_attachment=as_attachment,
+        download_name=download_name or os.path.basename(path),
+        # Ranges are left to the proxy when offloading
+        conditional=not offload,
+        etag=sha256 or True,
+        max_age=IMMUTABLE_MAX_AGE if sha256 else None,
+        use_x_sendfile=offload,
+        response_class=current_app.response_class,
+    )
+    if sha256:
+        response.cache_control.public = None
+        response.cache_control.private = True
+        response.cache_control.immutable = True
+
+    if offload:
+        response.make_conditional(request.environ)
+        if response.status_code == 304:
+            response.headers.pop('X-Sendfile', None)
+        elif mode == 'x-accel':
+            del response.headers['X-Sendfile']
+            response.headers['X-Accel-Redirect'] = current_app.config['FILE_OFFLOAD_PREFIX'] + quote(relative_path)
+    return response
+
+
+def send_stored_file(file_path, **kwargs):
+    """Send a ``file_path`` as stored on an attachment row, blob or legacy flat file."""
+    blob = None
+    if file_path.startswith('blobs/'):
+        blob = db.session.get(Blob, os.path.basename(file_path))
+    if blob is None:
+        return send_upload(file_path, **kwargs)
+    # Blob files have no extension, so the type comes from the row
+    return send_upload(blob.path, mimetype=blob.content_type, sha256=blob.sha256, **kwargs)
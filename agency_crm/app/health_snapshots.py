@@ -0,0 +1,149 @@
+"""Daily snapshots of brand health for trend reporting.
+
+The dashboard only shows the current state. ``take_snapshot`` stores the
+same health metrics (last evaluation, days since the last status update and
+key meeting, overdue flags, valid agreements, a key responsible) for every
+active brand as one narrow row per brand and day in
+``brand_health_snapshots``. The rows are computed with a handful of grouped
+queries and upserted on ``(snapshot_date, brand_id)``, so running the job
+twice on a day, or backfilling days already taken, just rewrites them.
+
+Trends read date ranges straight from the primary key (date first) or the
+``(brand_id, snapshot_date)`` index, without touching the raw records.
+Backfilled days use status updates, meetings and agreements as of that
+day; brand status and team assignments are only known as they are now.
+"""
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import select, delete, func, case, or_
+from sqlalchemy.dialects import postgresql, sqlite
+from app import db
+from app.hierarchy import subtree_select
+from app.models import Brand, BrandTeam, StatusUpdate, KeyMeeting, Agreement, BrandHealthSnapshot
+
+UPDATE_OVERDUE_DAYS = 14
+MEETING_OVERDUE_DAYS = 30
+EVALUATIONS = ('perfect', 'medium', 'risk')
+
+DayTrend = namedtuple('DayTrend', 'date brands perfect medium risk no_evaluation update_overdue meeting_overdue '
+                                  'missing_service_agreement missing_data_agreement no_key_responsible')
+
+
+def health_rows(as_of):
+    """Snapshot rows for every active brand as of the end of ``as_of``."""
+    brands = db.session.execute(select(Brand.id, Brand.company_id).where(Brand.status == 'active')).all()
+    if not brands:
+        return []
+
+    ranked = (select(StatusUpdate.brand_id, StatusUpdate.date, StatusUpdate.evaluation,
+                     func.row_number().over(partition_by=StatusUpdate.brand_id,
+                                            order_by=(StatusUpdate.date.desc(), StatusUpdate.id.desc()))
+                     .label('position'))
+              .where(StatusUpdate.date <= as_of).subquery())
+    updates = {brand_id: (update_date, evaluation) for brand_id, update_date, evaluation in db.session.execute(
+        select(ranked.c.brand_id, ranked.c.date, ranked.c.evaluation).where(ranked.c.position == 1))}
+    meetings = dict(db.session.execute(
+        select(KeyMeeting.brand_id, func.max(KeyMeeting.date))
+        .where(KeyMeeting.date <= as_of).group_by(KeyMeeting.brand_id)).all())
+    agreements = set(db.session.execute(
+        select(Agreement.company_id, Agreement.type).distinct()
+        .where(Agreement.uploaded_at < datetime.combine(as_of + timedelta(days=1), time()),
+               or_(Agreement.valid_until.is_(None), Agreement.valid_until >= as_of))).all())
+    key_responsible = set(db.session.scalars(
+        select(BrandTeam.brand_id).distinct().where(BrandTeam.is_key_responsible == True)))
+
+    rows = []
+    for brand_id, company_id in brands:
+        update_date, evaluation = updates.get(brand_id, (None, None))
+        meeting_date = meetings.get(brand_id)
+        days_since_update = (as_of - update_date).days if update_date else None
+        days_since_meeting = (as_of - meeting_date).days if meeting_date else None
+        rows.append(dict(
+            snapshot_date=as_of,
+            brand_id=brand_id,
+            company_id=company_id,
+            evaluation=evaluation,
+            days_since_update=days_since_update,
+            update_overdue=days_since_update is None or days_since_update > UPDATE_OVERDUE_DAYS,
+            days_since_meeting=days_since_meeting,
+            meeting_overdue=days_since_meeting is None or days_since_meeting > MEETING_OVERDUE_DAYS,
+            has_service_agreement=(company_id, 'service') in agreements,
+            has_data_agreement=(company_id, 'data') in agreements,
+            has_key_responsible=brand_id in key_responsible,
+        ))
+    return rows
+
+
+def _upsert(rows):
+    table = BrandHealthSnapshot.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        statement = (sqlite if dialect == 'sqlite' else postgresql).insert(table)
+        statement = statement.on_conflict_do_update(
+            index_elements=[table.c.snapshot_date, table.c.brand_id],
+            set_={column.name: statement.excluded[column.name] for column in table.columns
+                  if not column.primary_key})
+        db.session.execute(statement, rows)
+    else:
+        for row in rows:
+            db.session.execute(delete(table).where(table.c.snapshot_date == row['snapshot_date'],
+                                                   table.c.brand_id == row['brand_id']))
+        db.session.execute(table.insert(), rows)
+
+
+def take_snapshot(as_of=None):
+    """Store the health of every active brand on ``as_of`` (default today).
+
+    Idempotent: rows of that day are updated in place and rows of brands no
+    longer active are dropped. Returns the number of brands stored; the
+    caller commits.
+    """
+    as_of = as_of or date.today()
+    table = BrandHealthSnapshot.__table__
+    rows = health_rows(as_of)
+    db.session.execute(delete(table).where(
+        table.c.snapshot_date == as_of, table.c.brand_id.not_in([row['brand_id'] for row in rows])))
+    if rows:
+        _upsert(rows)
+    return len(rows)
+
+
+def _flag_count(condition):
+    return func.sum(case((condition, 1), else_=0))
+
+
+def daily_trend(start, end, company_id=None):
+    """Health totals per snapshot day between ``start`` and ``end``, oldest first.
+
+    ``company_id`` limits them to brands of that company and its subcompanies.
+    """
+    snapshot = BrandHealthSnapshot
+    query = (select(snapshot.snapshot_date, func.count(),
+                    *[_flag_count(snapshot.evaluation == evaluation) for evaluation in EVALUATIONS],
+                    _flag_count(snapshot.evaluation.is_(None)),
+                    _flag_count(snapshot.update_overdue == True),
+                    _flag_count(snapshot.meeting_overdue == True),
+                    _flag_count(snapshot.has_service_agreement == False),
+                    _flag_count(snapshot.has_data_agreement == False),
+                    _flag_count(snapshot.has_key_responsible == False))
+             .where(snapshot.snapshot_date.between(start, end))
+             .group_by(snapshot.snapshot_date)
+             .order_by(snapshot.snapshot_date))
+    if company_id:
+        query = query.where(snapshot.company_id.in_(subtree_select(company_id)))
+    return [DayTrend(*row) for row in db.session.execute(query)]
+
+
+def brand_trend(brand_id, start, end):
+    """The snapshots of one brand between ``start`` and ``end``, oldest first."""
+    return db.session.scalars(
+        select(BrandHealthSnapshot)
+        .where(BrandHealthSnapshot.brand_id == brand_id,
+               BrandHealthSnapshot.snapshot_date.between(start, end))
+        .order_by(BrandHealthSnapshot.snapshot_date)).all()
+
+
+def snapshot_range():
+    """The first and last snapshot days, or ``(None, None)`` before the first run."""
+    return tuple(db.session.execute(
+        select(func.min(BrandHealthSnapshot.snapshot_date), func.max(BrandHealthSnapshot.snapshot_date))).one())
@@ -0,0 +1,174 @@
+"""Company hierarchies of any depth.
+
+``Company.parent_company_id`` forms a tree. Rather than keeping a closure
+table in sync with every move, the closure is computed on demand by a
+recursive CTE: ``closure()`` yields an ``(ancestor_id, company_id, depth)``
+row for every company and each of its descendants, itself included at
+depth 0. Ancestors, descendants, depths and cycle checks are then one query
+each, and roll-ups over whole subtrees are plain joins against it.
+
+Moving a company below one of its own subcompanies is refused at flush
+time. Recursion also stops at ``MAX_DEPTH`` levels, so a parent cycle that
+slipped in through raw SQL cannot make a query run forever.
+"""
+from collections import namedtuple, defaultdict
+from decimal import Decimal
+from sqlalchemy import event, inspect, select, func, literal, exists
+from sqlalchemy.orm import Session, aliased
+from app import db
+from app.models import Company, Brand, Invoice, Commitment
+
+MAX_DEPTH = 32
+
+SubtreeTotals = namedtuple('SubtreeTotals', 'companies brands invoices invoiced commitments committed')
+
+
+def closure(company_ids=None):
+    """Recursive CTE of ``(ancestor_id, company_id, depth)`` rows.
+
+    Limited to the subtrees of ``company_ids`` (ids or a SELECT of ids) when
+    given.
+    """
+    seed = select(Company.id.label('ancestor_id'), Company.id.label('company_id'), literal(0).label('depth'))
+    if company_ids is not None:
+        seed = seed.where(Company.id.in_(company_ids))
+    tree = seed.cte('company_closure', recursive=True)
+    child = aliased(Company)
+    return tree.union_all(
+        select(tree.c.ancestor_id, child.id, tree.c.depth + 1)
+        .where(child.parent_company_id == tree.c.company_id, tree.c.depth < MAX_DEPTH))
+
+
+def subtree_select(company_id, include_self=True):
+    """A SELECT of the ids in the subtree of a company, usable with ``in_()``."""
+    tree = closure([company_id])
+    query = select(tree.c.company_id).distinct()
+    if not include_self:
+        query = query.where(tree.c.depth > 0)
+    return query
+
+
+def descendant_ids(company_id, include_self=True):
+    return db.session.scalars(subtree_select(company_id, include_self)).all()
+
+
+def _ancestors(company_id):
+    first = select(Company.parent_company_id.label('company_id'), literal(1).label('depth')).where(
+        Company.id == company_id, Company.parent_company_id.isnot(None))
+    chain = first.cte('company_ancestors', recursive=True)
+    parent = aliased(Company)
+    return chain.union_all(
+        select(parent.parent_company_id, chain.c.depth + 1)
+        .where(parent.id == chain.c.company_id, parent.parent_company_id.isnot(None),
+               chain.c.depth < MAX_DEPTH))
+
+
+def ancestor_ids(company_id):
+    """Ids of the parents of a company, nearest first."""
+    chain = _ancestors(company_id)
+    return db.session.scalars(select(chain.c.company_id).order_by(chain.c.depth)).all()
+
+
+def ancestors(company_id):
+    """Parent companies, root first, for breadcrumbs."""
+    chain = _ancestors(company_id)
+    return db.session.scalars(select(Company).join(chain, Company.id == chain.c.company_id)
+                              .order_by(chain.c.depth.desc())).all()
+
+
+def depth(company_id):
+    """How many levels below its root a company sits; roots are at 0."""
+    chain = _ancestors(company_id)
+    return db.session.scalar(select(func.count()).select_from(chain))
+
+
+def would_create_cycle(company_id, parent_id, connection=None):
+    """Whether making ``parent_id`` the parent of ``company_id`` would close a loop."""
+    if not parent_id or not company_id:
+        return False
+    tree = closure([company_id])
+    return (connection or db.session).scalar(select(exists().where(tree.c.company_id == parent_id)))
+
+
+def subtrees(company_ids=None):
+    """Map each company id to the set of ids in its subtree, itself included."""
+    tree = closure(company_ids)
+    result = defaultdict(set)
+    for ancestor_id, company_id in db.session.execute(select(tree.c.ancestor_id, tree.c.company_id)):
+        result[ancestor_id].add(company_id)
+    return result
+
+
+def group_roots():
+    """Map each company id to the id of the top-level company of its group."""
+    tree = closure(select(Company.id).where(Company.parent_company_id.is_(None)))
+    return dict(db.session.execute(select(tree.c.company_id, tree.c.ancestor_id)).all())
+
+
+def company_tree(companies):
+    """Group companies under their parents.
+
+    Returns ``(roots, children)`` where ``children`` maps a company id to its
+    direct subcompanies. Companies whose parent is not among ``companies``
+    count as roots.
+    """
+    by_id = {company.id: company for company in companies}
+    roots = []
+    children = defaultdict(list)
+    for company in companies:
+        if company.parent_company_id in by_id and company.parent_company_id != company.id:
+            children[company.parent_company_id].append(company)
+        else:
+            roots.append(company)
+    return roots, children
+
+
+def subtree_totals(company_ids=None):
+    """Brand, invoice and commitment totals over the subtree of each company.
+
+    Returns a dict of ``SubtreeTotals`` by company id; ``committed`` maps
+    currencies to the committed amount.
+    """
+    # Distinct pairs, so a company reached twice is not summed twice
+    pairs = closure(company_ids)
+    tree = select(pairs.c.ancestor_id, pairs.c.company_id).distinct().subquery()
+    companies = dict(db.session.execute(
+        select(tree.c.ancestor_id, func.count() - 1)
+        .group_by(tree.c.ancestor_id)).all())
+    brands = dict(db.session.execute(
+        select(tree.c.ancestor_id, func.count(Brand.id))
+        .join(Brand, Brand.company_id == tree.c.company_id)
+        .group_by(tree.c.ancestor_id)).all())
+    invoices = {ancestor_id: (count, Decimal(str(total or 0))) for ancestor_id, count, total in db.session.execute(
+        select(tree.c.ancestor_id, func.count(Invoice.id), func.sum(Invoice.total_amount))
+        .join(Invoice, Invoice.company_id == tree.c.company_id)
+        .group_by(tree.c.ancestor_id))}
+    commitments = defaultdict(int)
+    committed = defaultdict(dict)
+    for ancestor_id, currency, count, total in db.session.execute(
+            select(tree.c.ancestor_id, Commitment.currency, func.count(Commitment.id),
+                   func.sum(Commitment.amount))
+            .join(Commitment, Commitment.company_id == tree.c.company_id)
+            .group_by(tree.c.ancestor_id, Commitment.currency)):
+        commitments[ancestor_id] += count
+        committed[ancestor_id][currency or 'EUR'] = Decimal(str(total or 0))
+
+    return {company_id: SubtreeTotals(subcompanies, brands.get(company_id, 0),
+                                      *invoices.get(company_id, (0, Decimal(0))),
+                                      commitments[company_id], committed[company_id])
+            for company_id, subcompanies in companies.items()}
+
+
+def _refuse_cycles(session, flush_context, instances):
+    for obj in session.dirty:
+        if not isinstance(obj, Company) or not inspect(obj).attrs.parent_company_id.history.has_changes():
+            continue
+        # The rows still hold the old parents, which is the tree being moved within
+        if obj.parent_company_id == obj.id or would_create_cycle(obj.id, obj.parent_company_id,
+                                                                 session.connection()):
+            raise ValueError(f'Company {obj.id} cannot become a subcompany of its own subcompany')
+
+
+def init_app(app):
+    if not event.contains(Session, 'before_flush', _refuse_cycles):
+        event.listen(Session, 'before_flush', _refuse_cycles)
@@ -0,0 +1,148 @@
+"""Per-request timing: Server-Timing headers and a slow-request log.
+
+Every request collects wall time, SQL time and statement count (through
+SQLAlchemy cursor events), template render time (through Flask's template
+signals) and file I/O time (through ``io_timer``). The totals are sent back
+as a ``Server-Timing`` header, and requests slower than
+``SLOW_REQUEST_THRESHOLD_MS`` are logged as one JSON line together with
+their slowest SQL statements.
+"""
+import heapq
+import json
+import time
+from contextlib import contextmanager
+from flask import g, request, has_app_context, before_render_template, template_rendered
+from sqlalchemy import event
+
+
+class RequestTimings:
+    """Timing counters for a single request."""
+
+    def __init__(self, sql_limit=5):
+        self.started = time.perf_counter()
+        self.sql_time = 0.0
+        self.sql_count = 0
+        self.template_time = 0.0
+        self.io_time = 0.0
+        self.sql_limit = sql_limit
+        self._slowest_sql = []
+        self._template_starts = []
+
+    @property
+    def total_time(self):
+        return time.perf_counter() - self.started
+
+    def add_sql(self, statement, parameters, duration):
+        self.sql_time += duration
+        self.sql_count += 1
+        # Keep a bounded min-heap so only the N slowest statements are retained
+        entry = (duration, self.sql_count, statement, parameters)
+        if len(self._slowest_sql) < self.sql_limit:
+            heapq.heappush(self._slowest_sql, entry)
+        elif duration > self._slowest_sql[0][0]:
+            heapq.heapreplace(self._slowest_sql, entry)
+
+    def slowest_sql(self):
+        return [
+            {'ms': round(duration * 1000, 2), 'statement': statement, 'parameters': _short_repr(parameters)}
+            for duration, _, statement, parameters in sorted(self._slowest_sql, reverse=True)
+        ]
+
+    def server_timing(self):
+        return ', '.join([
+            f'db;dur={self.sql_time * 1000:.1f};desc="{self.sql_count} queries"',
+            f'tpl;dur={self.template_time * 1000:.1f}',
+            f'io;dur={self.io_time * 1000:.1f}',
+            f'total;dur={self.total_time * 1000:.1f}',
+        ])
+
+
+def _short_repr(value, limit=500):
+    text = repr(value)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def current_timings():
+    """Return the timings of the active request, or None outside a request."""
+    if has_app_context():
+        return g.get('request_timings')
+    return None
+
+
+@contextmanager
+def io_timer():
+    """Count the wrapped block towards the request's file I/O time."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings = current_timings()
+        if timings is not None:
+            timings.io_time += time.perf_counter() - start
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info['query_start_time'].pop()
+    timings = current_timings()
+    if timings is not None:
+        timings.add_sql(statement, parameters, time.perf_counter() - start)
+
+
+def _template_started(sender, template, context, **extra):
+    timings = current_timings()
+    if timings is not None:
+        timings._template_starts.append(time.perf_counter())
+
+
+def _template_finished(sender, template, context, **extra):
+    timings = current_timings()
+    if timings is not None and timings._template_starts:
+        started = timings._template_starts.pop()
+        # Only count the outermost render so nested render_template calls are not doubled
+        if not timings._template_starts:
+            timings.template_time += time.perf_counter() - started
+
+
+def init_app(app, db):
+    with app.app_context():
+        engine = db.engine
+        if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    before_render_template.connect(_template_started, app)
+    template_rendered.connect(_template_finished, app)
+
+    @app.before_request
+    def start_request_timings():
+        g.request_timings = RequestTimings(sql_limit=app.config['SLOW_REQUEST_SQL_LIMIT'])
+
+    @app.after_request
+    def finish_request_timings(response):
+        timings = current_timings()
+        if timings is None:
+            return response
+
+        if app.config['SERVER_TIMING_ENABLED']:
+            response.headers['Server-Timing'] = timings.server_timing()
+
+        total_ms = timings.total_time * 1000
+        if total_ms >= app.config['SLOW_REQUEST_THRESHOLD_MS']:
+            app.logger.warning(json.dumps({
+                'event': 'slow_request',
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'total_ms': round(total_ms, 2),
+                'sql_ms': round(timings.sql_time * 1000, 2),
+                'sql_count': timings.sql_count,
+                'template_ms': round(timings.template_time * 1000, 2),
+                'io_ms': round(timings.io_time * 1000, 2),
+                'slowest_sql': timings.slowest_sql(),
+            }, default=str))
+        return response
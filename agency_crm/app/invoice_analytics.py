@@ -0,0 +1,241 @@
+"""Invoiced revenue over time, by brand, company and group.
+
+One GROUP BY over ``invoices`` produces totals per billed company, brand,
+year and month. Like the media rollup, the result is cached per ``invoices``
+data version, so views only read the cached rows until an invoice, brand or
+company changes; monthly and quarterly series, top clients and
+year-over-year comparisons are summed from it in Python. A *group* is a
+top-level company together with all its subcompanies.
+
+Invoices carry no due date or payment status, so aging buckets invoiced
+amounts by how long ago they were issued. They depend on today's date and
+are cached per day as well.
+"""
+from collections import namedtuple, defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import select, func, extract, case
+from app import db
+from app.cache import cached_for_version, track_data_version
+from app.hierarchy import group_roots, descendant_ids
+from app.models import Company, Brand, Invoice
+
+DATA_VERSION = 'invoices'
+CENT = Decimal('0.01')
+DIMENSIONS = ('total', 'group', 'company', 'brand')
+PERIODS = ('month', 'quarter')
+AGING_BUCKETS = ((30, '0-30 days'), (60, '31-60 days'), (90, '61-90 days'), (None, 'Over 90 days'))
+MONTH_NAMES = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+MonthRow = namedtuple('MonthRow', 'company_id brand_id year month total invoices')
+Labels = namedtuple('Labels', 'companies brands roots')
+Series = namedtuple('Series', 'key label values total')
+Client = namedtuple('Client', 'key label total invoices share')
+Comparison = namedtuple('Comparison', 'key label current previous change_pct')
+
+
+def _money(value):
+    # SQLite hands back floats for SUM over numerics
+    return Decimal(str(value or 0)).quantize(CENT)
+
+
+def _change_pct(current, previous):
+    if not previous:
+        return None
+    return float((current - previous) / previous * 100)
+
+
+def _load_months():
+    year = extract('year', Invoice.invoice_date)
+    month = extract('month', Invoice.invoice_date)
+    rows = db.session.execute(
+        select(Invoice.company_id, Invoice.brand_id, year, month, func.sum(Invoice.total_amount), func.count())
+        .group_by(Invoice.company_id, Invoice.brand_id, year, month))
+    return [MonthRow(company_id, brand_id, int(row_year), int(row_month), _money(total), count)
+            for company_id, brand_id, row_year, row_month, total, count in rows]
+
+
+def _load_labels():
+    return Labels(dict(db.session.execute(select(Company.id, Company.name)).all()),
+                  dict(db.session.execute(select(Brand.id, Brand.name)).all()),
+                  group_roots())
+
+
+def monthly_revenue():
+    """Invoiced totals per company, brand and month, cached per data version."""
+    return cached_for_version(DATA_VERSION, 'months', _load_months)
+
+
+def _labels():
+    return cached_for_version(DATA_VERSION, 'labels', _load_labels)
+
+
+def _key(row, by, labels):
+    if by == 'brand':
+        return row.brand_id
+    if by == 'company':
+        return row.company_id
+    if by == 'group':
+        return labels.roots.get(row.company_id, row.company_id)
+    return None
+
+
+def _label(key, by, labels):
+    if by == 'brand':
+        return labels.brands.get(key, f'Brand {key}')
+    if by in ('company', 'group'):
+        return labels.companies.get(key, f'Company {key}')
+    return 'All invoices'
+
+
+def _period(row, period):
+    return (row.year, row.month) if period == 'month' else (row.year, (row.month - 1) // 3 + 1)
+
+
+def _periods(first, last, period):
+    """Every period from ``first`` to ``last`` inclusive, gaps included."""
+    per_year = 12 if period == 'month' else 4
+    year, number = first
+    periods = []
+    while (year, number) <= last:
+        periods.append((year, number))
+        year, number = (year + 1, 1) if number == per_year else (year, number + 1)
+    return periods
+
+
+def period_label(key, period):
+    year, number = key
+    return f'{MONTH_NAMES[number - 1]} {year}' if period == 'month' else f'Q{number} {year}'
+
+
+def period_code(key, period):
+    year, number = key
+    return f'{year}-{number:02d}' if period == 'month' else f'{year}-Q{number}'
+
+
+def _rows(year=None, company_id=None):
+    members = set(descendant_ids(company_id)) if company_id else None
+    for row in monthly_revenue():
+        if year and row.year != year:
+            continue
+        if members is not None and row.company_id not in members:
+            continue
+        yield row
+
+
+def revenue_series(period='month', by='total', year=None, company_id=None):
+    """Invoiced totals per period as ``(periods, series)``.
+
+    ``series`` holds one ``Series`` per brand, company or group (or a single
+    one for ``by='total'``), largest first, with a value for every period.
+    ``company_id`` limits the figures to that company and its subcompanies.
+    """
+    period = period if period in PERIODS else 'month'
+    by = by if by in DIMENSIONS else 'total'
+    labels = _labels()
+    totals = defaultdict(lambda: defaultdict(Decimal))
+    for row in _rows(year, company_id):
+        totals[_key(row, by, labels)][_period(row, period)] += row.total
+
+    seen = [key for values in totals.values() for key in values]
+    if year:
+        periods = _periods((year, 1), (year, 12 if period == 'month' else 4), period)
+    elif seen:
+        periods = _periods(min(seen), max(seen), period)
+    else:
+        periods = []
+    series = [Series(key, _label(key, by, labels), [values.get(p, Decimal(0)) for p in periods],
+                     sum(values.values(), Decimal(0)))
+              for key, values in totals.items()]
+    series.sort(key=lambda s: (-s.total, s.label))
+    return periods, series
+
+
+def top_clients(limit=10, year=None, by='group'):
+    """The ``limit`` groups, companies or brands with the most invoiced revenue."""
+    by = by if by in DIMENSIONS[1:] else 'group'
+    labels = _labels()
+    totals = defaultdict(Decimal)
+    counts = defaultdict(int)
+    for row in _rows(year):
+        key = _key(row, by, labels)
+        totals[key] += row.total
+        counts[key] += row.invoices
+    grand_total = sum(totals.values(), Decimal(0))
+    ranked = sorted(totals, key=lambda key: (-totals[key], _label(key, by, labels)))[:limit]
+    return [Client(key, _label(key, by, labels), totals[key], counts[key],
+                   float(totals[key] / grand_total * 100) if grand_total else None)
+            for key in ranked]
+
+
+def year_over_year(year, by='group', today=None):
+    """Revenue of ``year`` against the year before, per month and per client.
+
+    For the current year only the months up to this one are compared, so a
+    half-finished year is not set against a whole one.
+    """
+    by = by if by in DIMENSIONS[1:] else 'group'
+    today = today or date.today()
+    through_month = today.month if year == today.year else 12
+    labels = _labels()
+    months = {(y, m): Decimal(0) for y in (year, year - 1) for m in range(1, 13)}
+    clients = defaultdict(lambda: [Decimal(0), Decimal(0)])
+    for row in monthly_revenue():
+        if row.year not in (year, year - 1):
+            continue
+        months[(row.year, row.month)] += row.total
+        if row.month <= through_month:
+            clients[_key(row, by, labels)][0 if row.year == year else 1] += row.total
+
+    current = sum((months[(year, m)] for m in range(1, through_month + 1)), Decimal(0))
+    previous = sum((months[(year - 1, m)] for m in range(1, through_month + 1)), Decimal(0))
+    rows = [Comparison(key, _label(key, by, labels), this, last, _change_pct(this, last))
+            for key, (this, last) in clients.items()]
+    rows.sort(key=lambda r: (-r.current, -r.previous, r.label))
+    return {
+        'year': year,
+        'through_month': through_month,
+        'months': [(m, months[(year, m)], months[(year - 1, m)]) for m in range(1, 13)],
+        'clients': rows,
+        'total': Comparison(None, 'Total', current, previous, _change_pct(current, previous)),
+    }
+
+
+def _load_aging(today):
+    bucket = case(*[(Invoice.invoice_date >= today - timedelta(days=days), index)
+                    for index, (days, _) in enumerate(AGING_BUCKETS) if days is not None],
+                  else_=len(AGING_BUCKETS) - 1)
+    buckets = defaultdict(lambda: [Decimal(0)] * len(AGING_BUCKETS))
+    for company_id, index, total in db.session.execute(
+            select(Invoice.company_id, bucket, func.sum(Invoice.total_amount))
+            .where(Invoice.invoice_date <= today)
+            .group_by(Invoice.company_id, bucket)):
+        buckets[company_id][index] = _money(total)
+    return dict(buckets)
+
+
+def aging(by='company', today=None):
+    """Invoiced amounts per company or group in ``AGING_BUCKETS`` by invoice age.
+
+    Returns ``[(key, label, amounts)]``, largest total first.
+    """
+    by = by if by in ('company', 'group') else 'company'
+    today = today or date.today()
+    labels = _labels()
+    rows = defaultdict(lambda: [Decimal(0)] * len(AGING_BUCKETS))
+    for company_id, amounts in cached_for_version(DATA_VERSION, ('aging', today.isoformat()),
+                                                  lambda: _load_aging(today)).items():
+        key = labels.roots.get(company_id, company_id) if by == 'group' else company_id
+        rows[key] = [a + b for a, b in zip(rows[key], amounts)]
+    result = [(key, _label(key, by, labels), amounts) for key, amounts in rows.items()]
+    result.sort(key=lambda r: (-sum(r[2]), r[1]))
+    return result
+
+
+def revenue_years():
+    return sorted({row.year for row in monthly_revenue()}, reverse=True)
+
+
+def init_app(app):
+    # Names and moves within the hierarchy change the labels and groups too
+    track_data_version(DATA_VERSION, Invoice, Brand, Company)
@@ -0,0 +1,129 @@
+"""Planned versus actual media spend across the whole portfolio.
+
+One GROUP BY over ``media_plans`` produces planned and actual totals per
+company, brand, media type, year and quarter (media plans belong to brands,
+never to subbrands, so the brand is the finest level). The result is small
+and cached per ``media_plans`` data version; pivots by company, brand or
+media type against quarters or years are summed from it in Python.
+"""
+from collections import namedtuple
+from decimal import Decimal
+from flask import current_app
+from sqlalchemy import select, func
+from app import db
+from app.cache import cached_for_version, track_data_version
+from app.models import Company, Brand, MediaPlan
+
+DATA_VERSION = 'media_plans'
+CENT = Decimal('0.01')
+ROW_DIMENSIONS = ('company', 'brand', 'media_type')
+COLUMN_DIMENSIONS = ('quarter', 'year')
+
+RollupRow = namedtuple('RollupRow', 'company_id company brand_id brand media_type year quarter '
+                                    'planned actual plans')
+
+
+class Cell:
+    """Planned and actual spend of one pivot cell."""
+
+    def __init__(self):
+        self.planned = Decimal(0)
+        self.actual = Decimal(0)
+        self.plans = 0
+
+    def add(self, row):
+        self.planned += row.planned
+        self.actual += row.actual
+        self.plans += row.plans
+
+    @property
+    def variance(self):
+        return self.actual - self.planned
+
+    @property
+    def variance_pct(self):
+        if not self.planned:
+            return None
+        return float(self.variance / self.planned * 100)
+
+    def overspent(self, tolerance):
+        if not self.actual:
+            return False
+        return self.actual > self.planned * (1 + Decimal(str(tolerance)))
+
+
+def _load_rollup():
+    rows = db.session.execute(
+        select(Company.id, Company.name, Brand.id, Brand.name, MediaPlan.media_type,
+               MediaPlan.year, MediaPlan.quarter,
+               func.coalesce(func.sum(MediaPlan.planned_budget), 0),
+               func.coalesce(func.sum(MediaPlan.actual_spend), 0),
+               func.count(MediaPlan.id))
+        .join(MediaPlan.brand).join(Brand.company)
+        .group_by(Company.id, Company.name, Brand.id, Brand.name, MediaPlan.media_type,
+                  MediaPlan.year, MediaPlan.quarter))
+    # SQLite hands back floats for SUM over numerics
+    return [RollupRow(*row[:7], Decimal(str(row[7])).quantize(CENT), Decimal(str(row[8])).quantize(CENT),
+                      row[9]) for row in rows]
+
+
+def portfolio_rollup():
+    """Grouped planned/actual totals for the whole portfolio, cached per data version."""
+    return cached_for_version(DATA_VERSION, 'rollup', _load_rollup)
+
+
+def _row_key(row, dimension):
+    if dimension == 'company':
+        return (row.company, row.company_id), row.company
+    if dimension == 'brand':
+        return (row.company, row.brand, row.brand_id), f'{row.brand} ({row.company})'
+    return (row.media_type,), row.media_type
+
+
+def pivot(rows_by='company', columns_by='quarter', year=None, company_id=None):
+    """Pivot the rollup into ``(row labels, column keys, cells, row totals, column totals, total)``.
+
+    ``cells`` maps ``(row key, column key)`` to a ``Cell``. Quarter columns
+    are limited to ``year``; year columns cover every year.
+    """
+    if rows_by not in ROW_DIMENSIONS:
+        rows_by = 'company'
+    if columns_by not in COLUMN_DIMENSIONS:
+        columns_by = 'quarter'
+
+    labels = {}
+    cells = {}
+    row_totals = {}
+    column_totals = {}
+    total = Cell()
+    for row in portfolio_rollup():
+        if company_id and row.company_id != company_id:
+            continue
+        if columns_by == 'quarter':
+            if row.year != year:
+                continue
+            column = row.quarter
+        else:
+            column = row.year
+        key, label = _row_key(row, rows_by)
+        labels[key] = label
+        for cell in (cells.setdefault((key, column), Cell()), row_totals.setdefault(key, Cell()),
+                     column_totals.setdefault(column, Cell()), total):
+            cell.add(row)
+
+    columns = [1, 2, 3, 4] if columns_by == 'quarter' else sorted(column_totals)
+    rows = [(key, labels[key]) for key in sorted(labels)]
+    return rows, columns, cells, row_totals, column_totals, total
+
+
+def rollup_years():
+    return sorted({row.year for row in portfolio_rollup()}, reverse=True)
+
+
+def overspend_tolerance():
+    return current_app.config['MEDIA_OVERSPEND_TOLERANCE']
+
+
+def init_app(app):
+    # Names and company moves change the rollup as well as the plans themselves
+    track_data_version(DATA_VERSION, MediaPlan, Brand, Company)
@@ -0,0 +1,84 @@
+"""Prometheus metrics and the /metrics endpoint.
+
+Under gunicorn, point PROMETHEUS_MULTIPROC_DIR at an empty directory before
+the workers start (see gunicorn.conf.py). prometheus_client then keeps one
+file per worker and the /metrics view merges them, so whichever worker
+answers a scrape reports totals for the whole server. Without the variable
+the default in-process registry is used, which is fine for `python run.py`.
+
+Cache hit ratios are exported as hit/miss counters; compute the ratio in
+PromQL, e.g. rate(crm_cache_requests_total{result="hit"}[5m]) divided by
+rate(crm_cache_requests_total[5m]).
+"""
+import os
+from functools import wraps
+from flask import request, Response
+from prometheus_client import (Counter, Histogram, Gauge, CollectorRegistry, REGISTRY,
+                               generate_latest, CONTENT_TYPE_LATEST)
+from prometheus_client import multiprocess
+
+REQUEST_COUNT = Counter(
+    'crm_requests_total', 'HTTP requests handled', ['endpoint', 'method', 'status'])
+REQUEST_LATENCY = Histogram(
+    'crm_request_duration_seconds', 'Time spent handling a request', ['endpoint'],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+SQL_STATEMENTS = Histogram(
+    'crm_sql_statements_per_request', 'SQL statements executed per request', ['endpoint'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 250, 500, 1000))
+CACHE_REQUESTS = Counter(
+    'crm_cache_requests_total', 'Cache lookups by result', ['cache', 'result'])
+UPLOAD_BYTES = Counter(
+    'crm_upload_bytes_total', 'Bytes received in file uploads', ['endpoint'])
+EXPORT_DURATION = Histogram(
+    'crm_export_duration_seconds', 'Time spent building an export', ['export'],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+JOB_QUEUE_DEPTH = Gauge(
+    'crm_job_queue_depth', 'Background jobs submitted but not finished', ['queue'],
+    multiprocess_mode='livesum')
+
+
+def record_cache_lookup(cache, hit):
+    CACHE_REQUESTS.labels(cache=cache, result='hit' if hit else 'miss').inc()
+
+
+def timed_export(name):
+    """Decorator recording how long an export view takes to build its file."""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with EXPORT_DURATION.labels(export=name).time():
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def metrics():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    from app.instrumentation import current_timings
+
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+    @app.after_request
+    def record_request_metrics(response):
+        # Unmatched URLs share one label so 404 scans cannot blow up cardinality
+        endpoint = request.endpoint or 'unmatched'
+        if endpoint == 'metrics':
+            return response
+
+        REQUEST_COUNT.labels(endpoint=endpoint, method=request.method,
+                             status=str(response.status_code)).inc()
+        timings = current_timings()
+        if timings is not None:
+            REQUEST_LATENCY.labels(endpoint=endpoint).observe(timings.total_time)
+            SQL_STATEMENTS.labels(endpoint=endpoint).observe(timings.sql_count)
+        if request.mimetype == 'multipart/form-data' and request.content_length:
+            UPLOAD_BYTES.labels(endpoint=endpoint).inc(request.content_length)
+        return response
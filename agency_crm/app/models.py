@@ -1,11 +1,13 @@
 from datetime import datetime
+from dateutil.relativedelta import relativedelta
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 from app import db, login_manager
 
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    from app.cache import get_cached_user
+    return get_cached_user(int(id))
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -48,6 +50,10 @@ class Company(db.Model):
     parent_company_id = db.Column(db.Integer, db.ForeignKey('companies.id'))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    # Maintained by app.counters
+    brand_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    subcompany_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    invoice_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     brands = db.relationship('Brand', back_populates='company', cascade='all, delete-orphan')
     agreements = db.relationship('Agreement', back_populates='company', cascade='all, delete-orphan')
@@ -66,6 +72,11 @@ class Brand(db.Model):
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
     status = db.Column(db.String(20), default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Maintained by app.counters
+    contact_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    team_member_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    active_task_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    invoice_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     
     company = db.relationship('Company', back_populates='brands')
     contacts = db.relationship('ClientContact', secondary='brand_contacts', back_populates='brands')
@@ -144,6 +155,50 @@ class BrandTeam(db.Model):
     
     __table_args__ = (db.UniqueConstraint('brand_id', 'team_member_id'),)
 
+class Blob(db.Model):
+    """A stored file, addressed by the SHA-256 of its content."""
+    __tablename__ = 'blobs'
+    
+    sha256 = db.Column(db.String(64), primary_key=True)
+    size = db.Column(db.BigInteger, nullable=False)
+    content_type = db.Column(db.String(100))
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Set once the content has been through text extraction (see app.text_index)
+    text_indexed_at = db.Column(db.DateTime, index=True)
+    
+    @staticmethod
+    def relative_path(sha256):
+        # Two levels of sharding keep directories small
+        return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+    
+    @property
+    def path(self):
+        return self.relative_path(self.sha256)
+
+class DataVersion(db.Model):
+    """Counter bumped whenever a named set of tables changes; see app.cache.track_data_version."""
+    __tablename__ = 'data_versions'
+    
+    name = db.Column(db.String(50), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class ChangeLogEntry(db.Model):
+    """One inserted, updated or deleted row, recorded by app.changelog for incremental sync."""
+    __tablename__ = 'change_log'
+    
+    seq = db.Column(db.Integer, primary_key=True)
+    table_name = db.Column(db.String(64), nullable=False)
+    row_key = db.Column(db.String(100), nullable=False)  # Primary key values, comma separated
+    op = db.Column(db.String(6), nullable=False)  # insert/update/delete
+    data = db.Column(db.Text)  # JSON of the new column values; all of them for inserts, changed ones for updates
+    recorded_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+    
+    # AUTOINCREMENT keeps SQLite from reusing sequence numbers once old entries are compacted away
+    __table_args__ = (db.Index('ix_change_log_table_name_row_key', 'table_name', 'row_key'),
+                      {'sqlite_autoincrement': True})
+
 class Agreement(db.Model):
     __tablename__ = 'agreements'
     
@@ -152,6 +207,7 @@ class Agreement(db.Model):
     type = db.Column(db.String(50), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blobs.sha256'), index=True)
     valid_until = db.Column(db.Date)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     uploaded_by_id = db.Column(db.Integer, db.ForeignKey('users.id'))
@@ -167,6 +223,35 @@ class MediaGroup(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     commitments = db.relationship('Commitment', back_populates='media_group')
+    mappings = db.relationship('MediaGroupMapping', back_populates='media_group', cascade='all, delete-orphan')
+
+class MediaGroupMapping(db.Model):
+    """Assigns media plans to a media group by channel name or, failing that, by media type."""
+    __tablename__ = 'media_group_mappings'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    media_group_id = db.Column(db.Integer, db.ForeignKey('media_groups.id'), nullable=False)
+    field = db.Column(db.String(20), nullable=False)  # channel_name/media_type
+    value = db.Column(db.String(200), nullable=False)  # Stored as entered, matched on the database's lower()
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    media_group = db.relationship('MediaGroup', back_populates='mappings')
+    
+    # Unique the way plans are matched, so no plan can match two mappings
+    __table_args__ = (db.UniqueConstraint('field', 'value'),
+                      db.Index('ix_media_group_mappings_field_lower_value', 'field', db.func.lower(value), unique=True))
+
+class CommitmentSpend(db.Model):
+    """Media plan spend per company, media group and year, kept up to date by app.commitments."""
+    __tablename__ = 'commitment_spend'
+    
+    company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), primary_key=True)
+    media_group_id = db.Column(db.Integer, db.ForeignKey('media_groups.id'), primary_key=True)
+    year = db.Column(db.Integer, primary_key=True)
+    actual_spend = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    # Planned budget of plans with no actual spend recorded yet
+    open_budget = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    plans = db.Column(db.Integer, nullable=False, default=0)
 
 class Commitment(db.Model):
     __tablename__ = 'commitments'
@@ -205,6 +290,7 @@ class PlanningAttachment(db.Model):
     planning_info_id = db.Column(db.Integer, db.ForeignKey('planning_info.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blobs.sha256'), index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     planning_info = db.relationship('PlanningInfo', back_populates='attachments')
@@ -230,6 +316,7 @@ class MeetingAttachment(db.Model):
     meeting_id = db.Column(db.Integer, db.ForeignKey('key_meetings.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blobs.sha256'), index=True)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     meeting = db.relationship('KeyMeeting', back_populates='attachments')
@@ -261,6 +348,25 @@ class StatusUpdate(db.Model):
     brand = db.relationship('Brand', back_populates='status_updates')
     created_by = db.relationship('User', back_populates='status_updates')
 
+class BrandHealthSnapshot(db.Model):
+    """Health metrics of one brand on one day, written by app.health_snapshots."""
+    __tablename__ = 'brand_health_snapshots'
+    
+    # No foreign keys: the history outlives deleted brands and companies
+    snapshot_date = db.Column(db.Date, primary_key=True)
+    brand_id = db.Column(db.Integer, primary_key=True)
+    company_id = db.Column(db.Integer, nullable=False)
+    evaluation = db.Column(db.String(20))
+    days_since_update = db.Column(db.Integer)
+    update_overdue = db.Column(db.Boolean, nullable=False)
+    days_since_meeting = db.Column(db.Integer)
+    meeting_overdue = db.Column(db.Boolean, nullable=False)
+    has_service_agreement = db.Column(db.Boolean, nullable=False)
+    has_data_agreement = db.Column(db.Boolean, nullable=False)
+    has_key_responsible = db.Column(db.Boolean, nullable=False)
+    
+    __table_args__ = (db.Index('ix_brand_health_snapshots_brand_id_date', 'brand_id', 'snapshot_date'),)
+
 class Gift(db.Model):
     __tablename__ = 'gifts'
     
@@ -293,6 +399,21 @@ class TaskTemplate(db.Model):
     def __repr__(self):
         return f'<TaskTemplate {self.name}>'
 
+# Period between two occurrences of a recurring task, by BrandTask.frequency
+TASK_FREQUENCIES = {
+    'monthly': relativedelta(months=1),
+    'quarterly': relativedelta(months=3),
+    'twice_yearly': relativedelta(months=6),
+    'yearly': relativedelta(years=1),
+}
+
+def task_due_date(frequency, start_date, last_completion=None):
+    """When a task is due: one period after its last completion, or after its start date if never completed.
+
+    The task is overdue once that day has passed.
+    """
+    return (last_completion or start_date) + TASK_FREQUENCIES.get(frequency, relativedelta())
+
 class BrandTask(db.Model):
     __tablename__ = 'brand_tasks'
     
@@ -313,46 +434,23 @@ class BrandTask(db.Model):
     __table_args__ = (db.UniqueConstraint('brand_id', 'task_template_id'),)
     
     def get_next_due_date(self, from_date=None):
-        """Calculate next due date based on frequency"""
-        from dateutil.relativedelta import relativedelta
-        
+        """Due date by ``task_due_date``, moved forward by whole periods to ``from_date`` (default today).
+
+        This is the next occurrence still ahead, so it is never overdue; use
+        ``task_due_date`` to tell whether the task is.
+        """
         if from_date is None:
             from_date = datetime.now().date()
         
-        # Get the last completion date
         last_completion = TaskCompletion.query.filter_by(
             brand_task_id=self.id
         ).order_by(TaskCompletion.completion_date.desc()).first()
+        next_date = task_due_date(self.frequency, self.start_date,
+                                  last_completion.completion_date if last_completion else None)
         
-        if last_completion:
-            base_date = last_completion.completion_date
-        else:
-            base_date = self.start_date
-        
-        # Calculate next due date based on frequency
-        if self.frequency == 'monthly':
-            next_date = base_date + relativedelta(months=1)
-        elif self.frequency == 'quarterly':
-            next_date = base_date + relativedelta(months=3)
-        elif self.frequency == 'twice_yearly':
-            next_date = base_date + relativedelta(months=6)
-        elif self.frequency == 'yearly':
-            next_date = base_date + relativedelta(years=1)
-        else:
-            next_date = base_date
-        
-        # If next date is in the past, calculate from current date
-        while next_date < from_date:
-            if self.frequency == 'monthly':
-                next_date = next_date + relativedelta(months=1)
-            elif self.frequency == 'quarterly':
-                next_date = next_date + relativedelta(months=3)
-            elif self.frequency == 'twice_yearly':
-                next_date = next_date + relativedelta(months=6)
-            elif self.frequency == 'yearly':
-                next_date = next_date + relativedelta(years=1)
-            else:
-                break
+        period = TASK_FREQUENCIES.get(self.frequency)
+        while period and next_date < from_date:
+            next_date = next_date + period
         
         return next_date
 
@@ -375,7 +473,7 @@ class Invoice(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     brand_id = db.Column(db.Integer, db.ForeignKey('brands.id'), nullable=False)
     company_id = db.Column(db.Integer, db.ForeignKey('companies.id'), nullable=False)
-    invoice_date = db.Column(db.Date, nullable=False)
+    invoice_date = db.Column(db.Date, nullable=False, index=True)
     short_info = db.Column(db.Text)
     filename = db.Column(db.String(255))  # Keep for backward compatibility
     file_path = db.Column(db.String(500))  # Keep for backward compatibility
@@ -395,6 +493,7 @@ class InvoiceAttachment(db.Model):
     invoice_id = db.Column(db.Integer, db.ForeignKey('invoices.id'), nullable=False)
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(500), nullable=False)
+    blob_sha256 = db.Column(db.String(64), db.ForeignKey('blobs.sha256'), index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     invoice = db.relationship('Invoice', back_populates='attachments')
@@ -0,0 +1,93 @@
+"""Thumbnail previews of stored attachments.
+
+When a transaction that stored blobs commits, previews for the new images
+(and PDFs, if poppler's ``pdftoppm`` is installed) are queued on a process
+pool of PREVIEW_WORKERS per app worker; the request never waits for them.
+Each preview is a JPEG no larger than PREVIEW_MAX_SIZE pixels written next
+to its blob as ``<sha256>.preview.jpg``, so it is deduplicated and garbage
+collected with the blob. Pages only show a preview once its file exists.
+"""
+import logging
+import os
+import shutil
+import subprocess
+from flask import current_app, url_for
+from app.metrics import JOB_QUEUE_DEPTH
+from app.process_pools import process_pool
+from app.storage import blob_file, on_blobs_stored
+
+PREVIEW_SUFFIX = '.preview.jpg'
+IMAGE_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+PDF_RENDERER = shutil.which('pdftoppm')
+
+logger = logging.getLogger(__name__)
+
+
+def preview_file(sha256):
+    return blob_file(sha256) + PREVIEW_SUFFIX
+
+
+def can_preview(content_type):
+    return content_type in IMAGE_TYPES or (content_type == 'application/pdf' and PDF_RENDERER is not None)
+
+
+def render_preview(src, dest, content_type, max_size):
+    """Write a JPEG thumbnail of ``src`` to ``dest``. Runs in a pool process."""
+    from PIL import Image
+
+    tmp = f'{dest}.{os.getpid()}.tmp'
+    try:
+        if content_type == 'application/pdf':
+            # First page only, rendered straight at thumbnail size
+            subprocess.run([PDF_RENDERER, '-f', '1', '-l', '1', '-singlefile', '-jpeg',
+                            '-scale-to', str(max_size), src, tmp],
+                           check=True, timeout=60, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            os.replace(tmp + '.jpg', dest)
+            return dest
+        with Image.open(src) as image:
+            image.draft('RGB', (max_size, max_size))  # Lets JPEG decode at reduced scale
+            image.thumbnail((max_size, max_size))
+            image.convert('RGB').save(tmp, 'JPEG', quality=80, optimize=True)
+        os.replace(tmp, dest)
+        return dest
+    finally:
+        for leftover in (tmp, tmp + '.jpg'):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+
+
+def _finished(future):
+    JOB_QUEUE_DEPTH.labels(queue='previews').dec()
+    error = future.exception()
+    if error is not None:
+        logger.warning('Preview generation failed: %r', error)
+
+
+def schedule_previews(blobs):
+    """Queue previews for ``{sha256: content_type}`` that do not have one yet."""
+    config = current_app.config
+    for sha256, content_type in blobs.items():
+        if not can_preview(content_type) or os.path.exists(preview_file(sha256)):
+            continue
+        JOB_QUEUE_DEPTH.labels(queue='previews').inc()
+        future = process_pool('previews', config['PREVIEW_WORKERS']).submit(
+            render_preview, blob_file(sha256), preview_file(sha256), content_type, config['PREVIEW_MAX_SIZE'])
+        future.add_done_callback(_finished)
+
+
+def preview_url(attachment):
+    """URL of an attachment's preview, or None while there is none."""
+    sha256 = getattr(attachment, 'blob_sha256', None)
+    if sha256 and os.path.exists(preview_file(sha256)):
+        return url_for('clients.attachment_preview', sha256=sha256)
+    return None
+
+
+def _blobs_stored(blobs):
+    if current_app.config['PREVIEW_WORKERS'] > 0:
+        schedule_previews(blobs)
+
+
+def init_app(app):
+    app.add_template_global(preview_url)
+    on_blobs_stored(_blobs_stored)
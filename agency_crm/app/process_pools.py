@@ -0,0 +1,23 @@
+"""Process pools for background jobs queued by requests.
+
+Each pool is created by the first job submitted to it, with the worker
+count that job asks for, and shut down without waiting when the app worker
+exits. Pools are kept per name so slow text extraction never holds up
+thumbnail previews.
+"""
+import atexit
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def process_pool(name, workers):
+    """The pool called ``name``, started with ``workers`` processes on first use."""
+    with _pools_lock:
+        pool = _pools.get(name)
+        if pool is None:
+            pool = _pools[name] = ProcessPoolExecutor(max_workers=workers)
+            atexit.register(pool.shutdown, wait=False, cancel_futures=True)
+        return pool
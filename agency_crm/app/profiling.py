@@ -0,0 +1,181 @@
+"""Sampling profiler for live requests.
+
+A request is profiled when its endpoint is listed in PROFILE_ENDPOINTS, when
+it falls inside the random PROFILE_SAMPLE_RATE fraction, or when an admin
+adds ``?_profile=1`` to the URL. A background thread samples the request
+thread's stack every PROFILE_INTERVAL_MS and the samples are written to
+PROFILE_DIR in collapsed-stack format (one ``frame;frame;frame count`` line
+per distinct stack), keeping only the newest PROFILE_MAX_FILES files.
+"""
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from flask import g, request
+from flask_login import current_user
+from app.auth.decorators import is_admin
+
+PROFILE_SUFFIX = '.collapsed'
+
+
+class StackSampler(threading.Thread):
+    """Periodically records the stack of another thread."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.started_at = time.perf_counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        return time.perf_counter() - self.started_at
+
+
+def _should_profile(app):
+    if request.endpoint in app.config['PROFILE_ENDPOINTS']:
+        return True
+    if request.args.get('_profile') == '1' and is_admin(current_user):
+        return True
+    rate = app.config['PROFILE_SAMPLE_RATE']
+    return rate > 0 and random.random() < rate
+
+
+def list_profiles(profile_dir):
+    """Return stored profiles, newest first."""
+    if not os.path.isdir(profile_dir):
+        return []
+    profiles = []
+    for name in os.listdir(profile_dir):
+        if not name.endswith(PROFILE_SUFFIX):
+            continue
+        parts = name[:-len(PROFILE_SUFFIX)].split('__')
+        if len(parts) != 4:
+            continue
+        timestamp, endpoint, duration, pid = parts
+        profiles.append({
+            'name': name,
+            'captured_at': datetime.strptime(timestamp, '%Y%m%d_%H%M%S_%f'),
+            'endpoint': endpoint,
+            'duration_ms': int(duration.rstrip('ms')),
+            'size': os.path.getsize(os.path.join(profile_dir, name)),
+        })
+    profiles.sort(key=lambda p: p['captured_at'], reverse=True)
+    return profiles
+
+
+def save_profile(profile_dir, max_files, endpoint, duration, stacks):
+    os.makedirs(profile_dir, exist_ok=True)
+    name = '__'.join([
+        datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f'),
+        endpoint or 'unmatched',
+        f'{int(duration * 1000)}ms',
+        str(os.getpid()),
+    ]) + PROFILE_SUFFIX
+    path = os.path.join(profile_dir, name)
+    # Write then rename so a concurrent listing never sees a half-written file
+    with open(path + '.tmp', 'w') as f:
+        for stack, count in stacks.most_common():
+            f.write(f'{stack} {count}\n')
+    os.replace(path + '.tmp', path)
+
+    for old in list_profiles(profile_dir)[max_files:]:
+        try:
+            os.remove(os.path.join(profile_dir, old['name']))
+        except FileNotFoundError:
+            pass  # Another worker rotated it first
+    return name
+
+
+def read_collapsed(path):
+    stacks = []
+    with open(path) as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks.append((stack.split(';'), int(count)))
+    return stacks
+
+
+def top_functions(stacks, limit=30):
+    """Aggregate samples by leaf (self) and by any position in the stack (total)."""
+    self_samples = Counter()
+    total_samples = Counter()
+    for frames, count in stacks:
+        self_samples[frames[-1]] += count
+        for frame in set(frames):
+            total_samples[frame] += count
+    return [
+        {'frame': frame, 'self': self_samples[frame], 'total': total}
+        for frame, total in total_samples.most_common(limit)
+    ]
+
+
+def to_speedscope(name, stacks, interval_ms):
+    """Convert collapsed stacks to a speedscope 'sampled' profile."""
+    frame_index = {}
+    frames = []
+    samples = []
+    weights = []
+    for stack, count in stacks:
+        sample = []
+        for frame in stack:
+            if frame not in frame_index:
+                frame_index[frame] = len(frames)
+                frames.append({'name': frame})
+            sample.append(frame_index[frame])
+        samples.append(sample)
+        weights.append(count * interval_ms)
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': sum(weights),
+            'samples': samples,
+            'weights': weights,
+        }],
+        'name': name,
+        'exporter': 'agency_crm',
+    }
+
+
+def init_app(app):
+    @app.before_request
+    def start_profiler():
+        if not _should_profile(app):
+            return
+        sampler = StackSampler(threading.get_ident(), app.config['PROFILE_INTERVAL_MS'] / 1000)
+        sampler.start()
+        g.profiler = sampler
+
+    @app.teardown_request
+    def stop_profiler(exc):
+        sampler = g.pop('profiler', None)
+        if sampler is None:
+            return
+        duration = sampler.stop()
+        if sampler.stacks:
+            save_profile(app.config['PROFILE_DIR'], app.config['PROFILE_MAX_FILES'],
+                         request.endpoint, duration, sampler.stacks)
@@ -0,0 +1,144 @@
+// Resumable uploads for large attachments.
+//
+// Forms with a data-chunked-upload attribute (the URL that creates upload
+// sessions) send every file larger than data-chunk-size ahead of the form in
+// chunks, retrying and resuming from the server's offset when a chunk fails.
+// When the remaining files together would still exceed data-max-request-size,
+// the largest of them are sent in chunks as well until the rest fit. The form
+// is then submitted with the session ids in hidden upload_id fields and only
+// the files left in its file inputs.
+(function () {
+    var MAX_RETRIES = 5;
+    // Room left in a request for the other form fields and multipart headers
+    var REQUEST_OVERHEAD = 64 * 1024;
+
+    function sleep(ms) {
+        return new Promise(function (resolve) { setTimeout(resolve, ms); });
+    }
+
+    async function currentOffset(url) {
+        var response = await fetch(url, {credentials: 'same-origin'});
+        if (!response.ok) throw new Error('Upload session lost');
+        return (await response.json()).offset;
+    }
+
+    async function uploadFile(form, file, chunkSize, csrfToken, onProgress) {
+        var response = await fetch(form.dataset.chunkedUpload, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken},
+            body: JSON.stringify({filename: file.name, size: file.size})
+        });
+        var session = await response.json();
+        if (!response.ok) throw new Error(session.error || 'Upload failed');
+
+        var offset = session.offset;
+        var failures = 0;
+        while (offset < file.size) {
+            var end = Math.min(offset + chunkSize, file.size);
+            try {
+                response = await fetch(session.url, {
+                    method: 'PUT',
+                    credentials: 'same-origin',
+                    headers: {
+                        'Content-Range': 'bytes ' + offset + '-' + (end - 1) + '/' + file.size,
+                        'X-CSRFToken': csrfToken
+                    },
+                    body: file.slice(offset, end)
+                });
+                var result = await response.json();
+                if (response.ok) {
+                    offset = result.offset;
+                    failures = 0;
+                } else if (response.status === 409 && result.offset !== null) {
+                    offset = result.offset;
+                } else {
+                    throw new Error(result.error || 'Upload failed');
+                }
+            } catch (error) {
+                failures += 1;
+                if (failures > MAX_RETRIES) throw error;
+                await sleep(1000 * failures);
+                offset = await currentOffset(session.url);
+            }
+            onProgress(offset);
+        }
+        return session.id;
+    }
+
+    document.addEventListener('submit', async function (event) {
+        var form = event.target;
+        if (!form.dataset.chunkedUpload || form.dataset.chunkedDone) return;
+        var chunkSize = parseInt(form.dataset.chunkSize, 10);
+        var maxRequestSize = parseInt(form.dataset.maxRequestSize, 10) || Infinity;
+        var inputs = Array.prototype.slice.call(form.querySelectorAll('input[type=file]'));
+        var large = [];
+        var small = [];
+        inputs.forEach(function (input) {
+            Array.prototype.forEach.call(input.files, function (file) {
+                (file.size > chunkSize ? large : small).push(file);
+            });
+        });
+        // Chunk the biggest remaining files until the rest fit in one request
+        small.sort(function (a, b) { return b.size - a.size; });
+        var smallBytes = small.reduce(function (sum, file) { return sum + file.size; }, 0);
+        while (small.length && smallBytes > maxRequestSize - REQUEST_OVERHEAD) {
+            var moved = small.shift();
+            smallBytes -= moved.size;
+            large.push(moved);
+        }
+        if (!large.length) return;
+
+        event.preventDefault();
+        var submit = form.querySelector('[type=submit]');
+        var status = document.createElement('p');
+        status.className = 'mt-2 text-sm text-gray-500';
+        (submit ? submit.parentNode : form).appendChild(status);
+        if (submit) submit.disabled = true;
+
+        var csrfInput = form.querySelector('input[name=csrf_token]');
+        var csrfToken = csrfInput ? csrfInput.value : '';
+        var totalBytes = large.reduce(function (sum, file) { return sum + file.size; }, 0);
+        var doneBytes = 0;
+        try {
+            for (var i = 0; i < large.length; i++) {
+                var file = large[i];
+                var uploadId = await uploadFile(form, file, chunkSize, csrfToken, function (offset) {
+                    status.textContent = 'Uploading ' + file.name + ' (' +
+                        Math.floor((doneBytes + offset) * 100 / totalBytes) + '%)';
+                });
+                doneBytes += file.size;
+                var hidden = document.createElement('input');
+                hidden.type = 'hidden';
+                hidden.name = 'upload_id';
+                hidden.value = uploadId;
+                form.appendChild(hidden);
+            }
+        } catch (error) {
+            status.className = 'mt-2 text-sm text-red-600';
+            status.textContent = 'Upload failed: ' + error.message;
+            if (submit) submit.disabled = false;
+            return;
+        }
+
+        // Leave only the files not sent in chunks in the inputs for the regular form post
+        inputs.forEach(function (input) {
+            var keep = new DataTransfer();
+            Array.prototype.forEach.call(input.files, function (file) {
+                if (large.indexOf(file) === -1) keep.items.add(file);
+            });
+            input.files = keep.files;
+        });
+        form.dataset.chunkedDone = '1';
+        status.textContent = 'Saving...';
+        if (submit && submit.name) {
+            // form.submit() skips the submit button's own value
+            var button = document.createElement('input');
+            button.type = 'hidden';
+            button.name = submit.name;
+            button.value = submit.value;
+            form.appendChild(button);
+        }
+        form.submit();
+    });
+})();
@@ -0,0 +1,209 @@
+"""Status update evaluations over time, by brand, company, group and team member.
+
+``StatusUpdate.evaluation`` rates a brand until its next update. Window
+functions over ``status_updates`` pair every update with the previous and
+next one of its brand (``lag``/``lead``), so a single grouped query yields,
+per brand and evaluation over a rolling window of days:
+
+* how many updates gave that evaluation,
+* how many days the brand spent in that state, clipped to the window,
+* the gaps between consecutive updates (update cadence),
+* whether it is the brand's latest evaluation.
+
+The per-brand rows are cached per ``status_updates`` data version and day.
+Companies, groups (a top-level company with all its subcompanies) and team
+members are summed from them in Python; a team member covers the brands
+they are assigned to. Team assignments are read fresh on every call, since
+``app.associations`` writes them with Core statements.
+"""
+from collections import namedtuple, defaultdict
+from datetime import date, timedelta
+from sqlalchemy import select, func, case, extract, literal
+from app import db
+from app.cache import cached_for_version, track_data_version
+from app.hierarchy import group_roots, descendant_ids
+from app.models import Company, Brand, BrandTeam, StatusUpdate, User
+
+DATA_VERSION = 'status_updates'
+EVALUATIONS = ('perfect', 'medium', 'risk')
+DIMENSIONS = ('brand', 'company', 'group', 'member')
+WINDOWS = (30, 90, 365)
+DEFAULT_WINDOW = 90
+
+BrandRow = namedtuple('BrandRow', 'brand_id company_id evaluation updates days gap_days gaps longest_gap '
+                                  'last_date current')
+Labels = namedtuple('Labels', 'companies brands roots users')
+Distribution = namedtuple('Distribution', 'key label brands updates days unrated_days risk_share current '
+                                          'average_gap longest_gap days_since_update')
+
+
+def _dialect():
+    return db.session.get_bind().dialect.name
+
+
+def _day_number(value):
+    """Days since a fixed epoch, so differences of two dates are day counts."""
+    if _dialect() == 'sqlite':
+        return func.julianday(value)
+    return extract('epoch', value) / 86400
+
+
+def _greatest(a, b):
+    return func.max(a, b) if _dialect() == 'sqlite' else func.greatest(a, b)
+
+
+def _least(a, b):
+    return func.min(a, b) if _dialect() == 'sqlite' else func.least(a, b)
+
+
+def _days(value):
+    return int(round(value or 0))
+
+
+def _load_brand_rows(window, as_of):
+    start = as_of - timedelta(days=window - 1)
+    end = as_of + timedelta(days=1)
+    order = (StatusUpdate.date, StatusUpdate.id)
+    spans = (select(StatusUpdate.brand_id, StatusUpdate.evaluation, StatusUpdate.date,
+                    func.lag(StatusUpdate.date).over(partition_by=StatusUpdate.brand_id, order_by=order)
+                    .label('previous_date'),
+                    func.lead(StatusUpdate.date).over(partition_by=StatusUpdate.brand_id, order_by=order)
+                    .label('next_date'))
+             .where(StatusUpdate.date <= as_of).subquery())
+
+    in_window = spans.c.date >= start
+    # The state holds from its update until the next one (or the end of as_of)
+    state_start = _greatest(_day_number(spans.c.date), _day_number(literal(start)))
+    state_end = _least(_day_number(func.coalesce(spans.c.next_date, end)), _day_number(literal(end)))
+    gap = _day_number(spans.c.date) - _day_number(spans.c.previous_date)
+    counted_gap = case((in_window & spans.c.previous_date.isnot(None), gap))
+    rows = db.session.execute(
+        select(spans.c.brand_id, Brand.company_id, spans.c.evaluation,
+               func.sum(case((in_window, 1), else_=0)),
+               func.sum(case((state_end > state_start, state_end - state_start), else_=0)),
+               func.sum(counted_gap), func.count(counted_gap), func.max(counted_gap),
+               func.max(spans.c.date),
+               func.sum(case((spans.c.next_date.is_(None), 1), else_=0)))
+        .join(Brand, Brand.id == spans.c.brand_id)
+        .where(Brand.status == 'active')
+        .group_by(spans.c.brand_id, Brand.company_id, spans.c.evaluation))
+    return [BrandRow(brand_id, company_id, evaluation, updates or 0, _days(days), _days(gap_days), gaps,
+                     _days(longest_gap) if longest_gap is not None else None, last_date, bool(current))
+            for brand_id, company_id, evaluation, updates, days, gap_days, gaps, longest_gap, last_date, current
+            in rows]
+
+
+def brand_rows(window=DEFAULT_WINDOW, as_of=None):
+    """Per-brand, per-evaluation figures over ``window`` days up to ``as_of``, cached."""
+    as_of = as_of or date.today()
+    return cached_for_version(DATA_VERSION, ('brands', window, as_of.isoformat()),
+                              lambda: _load_brand_rows(window, as_of))
+
+
+def _load_labels():
+    return Labels(dict(db.session.execute(select(Company.id, Company.name)).all()),
+                  dict(db.session.execute(select(Brand.id, Brand.name)).all()),
+                  group_roots(),
+                  {user_id: f'{first_name} {last_name}' for user_id, first_name, last_name
+                   in db.session.execute(select(User.id, User.first_name, User.last_name))})
+
+
+def _labels():
+    return cached_for_version(DATA_VERSION, 'labels', _load_labels)
+
+
+def _keys(row, by, labels, teams):
+    if by == 'brand':
+        return [row.brand_id]
+    if by == 'company':
+        return [row.company_id]
+    if by == 'group':
+        return [labels.roots.get(row.company_id, row.company_id)]
+    if by == 'member':
+        return teams.get(row.brand_id, [])
+    return [None]
+
+
+def _label(key, by, labels):
+    if by == 'brand':
+        return labels.brands.get(key, f'Brand {key}')
+    if by in ('company', 'group'):
+        return labels.companies.get(key, f'Company {key}')
+    if by == 'member':
+        return labels.users.get(key, f'User {key}')
+    return 'All brands'
+
+
+def _team_members():
+    teams = defaultdict(list)
+    for brand_id, member_id in db.session.execute(select(BrandTeam.brand_id, BrandTeam.team_member_id)):
+        teams[brand_id].append(member_id)
+    return teams
+
+
+def _summarise(key, label, rows, window, as_of):
+    brands = {row.brand_id for row in rows}
+    updates = dict.fromkeys(EVALUATIONS, 0)
+    days = dict.fromkeys(EVALUATIONS, 0)
+    current = dict.fromkeys(EVALUATIONS, 0)
+    last_dates = {}
+    for row in rows:
+        updates[row.evaluation] = updates.get(row.evaluation, 0) + row.updates
+        days[row.evaluation] = days.get(row.evaluation, 0) + row.days
+        if row.current:
+            current[row.evaluation] = current.get(row.evaluation, 0) + 1
+        last_dates[row.brand_id] = max(last_dates.get(row.brand_id, row.last_date), row.last_date)
+    rated_days = sum(days.values())
+    gaps = sum(row.gaps for row in rows)
+    longest = [row.longest_gap for row in rows if row.longest_gap is not None]
+    return Distribution(
+        key=key,
+        label=label,
+        brands=len(brands),
+        updates=updates,
+        days=days,
+        unrated_days=window * len(brands) - rated_days,
+        risk_share=days.get('risk', 0) / rated_days * 100 if rated_days else None,
+        current=current,
+        average_gap=sum(row.gap_days for row in rows) / gaps if gaps else None,
+        longest_gap=max(longest) if longest else None,
+        # The stalest brand of the group
+        days_since_update=max((as_of - last).days for last in last_dates.values()),
+    )
+
+
+def evaluation_analytics(by='brand', window=DEFAULT_WINDOW, as_of=None, company_id=None):
+    """Evaluation distribution, time in each state and cadence per brand, company, group or member.
+
+    Returns a list of ``Distribution``, most days at risk first. ``company_id``
+    limits the figures to brands of that company and its subcompanies.
+    """
+    by = by if by in DIMENSIONS + ('total',) else 'brand'
+    as_of = as_of or date.today()
+    labels = _labels()
+    teams = _team_members() if by == 'member' else None
+    members = set(descendant_ids(company_id)) if company_id else None
+    grouped = defaultdict(list)
+    for row in brand_rows(window, as_of):
+        if members is not None and row.company_id not in members:
+            continue
+        for key in _keys(row, by, labels, teams):
+            grouped[key].append(row)
+    result = [_summarise(key, _label(key, by, labels), rows, window, as_of) for key, rows in grouped.items()]
+    result.sort(key=lambda d: (-d.days['risk'], -(d.risk_share or 0), d.label))
+    return result
+
+
+def portfolio(as_of=None, company_id=None):
+    """The overall distribution for each of ``WINDOWS``, as ``[(window, Distribution)]``."""
+    as_of = as_of or date.today()
+    summaries = []
+    for window in WINDOWS:
+        totals = evaluation_analytics('total', window, as_of, company_id)
+        summaries.append((window, totals[0] if totals else None))
+    return summaries
+
+
+def init_app(app):
+    # Brand status and company moves change which rows count, names the labels
+    track_data_version(DATA_VERSION, StatusUpdate, Brand, Company, User)
@@ -0,0 +1,311 @@
+"""Content-addressed attachment store.
+
+Uploaded files are stored once under UPLOAD_FOLDER/blobs/ab/cd/<sha256>,
+keyed by the SHA-256 of their content, and described by a ``Blob`` row.
+Agreements and planning, meeting and invoice attachments point at a blob
+through ``blob_sha256`` (``file_path`` holds the blob's relative path), so
+the same PDF attached to ten invoices is written to disk once.
+
+``Blob.ref_count`` is kept up to date by mapper events on the attachment
+models. ``Invoice.file_path`` only mirrors the invoice's first attachment
+and is not counted. Blobs whose count drops to zero are left on disk until
+``collect_garbage`` removes them; ``recount_references`` rebuilds the
+counts from the attachment tables should they ever drift (bulk deletes that
+bypass the ORM, for example).
+
+Multipart uploads are written by werkzeug straight into a ``HashingTempFile``
+under UPLOAD_FOLDER/tmp, which hashes the content and keeps its first bytes
+for MIME sniffing as it arrives, so storing the upload is a single rename.
+
+Other modules hook into new content with ``on_blobs_stored``; their handlers
+run after the transaction that stored the blobs commits.
+"""
+import glob
+import hashlib
+import mimetypes
+import os
+import tempfile
+from datetime import datetime, timedelta
+from flask import current_app, has_app_context, Request
+from sqlalchemy import event, inspect, select, update, delete, func, union_all
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from app import db
+from app.instrumentation import io_timer
+from app.models import Blob, Agreement, PlanningAttachment, MeetingAttachment, InvoiceAttachment
+
+ATTACHMENT_MODELS = (Agreement, PlanningAttachment, MeetingAttachment, InvoiceAttachment)
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 512
+
+MAGIC_NUMBERS = (
+    (b'%PDF-', 'application/pdf'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+)
+# Office documents are zip (docx/xlsx/pptx) or OLE2 (doc/xls/ppt) containers
+CONTAINER_MAGIC_NUMBERS = (
+    (b'PK\x03\x04', 'application/zip'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1', 'application/x-ole-storage'),
+)
+
+_stored_blob_handlers = []
+
+
+def blob_file(sha256):
+    """Absolute path of a blob's file."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], Blob.relative_path(sha256))
+
+
+def sniff_content_type(head, filename):
+    """Detect a file's MIME type from its first bytes, using the name only to refine containers."""
+    guessed = mimetypes.guess_type(filename or '')[0]
+    for magic, content_type in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return content_type
+    for magic, container_type in CONTAINER_MAGIC_NUMBERS:
+        if head.startswith(magic):
+            if guessed and (guessed.startswith('application/vnd.') or guessed == 'application/msword'):
+                return guessed
+            return container_type
+    return guessed or 'application/octet-stream'
+
+
+def upload_tmp_dir():
+    # Inside UPLOAD_FOLDER so the final os.replace never crosses filesystems
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _get_or_create_blob(sha256, size, content_type):
+    blob = db.session.get(Blob, sha256)
+    if blob is None:
+        try:
+            with db.session.begin_nested():
+                blob = Blob(sha256=sha256, size=size, content_type=content_type)
+                db.session.add(blob)
+        except IntegrityError:
+            # Another request stored the same content first
+            blob = db.session.get(Blob, sha256)
+    elif blob.ref_count <= 0:
+        # Restart the garbage collection grace period for a blob that is being reused
+        blob.created_at = datetime.utcnow()
+    # Picked up after commit, e.g. to render previews
+    db.session.info.setdefault('stored_blobs', {})[blob.sha256] = blob.content_type
+    return blob
+
+
+def place_file(src_path, sha256):
+    """Move ``src_path`` to the blob's location unless that content is already stored."""
+    final = blob_file(sha256)
+    if os.path.exists(final):
+        os.remove(src_path)
+        return False
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    os.replace(src_path, final)
+    return True
+
+
+class HashingTempFile:
+    """Temporary upload file that hashes and sniffs its content as it is written.
+
+    Werkzeug writes each multipart file part sequentially and then seeks back
+    to the start; every other file method is passed through. Closing the file
+    deletes it unless it has already been moved into the store.
+    """
+
+    def __init__(self, directory):
+        fd, self.name = tempfile.mkstemp(dir=directory)
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.head = b''
+
+    def write(self, data):
+        if len(self.head) < SNIFF_BYTES:
+            self.head += data[:SNIFF_BYTES - len(self.head)]
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self):
+        self._file.close()
+        try:
+            os.remove(self.name)
+        except FileNotFoundError:
+            pass  # Moved into the store
+
+
+class UploadRequest(Request):
+    """Request whose multipart files stream to UPLOAD_FOLDER/tmp instead of memory or /tmp."""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingTempFile(upload_tmp_dir())
+
+
+def store_stream(stream, filename):
+    """Copy a file-like object into the store and return its ``Blob``.
+
+    The content is hashed while it is written to a temporary file, so it is
+    read exactly once. The blob row is added to the session; the caller
+    commits together with the attachment row that references it.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    head = b''
+    with io_timer():
+        fd, tmp_path = tempfile.mkstemp(dir=upload_tmp_dir())
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    if not head:
+                        head = chunk[:SNIFF_BYTES]
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+            sha256 = digest.hexdigest()
+            blob = _get_or_create_blob(sha256, size, sniff_content_type(head, filename))
+            place_file(tmp_path, sha256)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return blob
+
+
+def store_upload(file):
+    """Store a werkzeug ``FileStorage`` from a form."""
+    stream = file.stream
+    if not isinstance(stream, HashingTempFile):
+        return store_stream(stream, file.filename)
+    # Already on disk next to the store and hashed while it was received
+    with io_timer():
+        stream.flush()
+        blob = _get_or_create_blob(stream.sha256, stream.size,
+                                   sniff_content_type(stream.head, file.filename))
+        place_file(stream.name, stream.sha256)
+    return blob
+
+
+def adopt_file(path, filename, sha256=None):
+    """Hash an existing file and return its ``Blob`` without moving the file.
+
+    Pass ``sha256`` when the content was already hashed while it was written,
+    so only the head is read for sniffing. Call ``place_file`` once the rows
+    pointing at the blob are committed.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+        if sha256 is None:
+            digest = hashlib.sha256(head)
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+            sha256 = digest.hexdigest()
+    return _get_or_create_blob(sha256, os.path.getsize(path), sniff_content_type(head, filename))
+
+
+def _adjust_ref_count(connection, sha256, delta):
+    if sha256:
+        table = Blob.__table__
+        connection.execute(update(table).where(table.c.sha256 == sha256)
+                           .values(ref_count=table.c.ref_count + delta))
+
+
+def _count_insert(mapper, connection, target):
+    _adjust_ref_count(connection, target.blob_sha256, 1)
+
+
+def _count_update(mapper, connection, target):
+    history = inspect(target).attrs.blob_sha256.history
+    for sha256 in history.deleted or ():
+        _adjust_ref_count(connection, sha256, -1)
+    for sha256 in history.added or ():
+        _adjust_ref_count(connection, sha256, 1)
+
+
+def _count_delete(mapper, connection, target):
+    # before_delete so an expired attribute can still be loaded
+    _adjust_ref_count(connection, target.blob_sha256, -1)
+
+
+def recount_references():
+    """Recompute every blob's ``ref_count`` from the attachment tables in one statement."""
+    refs = union_all(*[
+        select(model.blob_sha256.label('sha256')).where(model.blob_sha256.isnot(None))
+        for model in ATTACHMENT_MODELS
+    ]).subquery()
+    table = Blob.__table__
+    count = select(func.count()).select_from(refs).where(refs.c.sha256 == table.c.sha256)
+    db.session.execute(update(table).values(ref_count=count.scalar_subquery()))
+
+
+def collect_garbage(grace=timedelta(hours=24)):
+    """Delete blobs that no attachment references and that are older than ``grace``.
+
+    Rows are deleted first and committed; files are removed afterwards, so a
+    crash leaves at most an unreferenced file behind, never a row without
+    its file. Returns ``(blobs_removed, bytes_freed)``.
+    """
+    table = Blob.__table__
+    cutoff = datetime.utcnow() - grace
+    candidates = db.session.execute(
+        select(table.c.sha256, table.c.size)
+        .where(table.c.ref_count <= 0, table.c.created_at < cutoff)).all()
+
+    removed = []
+    for sha256, size in candidates:
+        # Repeat the conditions so a blob reused since the SELECT survives
+        result = db.session.execute(delete(table).where(
+            table.c.sha256 == sha256, table.c.ref_count <= 0, table.c.created_at < cutoff))
+        if result.rowcount:
+            removed.append((sha256, size))
+    db.session.commit()
+
+    for sha256, _ in removed:
+        # The blob and any derived files stored next to it
+        for path in glob.glob(glob.escape(blob_file(sha256)) + '*'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+    return len(removed), sum(size for _, size in removed)
+
+
+def on_blobs_stored(handler):
+    """Call ``handler({sha256: content_type})`` whenever a transaction that stored blobs commits."""
+    if handler not in _stored_blob_handlers:
+        _stored_blob_handlers.append(handler)
+
+
+def _after_commit(session):
+    blobs = session.info.pop('stored_blobs', None)
+    if blobs and has_app_context():
+        for handler in _stored_blob_handlers:
+            handler(blobs)
+
+
+def _after_rollback(session, previous_transaction):
+    # A failed savepoint leaves the rest of the transaction's blobs in place
+    if not previous_transaction.nested:
+        session.info.pop('stored_blobs', None)
+
+
+def init_app(app):
+    app.request_class = UploadRequest
+    if not event.contains(Session, 'after_commit', _after_commit):
+        event.listen(Session, 'after_commit', _after_commit)
+        event.listen(Session, 'after_soft_rollback', _after_rollback)
+    for model in ATTACHMENT_MODELS:
+        if not event.contains(model, 'after_insert', _count_insert):
+            event.listen(model, 'after_insert', _count_insert)
+            event.listen(model, 'after_update', _count_update)
+            event.listen(model, 'before_delete', _count_delete)
@@ -0,0 +1,206 @@
+"""Storage usage and orphaned file scanner.
+
+Deleting a company, brand or invoice removes its rows but leaves files in
+UPLOAD_FOLDER that no ``file_path`` column (and no blob row) refers to any
+more. ``scan_uploads`` lists the folder with a pool of threads, one
+directory per task, and ``storage_report`` compares the listing with every
+``file_path`` column to find those orphans and to total the space used per
+company.
+
+Listings are kept in a checkpoint file (STORAGE_SCAN_CHECKPOINT). A
+directory whose modification time has not changed since the last scan still
+has the same entries, so only its subdirectories are visited and its files
+are taken from the checkpoint instead of being listed and stat'ed again.
+Files are never rewritten in place, so their sizes stay valid too, and
+deleting orphans changes their directories' times so those are relisted.
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from collections import defaultdict
+from flask import current_app
+from sqlalchemy import select
+from app import db
+from app.models import (Company, Brand, Blob, Agreement, PlanningInfo, PlanningAttachment, KeyMeeting,
+                        MeetingAttachment, Invoice, InvoiceAttachment)
+from app.previews import PREVIEW_SUFFIX
+
+CHECKPOINT_VERSION = 1
+# Temporary uploads and chunked upload sessions are cleaned by clean_stale_uploads
+SKIP_DIRS = {'tmp'}
+# Directories modified this close to the previous scan may have changed within
+# the filesystem's timestamp resolution, so they are always listed again
+MTIME_SLACK_SECONDS = 2
+
+
+def _load_checkpoint(path, root):
+    try:
+        with open(path) as f:
+            checkpoint = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('root') != root:
+        return None
+    return checkpoint
+
+
+def _save_checkpoint(path, checkpoint):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(checkpoint, f, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _list_directory(root, relative, cached, trusted_before):
+    """Return ``(relative, entry)`` for one directory, reusing ``cached`` if it is unchanged."""
+    path = os.path.join(root, relative)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return relative, None
+    if cached and cached['mtime'] == mtime and mtime < trusted_before:
+        return relative, dict(cached, reused=True)
+
+    files = {}
+    dirs = []
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    stat = entry.stat(follow_symlinks=False)
+                    files[entry.name] = [stat.st_size, stat.st_mtime]
+            except FileNotFoundError:
+                pass  # Removed while listing
+    return relative, {'mtime': mtime, 'files': files, 'dirs': dirs, 'reused': False}
+
+
+def scan_uploads(workers=8, full=False):
+    """List every file under UPLOAD_FOLDER in parallel.
+
+    Returns ``(files, stats)`` where ``files`` maps each relative path to
+    ``(size, mtime)``. With ``full`` the checkpoint is ignored and every
+    directory is listed again; the checkpoint is rewritten either way.
+    """
+    root = current_app.config['UPLOAD_FOLDER']
+    checkpoint_path = current_app.config['STORAGE_SCAN_CHECKPOINT']
+    checkpoint = None if full else _load_checkpoint(checkpoint_path, root)
+    cached_dirs = checkpoint['directories'] if checkpoint else {}
+    trusted_before = (checkpoint['scanned_at'] - MTIME_SLACK_SECONDS) * 1e9 if checkpoint else 0
+
+    started = time.time()
+    directories = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_list_directory, root, '', cached_dirs.get(''), trusted_before)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                relative, entry = future.result()
+                if entry is None:
+                    continue
+                directories[relative] = entry
+                for name in entry['dirs']:
+                    if not relative and name in SKIP_DIRS:
+                        continue
+                    child = os.path.join(relative, name)
+                    pending.add(pool.submit(_list_directory, root, child, cached_dirs.get(child), trusted_before))
+
+    files = {}
+    for relative, entry in directories.items():
+        for name, (size, mtime) in entry['files'].items():
+            files[os.path.join(relative, name)] = (size, mtime)
+
+    stats = {
+        'directories': len(directories),
+        'reused': sum(1 for entry in directories.values() if entry.pop('reused')),
+        'seconds': time.time() - started,
+    }
+    _save_checkpoint(checkpoint_path, {'version': CHECKPOINT_VERSION, 'root': root,
+                                       'scanned_at': started, 'directories': directories})
+    return files, stats
+
+
+def referenced_files():
+    """Map every ``file_path`` in the database to the ids of the companies using it."""
+    queries = [
+        select(Agreement.file_path, Agreement.company_id),
+        select(PlanningAttachment.file_path, Brand.company_id)
+        .join(PlanningAttachment.planning_info).join(Brand, Brand.id == PlanningInfo.brand_id),
+        select(MeetingAttachment.file_path, Brand.company_id)
+        .join(MeetingAttachment.meeting).join(Brand, Brand.id == KeyMeeting.brand_id),
+        select(InvoiceAttachment.file_path, Invoice.company_id)
+        .join(Invoice, Invoice.id == InvoiceAttachment.invoice_id),
+        select(Invoice.file_path, Invoice.company_id).where(Invoice.file_path.isnot(None)),
+    ]
+    references = defaultdict(set)
+    for query in queries:
+        for file_path, company_id in db.session.execute(query):
+            references[os.path.normpath(file_path)].add(company_id)
+    return references
+
+
+def storage_report(files, grace_seconds):
+    """Compare a ``scan_uploads`` listing with the database.
+
+    Blob files (and their previews) count as known even without attachments;
+    ``collect_garbage`` takes care of those. Files modified within
+    ``grace_seconds`` are never reported as orphans since their upload may
+    not be committed yet. A file shared by several companies counts towards
+    each of them.
+    """
+    references = referenced_files()
+    blob_paths = {os.path.normpath(Blob.relative_path(sha256))
+                  for sha256 in db.session.scalars(select(Blob.sha256))}
+    cutoff = time.time() - grace_seconds
+
+    orphans = []
+    usage = defaultdict(lambda: [0, 0])
+    for path, (size, mtime) in files.items():
+        companies = references.get(path)
+        if companies:
+            for company_id in companies:
+                usage[company_id][0] += 1
+                usage[company_id][1] += size
+            continue
+        if path in blob_paths or (path.endswith(PREVIEW_SUFFIX)
+                                  and path[:-len(PREVIEW_SUFFIX)] in blob_paths):
+            continue
+        if mtime < cutoff:
+            orphans.append((path, size))
+
+    names = dict(db.session.execute(select(Company.id, Company.name)).all())
+    companies = sorted(((names.get(company_id, f'#{company_id}'), count, size)
+                        for company_id, (count, size) in usage.items()), key=lambda row: -row[2])
+    return {
+        'files': len(files),
+        'bytes': sum(size for size, _ in files.values()),
+        'orphans': sorted(orphans),
+        'missing': sorted(path for path in references if path not in files),
+        'companies': companies,
+    }
+
+
+def delete_orphans(orphans):
+    """Delete orphaned files and the directories they leave empty. Returns ``(count, bytes)``."""
+    root = current_app.config['UPLOAD_FOLDER']
+    removed = 0
+    freed = 0
+    for path, size in orphans:
+        full_path = os.path.join(root, path)
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            continue
+        removed += 1
+        freed += size
+        directory = os.path.dirname(full_path)
+        while directory != root:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break  # Not empty
+            directory = os.path.dirname(directory)
+    return removed, freed
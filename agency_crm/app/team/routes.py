@@ -1,11 +1,16 @@
 from flask import render_template, redirect, url_for, flash, request
 from flask_login import login_required, current_user
+from flask_wtf import FlaskForm
+from sqlalchemy.orm import contains_eager, joinedload
 from app.team import bp
-from app.models import User
+from app.models import User, BrandTeam, Brand
 from app import db
+from app.associations import reassign_brands
+from app.workload import team_workload, workload, TASK_DUE_DAYS
 from app.auth.forms import RegistrationForm
-from wtforms import PasswordField
-from wtforms.validators import Optional, ValidationError
+from app.clients.forms import MultiCheckboxField
+from wtforms import PasswordField, SelectField, SubmitField
+from wtforms.validators import Optional, ValidationError, DataRequired
 
 class TeamMemberForm(RegistrationForm):
     password = PasswordField('Password', validators=[Optional()])
@@ -25,17 +30,33 @@ class TeamMemberForm(RegistrationForm):
                 return
             raise ValidationError('Please use a different email address.')
 
+class ReassignBrandsForm(FlaskForm):
+    to_user_id = SelectField('Move to', coerce=int, validators=[DataRequired()])
+    brand_ids = MultiCheckboxField('Brands', coerce=int)
+    submit = SubmitField('Reassign Brands')
+
 @bp.route('/')
 @login_required
 def index():
     team_members = User.query.order_by(User.last_name).all()
-    return render_template('team/index.html', team_members=team_members)
+    workloads = team_workload([member.id for member in team_members])
+    return render_template('team/index.html',
+                         team_members=team_members,
+                         workloads=workloads,
+                         task_due_days=TASK_DUE_DAYS)
 
 @bp.route('/<int:user_id>')
 @login_required
 def member_detail(user_id):
     member = User.query.get_or_404(user_id)
-    return render_template('team/member_detail.html', member=member)
+    assignments = (BrandTeam.query.filter_by(team_member_id=user_id).join(Brand)
+                   .options(contains_eager(BrandTeam.brand).joinedload(Brand.company))
+                   .order_by(Brand.name).all())
+    return render_template('team/member_detail.html',
+                         member=member,
+                         assignments=assignments,
+                         workload=workload(user_id),
+                         task_due_days=TASK_DUE_DAYS)
 
 @bp.route('/new', methods=['GET', 'POST'])
 @login_required
@@ -99,4 +120,26 @@ def toggle_status(user_id):
         db.session.commit()
         status = 'activated' if member.is_active else 'deactivated'
         flash(f'Team member {status} successfully!', 'success')
-    return redirect(url_for('team.index'))
\ No newline at end of file
+    return redirect(url_for('team.index'))
+
+@bp.route('/<int:user_id>/reassign', methods=['GET', 'POST'])
+@login_required
+def reassign(user_id):
+    member = User.query.get_or_404(user_id)
+    form = ReassignBrandsForm()
+    
+    assignments = BrandTeam.query.filter_by(team_member_id=user_id).all()
+    form.brand_ids.choices = [(a.brand_id, f"{a.brand.name} ({a.brand.company.name})") for a in assignments]
+    form.to_user_id.choices = [(u.id, f"{u.first_name} {u.last_name}") for u in 
+                               User.query.filter(User.is_active == True, User.id != user_id).order_by(User.last_name, User.first_name).all()]
+    
+    if form.validate_on_submit():
+        moved = reassign_brands(user_id, form.to_user_id.data, form.brand_ids.data)
+        db.session.commit()
+        flash(f'{moved} brand assignment{"s" if moved != 1 else ""} moved successfully!', 'success')
+        return redirect(url_for('team.member_detail', user_id=user_id))
+    
+    elif request.method == 'GET':
+        form.brand_ids.data = [a.brand_id for a in assignments]
+    
+    return render_template('team/reassign_brands.html', form=form, member=member)
@@ -0,0 +1,294 @@
+"""Full-text search over the contents of stored attachments.
+
+Plain text is pulled out of PDFs (with poppler's ``pdftotext``), Word and
+PowerPoint files (straight from their XML) and Excel workbooks (openpyxl) in
+a process pool of TEXT_INDEX_WORKERS per app worker, queued when the upload
+commits. The text goes into the SQLite FTS5 table ``attachment_text``, one
+row per blob, so a document attached to several records is extracted and
+indexed once; ``search_attachments`` maps the matching blobs back to the
+agreements and planning, meeting and invoice attachments that use them.
+
+``Blob.text_indexed_at`` marks blobs that have been processed, which makes
+``index_pending`` (run by ``index_attachments.py``) incremental: it only
+extracts blobs stored while no worker was running, or before this existed.
+"""
+import logging
+import re
+import shutil
+import subprocess
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from xml.etree import ElementTree
+from flask import current_app, url_for
+from markupsafe import Markup, escape
+from sqlalchemy import select, text, update
+from app import db
+from app.metrics import JOB_QUEUE_DEPTH
+from app.models import (Company, Brand, Blob, Agreement, PlanningInfo, PlanningAttachment, KeyMeeting,
+                        MeetingAttachment, Invoice, InvoiceAttachment)
+from app.process_pools import process_pool
+from app.storage import blob_file, on_blobs_stored
+
+PDF_TEXT = shutil.which('pdftotext')
+DOCX_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+XLSX_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+PPTX_TYPE = 'application/vnd.openxmlformats-officedocument.presentationml.presentation'
+# Keeps a pathological spreadsheet from bloating the index
+MAX_TEXT_CHARS = 1000000
+# Never part of a document's text, so they can mark matches inside snippets
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+logger = logging.getLogger(__name__)
+_index_ready = False
+
+
+def extractable_types():
+    types = [DOCX_TYPE, XLSX_TYPE, PPTX_TYPE]
+    if PDF_TEXT is not None:
+        types.append('application/pdf')
+    return types
+
+
+def can_extract(content_type):
+    return content_type in extractable_types()
+
+
+def _xml_text(data):
+    # Text runs are <w:t>/<a:t>; paragraphs (<w:p>/<a:p>) end a line
+    lines = []
+    current = []
+    for _, element in ElementTree.iterparse(data):
+        tag = element.tag.rsplit('}', 1)[-1]
+        if tag == 't' and element.text:
+            current.append(element.text)
+        elif tag == 'p' and current:
+            lines.append(''.join(current))
+            current = []
+        element.clear()
+    if current:
+        lines.append(''.join(current))
+    return '\n'.join(lines)
+
+
+def _ooxml_text(path, member_pattern):
+    with zipfile.ZipFile(path) as archive:
+        members = [name for name in archive.namelist() if re.fullmatch(member_pattern, name)]
+        # slide10.xml sorts after slide2.xml
+        members.sort(key=lambda name: [int(part) if part.isdigit() else part
+                                       for part in re.split(r'(\d+)', name)])
+        parts = []
+        for name in members:
+            with archive.open(name) as member:
+                parts.append(_xml_text(member))
+    return '\n'.join(parts)
+
+
+def _xlsx_text(path):
+    from openpyxl import load_workbook
+
+    # Opened as a file object: openpyxl rejects paths without an .xlsx extension
+    with open(path, 'rb') as f:
+        workbook = load_workbook(f, read_only=True, data_only=True)
+        try:
+            lines = []
+            for sheet in workbook.worksheets:
+                lines.append(sheet.title)
+                for row in sheet.iter_rows(values_only=True):
+                    values = [str(value) for value in row if value is not None]
+                    if values:
+                        lines.append(' '.join(values))
+            return '\n'.join(lines)
+        finally:
+            workbook.close()
+
+
+def extract_text(path, content_type):
+    """Return the plain text of a stored file. Runs in a pool process."""
+    if content_type == 'application/pdf':
+        result = subprocess.run([PDF_TEXT, '-q', '-enc', 'UTF-8', path, '-'],
+                                check=True, timeout=120, capture_output=True)
+        content = result.stdout.decode('utf-8', 'replace')
+    elif content_type == DOCX_TYPE:
+        content = _ooxml_text(path, r'word/(document|header\d*|footer\d*|footnotes)\.xml')
+    elif content_type == PPTX_TYPE:
+        content = _ooxml_text(path, r'ppt/(slides/slide|notesSlides/notesSlide)\d+\.xml')
+    else:
+        content = _xlsx_text(path)
+    return content[:MAX_TEXT_CHARS]
+
+
+def ensure_text_index():
+    """Create the FTS table unless it exists (the migration creates it too)."""
+    global _index_ready
+    if _index_ready:
+        return
+    db.session.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS attachment_text "
+        "USING fts5(sha256 UNINDEXED, body, tokenize='unicode61 remove_diacritics 2')"))
+    _index_ready = True
+
+
+def save_text(sha256, content):
+    """Replace a blob's indexed text and mark it as processed; ``None`` marks it without text."""
+    ensure_text_index()
+    db.session.execute(text('DELETE FROM attachment_text WHERE sha256 = :sha256'), {'sha256': sha256})
+    if content and content.strip():
+        db.session.execute(text('INSERT INTO attachment_text (sha256, body) VALUES (:sha256, :body)'),
+                           {'sha256': sha256, 'body': content})
+    db.session.execute(update(Blob).where(Blob.sha256 == sha256).values(text_indexed_at=datetime.utcnow()))
+
+
+def prune_text_index():
+    """Drop the text of blobs that no longer exist. Returns the number of rows removed."""
+    result = db.session.execute(text(
+        'DELETE FROM attachment_text WHERE sha256 NOT IN (SELECT sha256 FROM blobs)'))
+    return result.rowcount
+
+
+def _store_result(app, sha256, future):
+    JOB_QUEUE_DEPTH.labels(queue='text_index').dec()
+    if future.cancelled():
+        return  # Shutting down; index_pending picks it up later
+    error = future.exception()
+    with app.app_context():
+        try:
+            if error is not None:
+                logger.warning('Text extraction failed for %s: %r', sha256, error)
+            # A file that cannot be read is marked too, so it is not retried forever
+            save_text(sha256, None if error is not None else future.result())
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            logger.exception('Could not index the text of %s', sha256)
+
+
+def schedule_extraction(blobs):
+    """Queue text extraction for ``{sha256: content_type}``."""
+    app = current_app._get_current_object()
+    pending = {sha256: content_type for sha256, content_type in blobs.items() if can_extract(content_type)}
+    if not pending:
+        return
+    # Content uploaded again has been indexed already. Runs after commit, where
+    # the session cannot be used, hence the separate connection.
+    with db.engine.connect() as connection:
+        indexed = set(connection.scalars(
+            select(Blob.sha256).where(Blob.sha256.in_(pending), Blob.text_indexed_at.isnot(None))))
+    for sha256, content_type in pending.items():
+        if sha256 in indexed:
+            continue
+        JOB_QUEUE_DEPTH.labels(queue='text_index').inc()
+        future = process_pool('text_index', app.config['TEXT_INDEX_WORKERS']).submit(
+            extract_text, blob_file(sha256), content_type)
+        future.add_done_callback(lambda future, sha256=sha256: _store_result(app, sha256, future))
+
+
+def index_pending(processes, batch_size=100, progress=None):
+    """Extract every blob not processed yet in a pool of ``processes``.
+
+    Results are committed every ``batch_size`` files, so an interrupted run
+    carries on where it stopped. Returns ``(indexed, failed)``.
+    """
+    ensure_text_index()
+    db.session.commit()
+    pending = db.session.execute(
+        select(Blob.sha256, Blob.content_type)
+        .where(Blob.text_indexed_at.is_(None), Blob.content_type.in_(extractable_types()))).all()
+    indexed = failed = 0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(extract_text, blob_file(sha256), content_type): sha256
+                   for sha256, content_type in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            sha256 = futures[future]
+            if future.exception() is None:
+                save_text(sha256, future.result())
+                indexed += 1
+            else:
+                save_text(sha256, None)
+                failed += 1
+                if progress:
+                    progress(f'Failed {sha256}: {future.exception()}')
+            if done % batch_size == 0:
+                db.session.commit()
+    db.session.commit()
+    return indexed, failed
+
+
+def _match_query(query):
+    # Every word must appear, as a prefix; quoting keeps FTS syntax out of user input
+    words = re.findall(r'\w+', query)
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+def _snippet(value):
+    return Markup(str(escape(value)).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
+
+
+def search_attachments(query, limit=50):
+    """Attachments whose content matches ``query``, best matches first.
+
+    Returns dicts with ``kind``, ``filename``, ``file_path``, ``owner``,
+    ``url`` and an HTML ``snippet`` around the match.
+    """
+    match = _match_query(query)
+    if not match:
+        return []
+    ensure_text_index()
+    hits = db.session.execute(text(
+        f"SELECT sha256, snippet(attachment_text, 1, '{MATCH_START}', '{MATCH_END}', '...', 16) "
+        "FROM attachment_text WHERE attachment_text MATCH :match ORDER BY rank LIMIT :limit"),
+        {'match': match, 'limit': limit}).all()
+    if not hits:
+        return []
+    rank = {sha256: position for position, (sha256, _) in enumerate(hits)}
+    snippets = dict(hits)
+
+    results = []
+    agreements = db.session.execute(
+        select(Agreement.blob_sha256, Agreement.filename, Agreement.file_path, Agreement.type,
+               Company.id, Company.name)
+        .join(Agreement.company).where(Agreement.blob_sha256.in_(rank)))
+    for sha256, filename, file_path, agreement_type, company_id, company_name in agreements:
+        results.append((sha256, f'{agreement_type.title()} agreement', filename, file_path, company_name,
+                        url_for('clients.company_detail', company_id=company_id)))
+
+    planning = db.session.execute(
+        select(PlanningAttachment.blob_sha256, PlanningAttachment.filename, PlanningAttachment.file_path,
+               Brand.id, Brand.name)
+        .join(PlanningAttachment.planning_info).join(Brand, Brand.id == PlanningInfo.brand_id)
+        .where(PlanningAttachment.blob_sha256.in_(rank)))
+    for sha256, filename, file_path, brand_id, brand_name in planning:
+        results.append((sha256, 'Planning', filename, file_path, brand_name,
+                        url_for('clients.brand_detail', brand_id=brand_id)))
+
+    meetings = db.session.execute(
+        select(MeetingAttachment.blob_sha256, MeetingAttachment.filename, MeetingAttachment.file_path,
+               KeyMeeting.date, Brand.id, Brand.name)
+        .join(MeetingAttachment.meeting).join(Brand, Brand.id == KeyMeeting.brand_id)
+        .where(MeetingAttachment.blob_sha256.in_(rank)))
+    for sha256, filename, file_path, meeting_date, brand_id, brand_name in meetings:
+        results.append((sha256, f'Meeting {meeting_date:%Y-%m-%d}', filename, file_path, brand_name,
+                        url_for('clients.brand_detail', brand_id=brand_id)))
+
+    invoices = db.session.execute(
+        select(InvoiceAttachment.blob_sha256, InvoiceAttachment.filename, InvoiceAttachment.file_path,
+               Invoice.id, Invoice.invoice_date, Brand.id, Brand.name)
+        .join(InvoiceAttachment.invoice).join(Brand, Brand.id == Invoice.brand_id)
+        .where(InvoiceAttachment.blob_sha256.in_(rank)))
+    for sha256, filename, file_path, invoice_id, invoice_date, brand_id, brand_name in invoices:
+        results.append((sha256, f'Invoice #{invoice_id} ({invoice_date:%Y-%m-%d})', filename, file_path,
+                        brand_name, url_for('clients.invoices', brand_id=brand_id)))
+
+    results.sort(key=lambda row: rank[row[0]])
+    return [{'kind': kind, 'filename': filename, 'file_path': file_path, 'owner': owner, 'url': url,
+             'snippet': _snippet(snippets[sha256])}
+            for sha256, kind, filename, file_path, owner, url in results]
+
+
+def _blobs_stored(blobs):
+    if current_app.config['TEXT_INDEX_WORKERS'] > 0:
+        schedule_extraction(blobs)
+
+
+def init_app(app):
+    on_blobs_stored(_blobs_stored)
@@ -0,0 +1,234 @@
+"""Resumable chunked uploads.
+
+Files larger than UPLOAD_CHUNK_SIZE are sent by the browser ahead of the
+form: it creates an upload session, PUTs the file piece by piece with a
+``Content-Range`` header and, after a dropped connection, asks the session
+for its offset and carries on from there. Each piece is streamed from the
+request straight onto the end of ``<id>.part`` in UPLOAD_FOLDER/tmp/sessions,
+so neither the worker's memory nor MAX_CONTENT_LENGTH limit the file size.
+
+Pieces are hashed as they are written. The running digest of a session is
+kept by the worker that wrote its last piece; a worker that did not see the
+pieces before catches up by hashing only the bytes written since its own
+last piece. The cached digest is only replaced once a piece is on disk, so
+a piece that fails partway is hashed again from the file. The digest of the finished file is saved with the session, so
+adopting it into the blob store does not read the file again.
+
+The form then submits the session ids in ``upload_id`` fields and
+``form_uploads`` moves the finished files into the blob store alongside the
+regular multipart files. Sessions nobody finishes are removed by
+``clean_stale_uploads``.
+"""
+import hashlib
+import json
+import os
+import re
+import time
+import uuid
+from datetime import datetime
+from flask import current_app, request
+from flask_login import current_user
+from app.cache import TTLCache
+from app.instrumentation import io_timer
+from app.storage import CHUNK_SIZE, adopt_file, place_file, store_upload, upload_tmp_dir
+
+try:
+    import fcntl
+except ImportError:  # Windows development servers run a single process
+    fcntl = None
+
+UPLOAD_ID_PATTERN = re.compile(r'[0-9a-f]{32}')
+CONTENT_RANGE_PATTERN = re.compile(r'bytes (\d+)-(\d+)/(\d+)')
+# Running (offset, sha256) of the sessions this worker wrote pieces of
+DIGEST_TTL = 24 * 3600
+_digests = TTLCache('upload_digest', maxsize=256)
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400, offset=None):
+        super().__init__(message)
+        self.status = status
+        self.offset = offset
+
+
+def _session_dir():
+    path = os.path.join(upload_tmp_dir(), 'sessions')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def _session_paths(upload_id):
+    if not upload_id or not UPLOAD_ID_PATTERN.fullmatch(upload_id):
+        raise UploadError('Unknown upload', 404)
+    base = os.path.join(_session_dir(), upload_id)
+    return base + '.json', base + '.part'
+
+
+def create_session(filename, size, user_id):
+    """Start a resumable upload of ``size`` bytes and return its state."""
+    try:
+        size = int(size)
+    except (TypeError, ValueError):
+        raise UploadError('A file size is required')
+    if not filename:
+        raise UploadError('A file name is required')
+    if size <= 0 or size > current_app.config['MAX_UPLOAD_SIZE']:
+        raise UploadError('File is too large', 413)
+
+    upload_id = uuid.uuid4().hex
+    meta_path, part_path = _session_paths(upload_id)
+    meta = {'filename': filename, 'size': size, 'user_id': user_id,
+            'created_at': datetime.utcnow().isoformat()}
+    open(part_path, 'wb').close()
+    with open(meta_path, 'w') as f:
+        json.dump(meta, f)
+    return dict(meta, id=upload_id, offset=0)
+
+
+def _write_meta(upload_id, meta):
+    meta_path, _ = _session_paths(upload_id)
+    with open(meta_path + '.tmp', 'w') as f:
+        json.dump({key: value for key, value in meta.items() if key not in ('id', 'offset')}, f)
+    os.replace(meta_path + '.tmp', meta_path)
+
+
+def _running_digest(upload_id, part, offset):
+    """The sha256 of the first ``offset`` bytes of ``part``, reusing what this worker hashed before.
+
+    Returns a copy, so a piece that fails partway leaves the cached digest
+    at the offset it was cached for.
+    """
+    cached = _digests.get(upload_id)
+    if cached is not None and cached[0] <= offset:
+        done, digest = cached[0], cached[1].copy()
+    else:
+        done, digest = 0, hashlib.sha256()
+    if done < offset:
+        part.seek(done)
+        remaining = offset - done
+        while remaining:
+            chunk = part.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            digest.update(chunk)
+            remaining -= len(chunk)
+    return digest
+
+
+def load_session(upload_id, user_id):
+    """Return a session's state; the offset is simply the size of the part file."""
+    meta_path, part_path = _session_paths(upload_id)
+    try:
+        with open(meta_path) as f:
+            meta = json.load(f)
+        offset = os.path.getsize(part_path)
+    except FileNotFoundError:
+        raise UploadError('Unknown upload', 404)
+    if meta['user_id'] != user_id:
+        raise UploadError('Unknown upload', 404)
+    return dict(meta, id=upload_id, offset=offset)
+
+
+def append_chunk(upload_id, user_id, content_range, stream):
+    """Append the request body to an upload at the offset given by ``Content-Range``.
+
+    Returns the new offset. A chunk that does not start where the previous one
+    ended is rejected with 409 and the current offset, so the client can resume.
+    """
+    state = load_session(upload_id, user_id)
+    match = CONTENT_RANGE_PATTERN.fullmatch(content_range or '')
+    if not match:
+        raise UploadError('A Content-Range header is required')
+    start, end, total = (int(value) for value in match.groups())
+    if total != state['size'] or end < start or end >= total:
+        raise UploadError('Content-Range does not match the upload', 416, state['offset'])
+
+    _, part_path = _session_paths(upload_id)
+    with io_timer(), open(part_path, 'a+b') as part:
+        if fcntl is not None:
+            try:
+                fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadError('Another chunk is being written', 409, state['offset'])
+        offset = os.fstat(part.fileno()).st_size
+        if start != offset:
+            raise UploadError('Chunk does not start at the current offset', 409, offset)
+
+        digest = _running_digest(upload_id, part, offset)
+        remaining = end - start + 1
+        while remaining:
+            chunk = stream.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break  # Client went away; whatever arrived is kept for resuming
+            part.write(chunk)
+            digest.update(chunk)
+            remaining -= len(chunk)
+        part.flush()
+        os.fsync(part.fileno())
+        offset = os.fstat(part.fileno()).st_size
+        if offset == state['size']:
+            _digests.invalidate(upload_id)
+            _write_meta(upload_id, dict(state, sha256=digest.hexdigest()))
+        else:
+            _digests.set(upload_id, (offset, digest), DIGEST_TTL)
+        return offset
+
+
+def take_session(upload_id, user_id):
+    """Move a finished upload into the blob store and return ``(filename, Blob)``."""
+    state = load_session(upload_id, user_id)
+    if state['offset'] != state['size']:
+        raise UploadError('Upload is not complete', 409, state['offset'])
+    meta_path, part_path = _session_paths(upload_id)
+    with io_timer():
+        blob = adopt_file(part_path, state['filename'], state.get('sha256'))
+        place_file(part_path, blob.sha256)
+    os.remove(meta_path)
+    return state['filename'], blob
+
+
+def form_uploads(files, allowed):
+    """Store a form's files and its finished chunked uploads.
+
+    ``files`` is the data of a file field (a ``FileStorage`` or a list of
+    them); chunked uploads are named by the request's ``upload_id`` fields.
+    Files whose name fails ``allowed`` and unknown or unfinished uploads are
+    skipped. Returns a list of ``(original filename, Blob)``.
+    """
+    if not isinstance(files, (list, tuple)):
+        files = [files]
+    stored = []
+    for file in files:
+        if file and allowed(file.filename):
+            stored.append((file.filename, store_upload(file)))
+    for upload_id in request.form.getlist('upload_id'):
+        try:
+            if allowed(load_session(upload_id, current_user.id)['filename']):
+                stored.append(take_session(upload_id, current_user.id))
+        except UploadError:
+            continue
+    return stored
+
+
+def clean_stale_uploads(max_age_seconds):
+    """Delete upload sessions and temporary files untouched for ``max_age_seconds``.
+
+    Temporary files are normally removed when their request ends; this also
+    catches those left by a killed worker. Returns the number of files removed.
+    """
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for directory in (upload_tmp_dir(), _session_dir()):
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            # A session is active as long as its part file keeps growing
+            activity = [path, os.path.splitext(path)[0] + '.part']
+            try:
+                if not os.path.isfile(path):
+                    continue
+                if max(os.path.getmtime(p) for p in activity if os.path.exists(p)) < cutoff:
+                    os.remove(path)
+                    removed += 1
+            except (FileNotFoundError, ValueError):
+                pass  # Finished or removed meanwhile
+    return removed
@@ -0,0 +1,117 @@
+"""Workload of every team member, for capacity planning.
+
+A member's workload covers the brands they are assigned to (and how many
+of them they are key responsible for), the active recurring tasks on those
+brands that are due soon or overdue, the status updates and key meetings
+they logged recently, and the invoices raised on their brands in the last
+year. ``team_workload`` computes it for the whole team with one grouped
+query per figure, instead of walking ``User.team_assignments`` and its
+brands member by member.
+
+A task is due one period (month, quarter, half year or year) after its
+last completion, or after its start date if it was never completed
+(``task_due_date``, the rule the task board uses as well). It is overdue
+once that day has passed and open if it is overdue or due within
+``TASK_DUE_DAYS``.
+"""
+from collections import namedtuple, defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+from sqlalchemy import select, func, case
+from app import db
+from app.models import BrandTeam, BrandTask, TaskCompletion, StatusUpdate, KeyMeeting, Invoice, task_due_date
+
+TASK_DUE_DAYS = 30
+ACTIVITY_DAYS = (30, 90)
+INVOICE_DAYS = 365
+
+Workload = namedtuple('Workload', 'user_id brands key_responsible open_tasks overdue_tasks '
+                                  'status_updates_30 status_updates_90 meetings_30 meetings_90 '
+                                  'invoices invoiced')
+
+
+def _assignments(user_ids):
+    query = select(BrandTeam.team_member_id, BrandTeam.brand_id, BrandTeam.is_key_responsible)
+    if user_ids is not None:
+        query = query.where(BrandTeam.team_member_id.in_(user_ids))
+    brands = defaultdict(set)
+    key_responsible = defaultdict(int)
+    for user_id, brand_id, is_key in db.session.execute(query):
+        brands[user_id].add(brand_id)
+        key_responsible[user_id] += 1 if is_key else 0
+    return brands, key_responsible
+
+
+def task_status(brand_ids=None, today=None):
+    """Open and overdue active task counts per brand, as ``{brand_id: (open, overdue)}``."""
+    today = today or date.today()
+    query = (select(BrandTask.brand_id, BrandTask.frequency, BrandTask.start_date,
+                    func.max(TaskCompletion.completion_date))
+             .outerjoin(TaskCompletion, TaskCompletion.brand_task_id == BrandTask.id)
+             .where(BrandTask.is_active == True)
+             .group_by(BrandTask.id, BrandTask.brand_id, BrandTask.frequency, BrandTask.start_date))
+    if brand_ids is not None:
+        query = query.where(BrandTask.brand_id.in_(brand_ids))
+    horizon = today + timedelta(days=TASK_DUE_DAYS)
+    counts = defaultdict(lambda: [0, 0])
+    for brand_id, frequency, start_date, last_completion in db.session.execute(query):
+        due = task_due_date(frequency, start_date, last_completion)
+        if due <= horizon:
+            counts[brand_id][0] += 1
+        if due < today:
+            counts[brand_id][1] += 1
+    return {brand_id: tuple(pair) for brand_id, pair in counts.items()}
+
+
+def _activity(model, user_ids, today):
+    """Rows logged per user within each of ``ACTIVITY_DAYS``."""
+    since = [today - timedelta(days=days) for days in ACTIVITY_DAYS]
+    query = (select(model.created_by_id, *[func.sum(case((model.date >= start, 1), else_=0)) for start in since])
+             .where(model.date >= min(since), model.date <= today)
+             .group_by(model.created_by_id))
+    if user_ids is not None:
+        query = query.where(model.created_by_id.in_(user_ids))
+    return {user_id: tuple(count or 0 for count in counts) for user_id, *counts in db.session.execute(query)}
+
+
+def _invoices(user_ids, today):
+    query = (select(BrandTeam.team_member_id, func.count(Invoice.id), func.sum(Invoice.total_amount))
+             .join(Invoice, Invoice.brand_id == BrandTeam.brand_id)
+             .where(Invoice.invoice_date > today - timedelta(days=INVOICE_DAYS), Invoice.invoice_date <= today)
+             .group_by(BrandTeam.team_member_id))
+    if user_ids is not None:
+        query = query.where(BrandTeam.team_member_id.in_(user_ids))
+    # SQLite hands back floats for SUM over numerics
+    return {user_id: (count, Decimal(str(total or 0)).quantize(Decimal('0.01')))
+            for user_id, count, total in db.session.execute(query)}
+
+
+def team_workload(user_ids=None, today=None):
+    """``Workload`` by user id for ``user_ids`` (default everyone with any activity)."""
+    today = today or date.today()
+    user_ids = list(user_ids) if user_ids is not None else None
+    brands, key_responsible = _assignments(user_ids)
+    tasks = task_status(set().union(*brands.values()) if brands else set(), today)
+    updates = _activity(StatusUpdate, user_ids, today)
+    meetings = _activity(KeyMeeting, user_ids, today)
+    invoices = _invoices(user_ids, today)
+
+    everyone = set(user_ids) if user_ids is not None else set(brands) | set(updates) | set(meetings)
+    no_activity = (0,) * len(ACTIVITY_DAYS)
+    result = {}
+    for user_id in everyone:
+        member_brands = brands.get(user_id, set())
+        result[user_id] = Workload(
+            user_id,
+            len(member_brands),
+            key_responsible.get(user_id, 0),
+            sum(tasks.get(brand_id, (0, 0))[0] for brand_id in member_brands),
+            sum(tasks.get(brand_id, (0, 0))[1] for brand_id in member_brands),
+            *updates.get(user_id, no_activity),
+            *meetings.get(user_id, no_activity),
+            *invoices.get(user_id, (0, Decimal('0.00'))))
+    return result
+
+
+def workload(user_id, today=None):
+    return team_workload([user_id], today)[user_id]
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""Compare delete-and-reinsert team assignment with the diff-based service.
+
+Runs against a throwaway SQLite database, so it is safe to run anywhere:
+
+    python benchmark_team_assignment.py [brands] [members_per_brand] [rounds]
+
+Rows written counts every row inserted, updated or deleted, change log
+entries and counter updates included.
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+from sqlalchemy import event
+from config import Config
+from app import create_app, db
+from app.associations import assign_brand_team, reassign_brands
+from app.instrumentation import RequestTimings
+from app.models import User, Company, Brand, BrandTeam
+from flask import g
+
+BRANDS = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+MEMBERS = int(sys.argv[2]) if len(sys.argv) > 2 else 6
+ROUNDS = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+
+rows_written = 0
+
+def count_rows(conn, cursor, statement, parameters, context, executemany):
+    global rows_written
+    if statement.lstrip().split(None, 1)[0].upper() in ('INSERT', 'UPDATE', 'DELETE') and cursor.rowcount > 0:
+        rows_written += cursor.rowcount
+
+def old_assign(brand_id, member_ids, key_id):
+    BrandTeam.query.filter_by(brand_id=brand_id).delete()
+    for user_id in member_ids:
+        db.session.add(BrandTeam(brand_id=brand_id, team_member_id=user_id,
+                                 is_key_responsible=(user_id == key_id)))
+
+def reset(teams):
+    """Put every brand back on its starting team, untimed."""
+    for brand_id, members in teams.items():
+        assign_brand_team(brand_id, members, members[0])
+    db.session.commit()
+
+def measure(label, action):
+    global rows_written
+    g.request_timings = RequestTimings()
+    rows_written = 0
+    start = time.perf_counter()
+    result = action()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<22} {elapsed * 1000:9.1f} ms  {g.request_timings.sql_count:7d} statements  "
+          f"{rows_written:7d} rows written")
+    return result
+
+def run(label, assign, plans, initial):
+    def replay():
+        for brand_id, member_ids, key_id in plans:
+            assign(brand_id, member_ids, key_id)
+            db.session.commit()
+    reset(initial)
+    measure(label, replay)
+
+def reassign(from_user_id, to_user_id):
+    moved = reassign_brands(from_user_id, to_user_id)
+    db.session.commit()
+    return moved
+
+with tempfile.TemporaryDirectory() as tmpdir:
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(tmpdir, 'benchmark.db')
+        UPLOAD_FOLDER = os.path.join(tmpdir, 'uploads')
+
+    app = create_app(BenchmarkConfig)
+
+    with app.app_context():
+        db.create_all()
+        event.listen(db.engine, 'after_cursor_execute', count_rows)
+        users = [User(email=f'user{i}@example.com', first_name='User', last_name=str(i), role='other')
+                 for i in range(MEMBERS * 3)]
+        company = Company(name='Benchmark')
+        db.session.add_all(users + [company])
+        db.session.flush()
+        brands = [Brand(name=f'Brand {i}', company_id=company.id) for i in range(BRANDS)]
+        db.session.add_all(brands)
+        db.session.commit()
+        user_ids = [u.id for u in users]
+        brand_ids = [b.id for b in brands]
+
+        random.seed(1)
+        initial = {b: random.sample(user_ids, MEMBERS) for b in brand_ids}
+        current = dict(initial)
+
+        # Typical edit: one member swapped and the key person changed on every brand
+        rounds = []
+        for _ in range(ROUNDS):
+            plans = []
+            for brand_id in brand_ids:
+                members = list(current[brand_id])
+                members[random.randrange(MEMBERS)] = random.choice([u for u in user_ids if u not in members])
+                current[brand_id] = members
+                plans.append((brand_id, members, random.choice(members)))
+            rounds.append(plans)
+
+        print(f"{BRANDS} brands x {MEMBERS} members, {ROUNDS} rounds of edits")
+        # Both replay the same edits from the same starting teams
+        run('delete + reinsert', old_assign, [p for plans in rounds for p in plans], initial)
+        run('diff-based', assign_brand_team, [p for plans in rounds for p in plans], initial)
+
+        moved = measure('bulk reassign', lambda: reassign(user_ids[0], user_ids[-1]))
+        print(f"{'':<22} ({moved} brands moved)")
+        db.session.remove()
+        db.engine.dispose()
@@ -0,0 +1,24 @@
+#!/usr/bin/env python
+"""Merge old change log entries into one per row.
+
+    python compact_changes.py [--days DAYS]
+
+Run daily or weekly from cron. Entries older than DAYS (default
+CHANGE_LOG_RETENTION_DAYS) are merged into the latest state of each row, so
+consumers of /api/v1/changes further behind than that still converge, just
+without the intermediate versions.
+"""
+import sys
+from datetime import datetime, timedelta
+from app import create_app, db
+from app.changelog import compact
+
+app = create_app()
+
+with app.app_context():
+    days = app.config['CHANGE_LOG_RETENTION_DAYS']
+    if '--days' in sys.argv:
+        days = int(sys.argv[sys.argv.index('--days') + 1])
+    removed = compact(datetime.utcnow() - timedelta(days=days))
+    db.session.commit()
+    print(f"Merged away {removed} change log entries older than {days} days.")
@@ -12,6 +12,53 @@ class Config:
     UPLOAD_FOLDER = os.path.join(basedir, os.environ.get('UPLOAD_FOLDER', 'app/static/uploads'))
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
     ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'ppt', 'pptx', 'xls', 'xlsx', 'png', 'jpg', 'jpeg', 'gif'}
+    # Files larger than one chunk are uploaded in resumable UPLOAD_CHUNK_SIZE pieces,
+    # each of which must fit in MAX_CONTENT_LENGTH
+    UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', 1024 * 1024 * 1024))
+    # Let the front proxy send attachments: 'x-accel' (nginx), 'x-sendfile' (Apache) or '' for none
+    FILE_OFFLOAD = os.environ.get('FILE_OFFLOAD', '').lower()
+    # nginx internal location that maps to UPLOAD_FOLDER, used with x-accel
+    FILE_OFFLOAD_PREFIX = os.environ.get('FILE_OFFLOAD_PREFIX', '/protected-uploads/')
+    # Attachment previews are rendered in a pool of this many processes per worker
+    PREVIEW_WORKERS = int(os.environ.get('PREVIEW_WORKERS', 2))
+    PREVIEW_MAX_SIZE = int(os.environ.get('PREVIEW_MAX_SIZE', 400))
+    # Attachment text is extracted for search in a pool of this many processes per worker
+    TEXT_INDEX_WORKERS = int(os.environ.get('TEXT_INDEX_WORKERS', 1))
+    # Directory listings kept between storage_scan.py runs
+    STORAGE_SCAN_CHECKPOINT = os.path.join(basedir, os.environ.get('STORAGE_SCAN_CHECKPOINT',
+                                                                   'instance/storage_scan.json'))
+    
+    # Request instrumentation
+    SERVER_TIMING_ENABLED = os.environ.get('SERVER_TIMING_ENABLED', 'true').lower() == 'true'
+    SLOW_REQUEST_THRESHOLD_MS = int(os.environ.get('SLOW_REQUEST_THRESHOLD_MS', 1000))
+    SLOW_REQUEST_SQL_LIMIT = int(os.environ.get('SLOW_REQUEST_SQL_LIMIT', 5))
+    
+    # Seconds a loaded user is reused across requests (0 disables the cache)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL', 60))
+    
+    # Upper bound on how long aggregates cached per data version are kept
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL', 3600))
+    # Actual spend above planned budget by more than this fraction is flagged
+    MEDIA_OVERSPEND_TOLERANCE = float(os.environ.get('MEDIA_OVERSPEND_TOLERANCE', 0.05))
+    
+    # Rows per page of the JSON API (default and upper bound of ?limit=) and per bulk request
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 100))
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', 1000))
+    API_MAX_BATCH = int(os.environ.get('API_MAX_BATCH', 1000))
+    
+    # compact_changes.py merges change log entries older than this many days into one per row
+    CHANGE_LOG_RETENTION_DAYS = int(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 30))
+    
+    # Users with these roles can reach the /admin pages
+    ADMIN_ROLES = set(os.environ.get('ADMIN_ROLES', 'management').split(','))
+    
+    # Sampling profiler
+    PROFILE_DIR = os.path.join(basedir, os.environ.get('PROFILE_DIR', 'instance/profiles'))
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+    PROFILE_ENDPOINTS = set(filter(None, os.environ.get('PROFILE_ENDPOINTS', '').split(',')))
+    PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+    PROFILE_MAX_FILES = int(os.environ.get('PROFILE_MAX_FILES', 200))
     
     @staticmethod
     def init_app(app):
@@ -0,0 +1,33 @@
+#!/usr/bin/env python
+"""Render missing attachment previews, e.g. after migrating existing uploads.
+
+    python generate_previews.py [processes]
+"""
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from app import create_app, db
+from app.models import Blob
+from app.previews import can_preview, preview_file, render_preview
+from app.storage import blob_file
+
+app = create_app()
+
+with app.app_context():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else os.cpu_count()
+    max_size = app.config['PREVIEW_MAX_SIZE']
+    pending = [(sha256, content_type) for sha256, content_type
+               in db.session.query(Blob.sha256, Blob.content_type)
+               if can_preview(content_type) and not os.path.exists(preview_file(sha256))]
+    print(f"Rendering {len(pending)} previews with {processes} processes...")
+
+    failed = 0
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        futures = {pool.submit(render_preview, blob_file(sha256), preview_file(sha256), content_type, max_size): sha256
+                   for sha256, content_type in pending}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                failed += 1
+                print(f"  Failed {futures[future]}: {future.exception()}")
+
+    print(f"Done: {len(pending) - failed} rendered, {failed} failed.")
@@ -0,0 +1,19 @@
+import os
+import tempfile
+
+# Shared directory for prometheus_client's per-worker metric files. It must
+# be set before the app (and prometheus_client) is imported by the workers.
+multiproc_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR',
+                                      os.path.join(tempfile.gettempdir(), 'agency_crm_metrics'))
+
+
+def on_starting(server):
+    # Start every server run from a clean directory so stale worker files are not merged
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for name in os.listdir(multiproc_dir):
+        os.remove(os.path.join(multiproc_dir, name))
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+"""Extract the text of stored attachments that are not in the search index yet.
+
+    python index_attachments.py [processes] [--reindex]
+
+Uploads are normally indexed in the background as they are saved; this
+catches up on files stored before the index existed or while no worker was
+running. Only unprocessed files are read, so it is cheap to run from cron.
+``--reindex`` extracts every file again, e.g. after installing pdftotext.
+"""
+import os
+import sys
+from sqlalchemy import update
+from app import create_app, db
+from app.models import Blob
+from app.text_index import index_pending, prune_text_index
+
+args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+processes = int(args[0]) if args else os.cpu_count()
+
+app = create_app()
+
+with app.app_context():
+    if '--reindex' in sys.argv:
+        db.session.execute(update(Blob).values(text_indexed_at=None))
+        db.session.commit()
+
+    indexed, failed = index_pending(processes, progress=print)
+    pruned = prune_text_index()
+    db.session.commit()
+    print(f"Indexed {indexed} files ({failed} failed), dropped {pruned} entries of deleted files.")
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+"""Move existing uploads into the content-addressed blob store.
+
+Run ``flask db upgrade`` first. Every flat file referenced by an agreement or
+an attachment is hashed once and moved to UPLOAD_FOLDER/blobs; files whose
+content is already stored are deleted instead. The rows are repointed,
+reference counts are rebuilt and the space saved by deduplication is
+reported. Safe to run again: rows that already point at a blob are skipped.
+"""
+import os
+from sqlalchemy import select, update
+from app import create_app, db
+from app.models import Invoice
+from app.storage import ATTACHMENT_MODELS, adopt_file, place_file, recount_references
+
+app = create_app()
+
+with app.app_context():
+    inspector = db.inspect(db.engine)
+    if 'blobs' not in inspector.get_table_names():
+        raise SystemExit("The blobs table is missing - run 'flask db upgrade' first.")
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+
+    # One entry per distinct file, however many rows share it
+    pending = {}
+    for model in ATTACHMENT_MODELS:
+        rows = db.session.execute(select(model.file_path, model.filename)
+                                  .where(model.blob_sha256.is_(None))).all()
+        for file_path, filename in rows:
+            pending.setdefault(file_path, filename)
+
+    print(f"Found {len(pending)} files to move into the blob store...")
+
+    moved = 0
+    missing = 0
+    total_bytes = 0
+    stored = {}
+    for file_path, filename in pending.items():
+        full_path = os.path.join(upload_folder, file_path)
+        if not os.path.isfile(full_path):
+            print(f"  Missing on disk, left as is: {file_path}")
+            missing += 1
+            continue
+        total_bytes += os.path.getsize(full_path)
+        blob = adopt_file(full_path, filename)
+        stored[blob.sha256] = blob.size
+
+        for model in ATTACHMENT_MODELS:
+            db.session.execute(update(model.__table__)
+                               .where(model.__table__.c.file_path == file_path)
+                               .values(file_path=blob.path, blob_sha256=blob.sha256))
+        db.session.execute(update(Invoice.__table__)
+                           .where(Invoice.__table__.c.file_path == file_path)
+                           .values(file_path=blob.path))
+        # Move the file only once the rows point at the blob, one file at a time,
+        # so an interrupted run never leaves a row without its file
+        db.session.commit()
+        place_file(full_path, blob.sha256)
+        moved += 1
+
+    recount_references()
+    db.session.commit()
+
+    saved = total_bytes - sum(stored.values())
+    print(f"Moved {moved} files into {len(stored)} blobs ({missing} missing).")
+    print(f"Deduplication saved {saved / 1024 / 1024:.1f} MB.")
@@ -0,0 +1,45 @@
+"""Add content-addressed blob store for attachments
+
+Revision ID: 3f6c2b9e41a7
+Revises: d9d7481d1870
+Create Date: 2026-10-19 10:12:04.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6c2b9e41a7'
+down_revision = 'd9d7481d1870'
+branch_labels = None
+depends_on = None
+
+ATTACHMENT_TABLES = ('agreements', 'planning_attachments', 'meeting_attachments', 'invoice_attachments')
+
+
+def upgrade():
+    op.create_table('blobs',
+    sa.Column('sha256', sa.String(length=64), nullable=False),
+    sa.Column('size', sa.BigInteger(), nullable=False),
+    sa.Column('content_type', sa.String(length=100), nullable=True),
+    sa.Column('ref_count', sa.Integer(), nullable=False, server_default='0'),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('sha256')
+    )
+
+    for table in ATTACHMENT_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('blob_sha256', sa.String(length=64), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_{table}_blob_sha256'), ['blob_sha256'], unique=False)
+            batch_op.create_foreign_key(f'fk_{table}_blob_sha256', 'blobs', ['blob_sha256'], ['sha256'])
+
+
+def downgrade():
+    for table in ATTACHMENT_TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_constraint(f'fk_{table}_blob_sha256', type_='foreignkey')
+            batch_op.drop_index(batch_op.f(f'ix_{table}_blob_sha256'))
+            batch_op.drop_column('blob_sha256')
+
+    op.drop_table('blobs')
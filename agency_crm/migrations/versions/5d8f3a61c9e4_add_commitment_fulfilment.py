@@ -0,0 +1,46 @@
+"""Add media group mappings and commitment spend aggregates
+
+Revision ID: 5d8f3a61c9e4
+Revises: c47a9e0d2b15
+Create Date: 2026-10-19 17:24:05.913662
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d8f3a61c9e4'
+down_revision = 'c47a9e0d2b15'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('media_group_mappings',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('media_group_id', sa.Integer(), nullable=False),
+    sa.Column('field', sa.String(length=20), nullable=False),
+    sa.Column('value', sa.String(length=200), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['media_group_id'], ['media_groups.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('field', 'value')
+    )
+    # Filled as soon as the first mapping is added
+    op.create_table('commitment_spend',
+    sa.Column('company_id', sa.Integer(), nullable=False),
+    sa.Column('media_group_id', sa.Integer(), nullable=False),
+    sa.Column('year', sa.Integer(), nullable=False),
+    sa.Column('actual_spend', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('open_budget', sa.Numeric(precision=14, scale=2), nullable=False),
+    sa.Column('plans', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['company_id'], ['companies.id'], ),
+    sa.ForeignKeyConstraint(['media_group_id'], ['media_groups.id'], ),
+    sa.PrimaryKeyConstraint('company_id', 'media_group_id', 'year')
+    )
+
+
+def downgrade():
+    op.drop_table('commitment_spend')
+    op.drop_table('media_group_mappings')
@@ -0,0 +1,28 @@
+"""Make media group mapping values unique case-insensitively
+
+Revision ID: 7c2e4b9d1a06
+Revises: b6e09c3d5f71
+Create Date: 2026-10-19 23:12:40.518734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e4b9d1a06'
+down_revision = 'b6e09c3d5f71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Mappings differing only in case matched the same plans; keep the oldest
+    op.execute('DELETE FROM media_group_mappings WHERE id NOT IN '
+               '(SELECT MIN(id) FROM media_group_mappings GROUP BY field, lower(value))')
+    op.create_index('ix_media_group_mappings_field_lower_value', 'media_group_mappings',
+                    ['field', sa.text('lower(value)')], unique=True)
+
+
+def downgrade():
+    op.drop_index('ix_media_group_mappings_field_lower_value', table_name='media_group_mappings')
@@ -0,0 +1,33 @@
+"""Add full-text index of attachment contents
+
+Revision ID: 8b1e5d2c7f30
+Revises: 3f6c2b9e41a7
+Create Date: 2026-10-19 14:36:51.402117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8b1e5d2c7f30'
+down_revision = '3f6c2b9e41a7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('blobs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('text_indexed_at', sa.DateTime(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_blobs_text_indexed_at'), ['text_indexed_at'], unique=False)
+
+    op.execute("CREATE VIRTUAL TABLE IF NOT EXISTS attachment_text "
+               "USING fts5(sha256 UNINDEXED, body, tokenize='unicode61 remove_diacritics 2')")
+
+
+def downgrade():
+    op.execute('DROP TABLE IF EXISTS attachment_text')
+
+    with op.batch_alter_table('blobs', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_blobs_text_indexed_at'))
+        batch_op.drop_column('text_indexed_at')
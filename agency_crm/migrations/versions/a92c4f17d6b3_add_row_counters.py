@@ -0,0 +1,53 @@
+"""Add denormalized counters to companies and brands
+
+Revision ID: a92c4f17d6b3
+Revises: 5d8f3a61c9e4
+Create Date: 2026-10-19 18:02:37.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a92c4f17d6b3'
+down_revision = '5d8f3a61c9e4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('companies', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('brand_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('subcompany_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('invoice_count', sa.Integer(), server_default='0', nullable=False))
+
+    with op.batch_alter_table('brands', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('contact_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('team_member_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('active_task_count', sa.Integer(), server_default='0', nullable=False))
+        batch_op.add_column(sa.Column('invoice_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.execute("UPDATE companies SET "
+               "brand_count = (SELECT count(*) FROM brands WHERE brands.company_id = companies.id), "
+               "subcompany_count = (SELECT count(*) FROM companies AS sub WHERE sub.parent_company_id = companies.id), "
+               "invoice_count = (SELECT count(*) FROM invoices WHERE invoices.company_id = companies.id)")
+    op.execute("UPDATE brands SET "
+               "contact_count = (SELECT count(*) FROM brand_contacts WHERE brand_contacts.brand_id = brands.id), "
+               "team_member_count = (SELECT count(*) FROM brand_teams WHERE brand_teams.brand_id = brands.id), "
+               "active_task_count = (SELECT count(*) FROM brand_tasks "
+               "WHERE brand_tasks.brand_id = brands.id AND brand_tasks.is_active = 1), "
+               "invoice_count = (SELECT count(*) FROM invoices WHERE invoices.brand_id = brands.id)")
+
+
+def downgrade():
+    with op.batch_alter_table('brands', schema=None) as batch_op:
+        batch_op.drop_column('invoice_count')
+        batch_op.drop_column('active_task_count')
+        batch_op.drop_column('team_member_count')
+        batch_op.drop_column('contact_count')
+
+    with op.batch_alter_table('companies', schema=None) as batch_op:
+        batch_op.drop_column('invoice_count')
+        batch_op.drop_column('subcompany_count')
+        batch_op.drop_column('brand_count')
@@ -0,0 +1,40 @@
+"""Add change log for incremental sync
+
+Revision ID: b6e09c3d5f71
+Revises: f58d2a90c3e6
+Create Date: 2026-10-19 21:04:17.385920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e09c3d5f71'
+down_revision = 'f58d2a90c3e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('change_log',
+    sa.Column('seq', sa.Integer(), nullable=False),
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('row_key', sa.String(length=100), nullable=False),
+    sa.Column('op', sa.String(length=6), nullable=False),
+    sa.Column('data', sa.Text(), nullable=True),
+    sa.Column('recorded_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('seq'),
+    sqlite_autoincrement=True
+    )
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_change_log_recorded_at'), ['recorded_at'], unique=False)
+        batch_op.create_index('ix_change_log_table_name_row_key', ['table_name', 'row_key'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('change_log', schema=None) as batch_op:
+        batch_op.drop_index('ix_change_log_table_name_row_key')
+        batch_op.drop_index(batch_op.f('ix_change_log_recorded_at'))
+
+    op.drop_table('change_log')
@@ -0,0 +1,29 @@
+"""Add data version counters for cached aggregates
+
+Revision ID: c47a9e0d2b15
+Revises: 8b1e5d2c7f30
+Create Date: 2026-10-19 16:02:27.538410
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c47a9e0d2b15'
+down_revision = '8b1e5d2c7f30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('data_versions',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade():
+    op.drop_table('data_versions')
@@ -0,0 +1,26 @@
+"""Index invoice dates for revenue reporting
+
+Revision ID: e31b7c05a8d2
+Revises: a92c4f17d6b3
+Create Date: 2026-10-19 18:41:12.207395
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e31b7c05a8d2'
+down_revision = 'a92c4f17d6b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('invoices', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_invoices_invoice_date'), ['invoice_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('invoices', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_invoices_invoice_date'))
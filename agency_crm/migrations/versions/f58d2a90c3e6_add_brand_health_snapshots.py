@@ -0,0 +1,42 @@
+"""Add daily brand health snapshots
+
+Revision ID: f58d2a90c3e6
+Revises: e31b7c05a8d2
+Create Date: 2026-10-19 19:12:48.631052
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f58d2a90c3e6'
+down_revision = 'e31b7c05a8d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('brand_health_snapshots',
+    sa.Column('snapshot_date', sa.Date(), nullable=False),
+    sa.Column('brand_id', sa.Integer(), nullable=False),
+    sa.Column('company_id', sa.Integer(), nullable=False),
+    sa.Column('evaluation', sa.String(length=20), nullable=True),
+    sa.Column('days_since_update', sa.Integer(), nullable=True),
+    sa.Column('update_overdue', sa.Boolean(), nullable=False),
+    sa.Column('days_since_meeting', sa.Integer(), nullable=True),
+    sa.Column('meeting_overdue', sa.Boolean(), nullable=False),
+    sa.Column('has_service_agreement', sa.Boolean(), nullable=False),
+    sa.Column('has_data_agreement', sa.Boolean(), nullable=False),
+    sa.Column('has_key_responsible', sa.Boolean(), nullable=False),
+    sa.PrimaryKeyConstraint('snapshot_date', 'brand_id')
+    )
+    with op.batch_alter_table('brand_health_snapshots', schema=None) as batch_op:
+        batch_op.create_index('ix_brand_health_snapshots_brand_id_date', ['brand_id', 'snapshot_date'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('brand_health_snapshots', schema=None) as batch_op:
+        batch_op.drop_index('ix_brand_health_snapshots_brand_id_date')
+
+    op.drop_table('brand_health_snapshots')
@@ -0,0 +1,23 @@
+#!/usr/bin/env python
+"""Recount the denormalized brand, contact, team, task and invoice counters.
+
+    python reconcile_counters.py [--check]
+
+The counters are kept current on every change made through the app; run
+this after bulk imports or manual SQL. ``--check`` only reports how many
+companies and brands are off.
+"""
+import sys
+from app import create_app, db
+from app.counters import refresh_counters, counter_drift
+
+app = create_app()
+
+with app.app_context():
+    companies, brands = counter_drift()
+    print(f"{len(companies)} companies and {len(brands)} brands have wrong counters.")
+
+    if '--check' not in sys.argv and (companies or brands):
+        refresh_counters(company_ids=None, brand_ids=None)
+        db.session.commit()
+        print("Counters rebuilt.")
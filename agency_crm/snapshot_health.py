@@ -0,0 +1,30 @@
+#!/usr/bin/env python
+"""Store today's brand health metrics for trend reporting.
+
+    python snapshot_health.py [YYYY-MM-DD] [--backfill DAYS]
+
+Run nightly from cron. Snapshots are upserted per brand and day, so running
+it again (or over days already stored) is harmless. ``--backfill`` also
+stores the DAYS days before the given date, reconstructed from the dated
+status updates, meetings and agreements.
+"""
+import sys
+from datetime import date, datetime, timedelta
+from app import create_app, db
+from app.health_snapshots import take_snapshot
+
+args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+backfill = 0
+if '--backfill' in sys.argv:
+    backfill = int(sys.argv[sys.argv.index('--backfill') + 1])
+    args.remove(str(backfill))
+as_of = datetime.strptime(args[0], '%Y-%m-%d').date() if args else date.today()
+
+app = create_app()
+
+with app.app_context():
+    for offset in range(backfill, -1, -1):
+        day = as_of - timedelta(days=offset)
+        brands = take_snapshot(day)
+        db.session.commit()
+        print(f"{day}: stored the health of {brands} brands.")
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+"""Remove stored attachment files that nothing references any more.
+
+    python storage_gc.py [grace_hours] [--recount]
+
+Blobs younger than grace_hours (default 24) are kept so uploads still in
+flight are never collected; abandoned chunked uploads and temporary files
+idle for that long are removed. ``--recount`` first rebuilds the reference
+counts from the attachment tables. Suitable for a nightly cron job.
+"""
+import sys
+from datetime import timedelta
+from app import create_app, db
+from app.storage import collect_garbage, recount_references
+from app.text_index import prune_text_index
+from app.uploads import clean_stale_uploads
+
+args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+grace_hours = int(args[0]) if args else 24
+
+app = create_app()
+
+with app.app_context():
+    if '--recount' in sys.argv:
+        recount_references()
+        db.session.commit()
+        print("Reference counts rebuilt.")
+
+    removed, freed = collect_garbage(timedelta(hours=grace_hours))
+    print(f"Removed {removed} unreferenced blobs, freed {freed / 1024 / 1024:.1f} MB.")
+
+    pruned = prune_text_index()
+    db.session.commit()
+    print(f"Dropped {pruned} search index entries of removed blobs.")
+
+    stale = clean_stale_uploads(grace_hours * 3600)
+    print(f"Removed {stale} abandoned upload files.")
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+"""Report storage usage per company and find files nothing refers to.
+
+    python storage_scan.py [--delete] [--full] [--grace HOURS] [--workers N]
+
+UPLOAD_FOLDER is listed in parallel and compared with every file_path column.
+Directories unchanged since the previous run are taken from the scan
+checkpoint (STORAGE_SCAN_CHECKPOINT); ``--full`` lists everything again.
+Orphans are only reported unless ``--delete`` is given; files younger than
+the grace period (default 24 hours) are never considered orphans.
+"""
+import sys
+from app import create_app
+from app.storage_scan import scan_uploads, storage_report, delete_orphans
+
+
+def option(name, default):
+    if name in sys.argv:
+        return int(sys.argv[sys.argv.index(name) + 1])
+    return default
+
+
+grace_hours = option('--grace', 24)
+workers = option('--workers', 8)
+
+app = create_app()
+
+with app.app_context():
+    files, stats = scan_uploads(workers=workers, full='--full' in sys.argv)
+    print(f"Scanned {stats['directories']} directories ({stats['reused']} unchanged) "
+          f"in {stats['seconds']:.1f}s.")
+
+    report = storage_report(files, grace_hours * 3600)
+    print(f"{report['files']} files, {report['bytes'] / 1024 / 1024:.1f} MB in total.")
+
+    print("\nUsage per company (shared files count for each company):")
+    for name, count, size in report['companies']:
+        print(f"  {name:<40} {count:>7} files {size / 1024 / 1024:>10.1f} MB")
+
+    if report['missing']:
+        print(f"\n{len(report['missing'])} referenced files are missing on disk:")
+        for path in report['missing']:
+            print(f"  {path}")
+
+    orphans = report['orphans']
+    orphan_bytes = sum(size for _, size in orphans)
+    print(f"\n{len(orphans)} orphaned files, {orphan_bytes / 1024 / 1024:.1f} MB:")
+    for path, size in orphans:
+        print(f"  {path} ({size / 1024:.0f} KB)")
+
+    if orphans and '--delete' in sys.argv:
+        removed, freed = delete_orphans(orphans)
+        print(f"\nDeleted {removed} orphaned files, freed {freed / 1024 / 1024:.1f} MB.")
+    elif orphans:
+        print("\nRun again with --delete to remove them.")